@@ -0,0 +1,76 @@
+"""
+Caches of built RPMs, shared between build hosts, by the key of the spec and
+sources they were built from (see :func:`conda_rpms.build.artifact_key`).
+
+A cache has two methods, which :func:`conda_rpms.build.build_new` uses:
+
+ * ``fetch(key, rpm_names, directory)`` puts the cached RPMs of the key into
+   the directory, returning whether it had them all.
+ * ``publish(key, rpm_paths)`` caches the given (freshly built) RPMs.
+
+"""
+import os
+import shutil
+import uuid
+
+
+def _link_or_copy(source, destination):
+    """
+    Hard link the source to the destination (replacing it), or copy it if
+    they are on different filesystems.
+    """
+    tmp = '{}.{}.tmp'.format(destination, uuid.uuid4().hex)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.rename(tmp, destination)
+
+
+class DirectoryCache(object):
+    """
+    A cache in a (local or NFS mounted) directory, holding the RPMs of each
+    key in the directory <key[:2]>/<key>.
+
+    The RPMs of a key are published to a temporary directory which is then
+    renamed into place, so the RPMs of a key are either all there or not
+    there at all, even with several hosts publishing at once.
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, rpm_names, directory):
+        key_dir = self.path(key)
+        if not all(os.path.isfile(os.path.join(key_dir, rpm_name))
+                   for rpm_name in rpm_names):
+            return False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for rpm_name in rpm_names:
+            _link_or_copy(os.path.join(key_dir, rpm_name),
+                          os.path.join(directory, rpm_name))
+        return True
+
+    def publish(self, key, rpm_paths):
+        key_dir = self.path(key)
+        if os.path.isdir(key_dir):
+            return
+        tmp = '{}.{}.tmp'.format(key_dir, uuid.uuid4().hex)
+        os.makedirs(tmp)
+        try:
+            for rpm_path in rpm_paths:
+                shutil.copy2(rpm_path,
+                             os.path.join(tmp, os.path.basename(rpm_path)))
+            try:
+                os.rename(tmp, key_dir)
+            except OSError:
+                # Another host has published the same key first.
+                if not os.path.isdir(key_dir):
+                    raise
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
@@ -0,0 +1,8 @@
+"""
+Offline benchmarks of conda-rpms, run with ``python -m conda_rpms.benchmarks``.
+
+The benchmarks operate on synthetic distributions, channels and conda-gitenv
+repositories (see :mod:`conda_rpms.benchmarks.synthetic`), and their results
+can be saved as JSON and compared against a previously saved baseline.
+
+"""
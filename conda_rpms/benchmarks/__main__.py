@@ -0,0 +1,5 @@
+from conda_rpms.benchmarks.suite import main
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,510 @@
+"""
+The conda-rpms benchmark suite.
+
+Each benchmark times one stage of turning a gitenv into RPMs, or of
+installing them, against synthetic inputs.  Benchmarks which need a
+dependency that isn't installed (e.g. conda or conda-gitenv) are reported
+as skipped.
+
+"""
+from __future__ import print_function
+
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+import conda_rpms
+from conda_rpms.benchmarks import synthetic
+import conda_rpms.install as conda_install
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+#: The registered benchmarks, in the order in which they are run.
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register the decorated function as a benchmark."""
+    BENCHMARKS.append(func)
+    return func
+
+
+def timed(func, setup=None, repeat=3):
+    """
+    Time func over `repeat` runs, calling setup (if given) before each run
+    to produce the arguments of func.
+
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = default_timer()
+        func(*args)
+        times.append(default_timer() - start)
+    return {'repeat': repeat, 'min': min(times),
+            'mean': sum(times) / len(times), 'times': times}
+
+
+class Workspace(object):
+    """
+    The synthetic inputs shared by the benchmarks, generated lazily within
+    a working directory.
+
+    """
+    def __init__(self, directory, params):
+        self.directory = directory
+        self.params = params
+        self.config = {'rpm': {'prefix': 'Bench'},
+                       'install': {'prefix': '/opt/bench'}}
+        self._channel = None
+        self._pkgs_dir = None
+        self._gitenv = None
+        self._count = 0
+
+    def fresh_dir(self, name):
+        """Return the path to a new, empty directory."""
+        self._count += 1
+        path = os.path.join(self.directory,
+                            '{}-{}'.format(name, self._count))
+        os.makedirs(path)
+        return path
+
+    @property
+    def channel(self):
+        """The URL and distributions of the synthetic channel."""
+        if self._channel is None:
+            self._channel = synthetic.make_channel(
+                os.path.join(self.directory, 'channel'),
+                n_dists=self.params['dists'],
+                n_files=self.params['files'],
+                file_size=self.params['file_size'],
+                n_text_prefix=self.params['prefix_files'],
+                n_binary_prefix=self.params['prefix_files'])
+        return self._channel
+
+    def tarball(self, dist):
+        return os.path.join(self.directory, 'channel', 'linux-64',
+                            dist + '.tar.bz2')
+
+    @property
+    def pkgs_dir(self):
+        """A package cache containing all of the extracted distributions."""
+        if self._pkgs_dir is None:
+            pkgs_dir = os.path.join(self.directory, 'pkgs')
+            os.makedirs(pkgs_dir)
+            for dist in self.channel[1]:
+                shutil.copy(self.tarball(dist), pkgs_dir)
+            conda_install.extract_all(pkgs_dir)
+            self._pkgs_dir = pkgs_dir
+        return self._pkgs_dir
+
+    @property
+    def gitenv(self):
+        """The path to the synthetic conda-gitenv repository."""
+        if self._gitenv is None:
+            url, dists = self.channel
+            repo_dir = os.path.join(self.directory, 'gitenv')
+            synthetic.make_gitenv(repo_dir, url, dists,
+                                  n_envs=self.params['envs'],
+                                  n_tags=self.params['tags'])
+            self._gitenv = repo_dir
+        return self._gitenv
+
+
+@benchmark
+def render_dist_spec(ws):
+    import conda_rpms.generate as generate
+
+    tarballs = [ws.tarball(dist) for dist in ws.channel[1]]
+
+    def render():
+        for tarball in tarballs:
+            generate.render_dist_spec(tarball, ws.config)
+    return timed(render, setup=_clear_dist_info_cache,
+                 repeat=ws.params['repeat'])
+
+
+def _clear_dist_info_cache():
+    # Each run reads the tarballs, as a run of build_rpm_structure does.
+    import conda_rpms.generate as generate
+    generate.clear_dist_info_cache()
+    return ()
+
+
+@benchmark
+def render_many(ws):
+    import conda_rpms.generate as generate
+
+    tarballs = [ws.tarball(dist) for dist in ws.channel[1]]
+    results = {}
+    for processes in [1, None]:
+        def render():
+            for _ in generate.render_many(tarballs, ws.config,
+                                          processes=processes):
+                pass
+        result = timed(render, setup=_clear_dist_info_cache,
+                       repeat=ws.params['repeat'])
+        result['specs_per_second'] = len(tarballs) / result['min']
+        results['serial' if processes == 1 else 'parallel'] = result
+    return results
+
+
+@benchmark
+def create_rpmbuild_content(ws):
+    try:
+        from conda_gitenv.resolve import create_tracking_branches
+        from git import Repo
+        from conda_rpms.build_rpm_structure import (
+            create_rpmbuild_content as create)
+    except ImportError as e:
+        raise SkipBenchmark(str(e))
+
+    def setup():
+        repo = Repo.clone_from(ws.gitenv, ws.fresh_dir('clone'))
+        create_tracking_branches(repo)
+        return repo, ws.fresh_dir('rpmbuild')
+    return timed(lambda repo, target: create(repo, target, ws.config),
+                 setup=setup, repeat=ws.params['repeat'])
+
+
+@contextlib.contextmanager
+def stub_rpmbuild(directory):
+    """Put an rpmbuild which does nothing at the front of PATH."""
+    bin_dir = os.path.join(directory, 'bin')
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+        script = os.path.join(bin_dir, 'rpmbuild')
+        with open(script, 'w') as fh:
+            fh.write('#!/bin/sh\nexit 0\n')
+        os.chmod(script, 0o755)
+    path = os.environ.get('PATH', '')
+    os.environ['PATH'] = bin_dir + os.pathsep + path
+    try:
+        yield
+    finally:
+        os.environ['PATH'] = path
+
+
+@benchmark
+def build_new(ws):
+    import conda_rpms.build as build
+    import conda_rpms.generate as generate
+
+    rpmbuild_dir = os.path.join(ws.directory, 'rpmbuild')
+    spec_dir = os.path.join(rpmbuild_dir, 'SPECS')
+    os.makedirs(spec_dir)
+    for dist in ws.channel[1]:
+        spec = generate.render_dist_spec(ws.tarball(dist), ws.config)
+        with open(os.path.join(spec_dir, dist + '.spec'), 'w') as fh:
+            fh.write(spec)
+    rpm_dir = ws.fresh_dir('RPMS')
+    with stub_rpmbuild(ws.directory):
+        return timed(lambda: build.build_new(rpmbuild_dir, rpm_dir),
+                     repeat=ws.params['repeat'])
+
+
+def find_executable(name):
+    """Return the path of the named executable on PATH, or None."""
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+#: The rpm payload compressions compared by the payload_compression benchmark.
+PAYLOADS = ['w0.ufdio', 'w1.gzdio', 'w9.gzdio', 'w2.xzdio', 'w9.xzdio']
+
+
+@benchmark
+def payload_compression(ws):
+    """
+    Build the package RPM of a distribution with each of the PAYLOADS, timing
+    the build and the unpacking of the RPM (the bulk of installing it).
+
+    """
+    import glob
+    import conda_rpms.build as build
+    import conda_rpms.generate as generate
+
+    for tool in ['rpmbuild', 'rpm2cpio', 'cpio']:
+        if find_executable(tool) is None:
+            raise SkipBenchmark('{} is not installed'.format(tool))
+    tarball = ws.tarball(ws.channel[1][0])
+    results = {}
+    for payload in PAYLOADS:
+        config = {'rpm': dict(ws.config['rpm'],
+                              payload={'small': payload, 'large': payload}),
+                  'install': ws.config['install']}
+        spec = generate.render_dist_spec(tarball, config)
+
+        def setup():
+            rpmbuild_dir = ws.fresh_dir('payload')
+            for name in ['SOURCES', 'SPECS']:
+                os.makedirs(os.path.join(rpmbuild_dir, name))
+            shutil.copy(tarball, os.path.join(rpmbuild_dir, 'SOURCES'))
+            spec_path = os.path.join(rpmbuild_dir, 'SPECS', 'pkg.spec')
+            with open(spec_path, 'w') as fh:
+                fh.write(spec)
+            return spec_path, rpmbuild_dir
+
+        rpms = []
+
+        def rpmbuild(spec_path, rpmbuild_dir):
+            log_path = os.path.join(rpmbuild_dir, 'rpmbuild.log')
+            if build.rpmbuild(spec_path, rpmbuild_dir, log_path) != 0:
+                raise RuntimeError('rpmbuild failed, see {}'.format(log_path))
+            rpms.extend(glob.glob(os.path.join(rpmbuild_dir, 'RPMS', '*',
+                                               '*.rpm')))
+        build_result = timed(rpmbuild, setup=setup, repeat=ws.params['repeat'])
+        build_result['rpm_size'] = os.path.getsize(rpms[-1])
+
+        def unpack(directory):
+            subprocess.check_call('rpm2cpio "{}" | cpio -idm --quiet'
+                                  ''.format(rpms[-1]), shell=True,
+                                  cwd=directory)
+        install_result = timed(unpack,
+                               setup=lambda: (ws.fresh_dir('unpack'),),
+                               repeat=ws.params['repeat'])
+        results[payload] = {'build': build_result, 'install': install_result}
+    return results
+
+
+#: The prefix the benchmark environments pretend to be installed in, which
+#: (unlike the temporary directories they are really linked into) is short
+#: enough to fit in place of the prefix placeholder of binary files.
+target_prefix = '/opt/bench/environments/env/tag'
+
+
+def _link_all(pkgs_dir, prefix, dists):
+    for dist in dists:
+        conda_install.link(pkgs_dir, prefix, dist,
+                           target_prefix=target_prefix)
+
+
+@benchmark
+def link(ws):
+    pkgs_dir, dists = ws.pkgs_dir, ws.channel[1]
+    return timed(lambda prefix: _link_all(pkgs_dir, prefix, dists),
+                 setup=lambda: (ws.fresh_dir('link'),),
+                 repeat=ws.params['repeat'])
+
+
+def _prefixed_file(ws, mode):
+    """Return a fresh copy of a large file which needs prefix replacement."""
+    path = os.path.join(ws.fresh_dir('update_prefix'), 'prefixed')
+    placeholder = conda_install.prefix_placeholder.encode('utf-8')
+    if mode == 'text':
+        chunk = b'#!' + placeholder + b'/bin/python\n' + b'x' * 200 + b'\n'
+    else:
+        chunk = placeholder + b'/lib\0' + b'\0' * 200
+    with open(path, 'wb') as fh:
+        fh.write(chunk * (ws.params['file_size'] * ws.params['files'] //
+                          len(chunk) + 1))
+    return path
+
+
+@benchmark
+def update_prefix(ws):
+    results = {}
+    for mode in ['text', 'binary']:
+        results[mode] = timed(
+            lambda path: conda_install.update_prefix(path, target_prefix,
+                                                     mode=mode),
+            setup=lambda: (_prefixed_file(ws, mode),),
+            repeat=ws.params['repeat'])
+    return results
+
+
+@benchmark
+def unlink(ws):
+    pkgs_dir, dists = ws.pkgs_dir, ws.channel[1]
+
+    def setup():
+        prefix = os.path.join(ws.fresh_dir('unlink'), 'env')
+        _link_all(pkgs_dir, prefix, dists)
+        return (prefix, )
+
+    def unlink_all(prefix):
+        for dist in dists:
+            conda_install.unlink(prefix, dist)
+    return timed(unlink_all, setup=setup, repeat=ws.params['repeat'])
+
+
+#: Modules which are slow to import, and which the conda-rpms modules should
+#: therefore only import when they are first needed.
+HEAVY_MODULES = ['conda', 'conda_gitenv', 'git', 'jinja2', 'yaml']
+
+_import_script = """
+import json, sys
+from timeit import default_timer
+start = default_timer()
+import {module}
+seconds = default_timer() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'seconds': seconds, 'heavy': heavy}}))
+"""
+
+
+def measure_import(module):
+    """
+    Import module in a fresh interpreter, returning the seconds the import
+    took and the list of the HEAVY_MODULES it imported.
+
+    """
+    script = _import_script.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    return result['seconds'], result['heavy']
+
+
+@benchmark
+def import_time(ws):
+    results = {}
+    for module in ['conda_rpms.build', 'conda_rpms.generate',
+                   'conda_rpms.install', 'conda_rpms.build_rpm_structure']:
+        times = []
+        for _ in range(ws.params['repeat']):
+            seconds, heavy = measure_import(module)
+            times.append(seconds)
+        results[module] = {'repeat': len(times), 'min': min(times),
+                           'mean': sum(times) / len(times), 'times': times,
+                           'heavy_modules': heavy}
+    return results
+
+
+def run(params, names=None, workdir=None):
+    """
+    Run the benchmarks (optionally only those named), returning the
+    results in a JSON serialisable dictionary.
+
+    """
+    directory = tempfile.mkdtemp(prefix='conda_rpms_bench_', dir=workdir)
+    try:
+        ws = Workspace(directory, params)
+        results = {}
+        for func in BENCHMARKS:
+            name = func.__name__
+            if names and name not in names:
+                continue
+            print('Running {}...'.format(name), file=sys.stderr)
+            try:
+                results[name] = func(ws)
+            except SkipBenchmark as e:
+                results[name] = {'skipped': str(e)}
+    finally:
+        shutil.rmtree(directory)
+    info = {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'conda_rpms': conda_rpms.__version__,
+            'date': datetime.datetime.now().isoformat()}
+    return {'info': info, 'params': params, 'results': results}
+
+
+def _flatten(results, prefix=''):
+    """Map each benchmark (and sub-benchmark) name to its timings."""
+    flat = {}
+    for name, result in results.items():
+        if 'min' in result or 'skipped' in result:
+            flat[prefix + name] = result
+        else:
+            flat.update(_flatten(result, prefix + name + '.'))
+    return flat
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Return a report of the current results relative to the baseline,
+    marking those which are slower by more than threshold (a fraction).
+
+    """
+    lines = []
+    old, new = _flatten(baseline['results']), _flatten(current['results'])
+    width = max([len(name) for name in new] + [10])
+    for name in sorted(new):
+        result = new[name]
+        if 'skipped' in result:
+            lines.append('{:<{}}  skipped: {}'.format(name, width,
+                                                      result['skipped']))
+            continue
+        base = old.get(name, {})
+        if 'min' not in base:
+            lines.append('{:<{}}  {:10.4f}s'.format(name, width,
+                                                    result['min']))
+            continue
+        ratio = result['min'] / base['min'] if base['min'] else float('inf')
+        flag = '  SLOWER' if ratio > 1 + threshold else ''
+        lines.append('{:<{}}  {:10.4f}s  (baseline {:.4f}s, x{:.2f}){}'.format(
+            name, width, result['min'], base['min'], ratio, flag))
+    return '\n'.join(lines)
+
+
+def configure_parser(parser):
+    parser.add_argument('names', nargs='*',
+                        help='The benchmarks to run (default: all of {}).'
+                             ''.format(', '.join(func.__name__
+                                                 for func in BENCHMARKS)))
+    parser.add_argument('--output', '-o',
+                        help='Save the results as JSON to this file.')
+    parser.add_argument('--baseline', '-b',
+                        help='Compare the results against this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The fractional slow-down, relative to the '
+                             'baseline, which is reported.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dists', type=int, default=20,
+                        help='The number of synthetic distributions.')
+    parser.add_argument('--files', type=int, default=50,
+                        help='The number of files in each distribution.')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='The size of the files in each distribution.')
+    parser.add_argument('--prefix-files', type=int, default=2,
+                        help='The number of text and binary files with '
+                             'the prefix placeholder in each distribution.')
+    parser.add_argument('--envs', type=int, default=3,
+                        help='The number of environments in the gitenv.')
+    parser.add_argument('--tags', type=int, default=5,
+                        help='The number of tags of each environment.')
+    parser.add_argument('--workdir',
+                        help='Where to generate the synthetic inputs.')
+    parser.set_defaults(function=handle_args)
+    return parser
+
+
+def handle_args(args):
+    params = {'repeat': args.repeat, 'dists': args.dists,
+              'files': args.files, 'file_size': args.file_size,
+              'prefix_files': args.prefix_files, 'envs': args.envs,
+              'tags': args.tags}
+    results = run(params, names=args.names, workdir=args.workdir)
+    baseline = {'results': {}}
+    if args.baseline:
+        with open(args.baseline, 'r') as fh:
+            baseline = json.load(fh)
+    print(compare(baseline, results, args.threshold))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark conda-rpms '
+                                                 'with synthetic inputs.')
+    configure_parser(parser)
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Generators of synthetic conda distributions, channels and conda-gitenv
+repositories, for benchmarking conda-rpms without network access.
+
+"""
+from __future__ import print_function
+
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import tarfile
+
+from conda_rpms.install import prefix_placeholder
+
+
+def _add_file(tar, name, content, mode=0o644):
+    member = tarfile.TarInfo(name)
+    member.size = len(content)
+    member.mode = mode
+    tar.addfile(member, io.BytesIO(content))
+
+
+def make_dist(directory, name, version='1.0', build_number=0, n_files=10,
+              file_size=1024, n_text_prefix=1, n_binary_prefix=1,
+              seed=None):
+    """
+    Create a synthetic conda distribution in directory, returning its
+    canonical name (e.g. 'name-1.0-0').
+
+    The distribution contains `n_files` files of `file_size` pseudo-random
+    bytes, plus `n_text_prefix` text files and `n_binary_prefix` binary
+    files containing the conda prefix placeholder (and listed in
+    info/has_prefix).
+
+    """
+    build = str(build_number)
+    dist = '{}-{}-{}'.format(name, version, build)
+    rand = random.Random(seed if seed is not None else dist)
+    files = {}
+    for i in range(n_files):
+        data = bytearray(rand.getrandbits(8) for _ in range(file_size))
+        files['lib/{}/data_{}.dat'.format(name, i)] = bytes(data)
+    has_prefix = []
+    for i in range(n_text_prefix):
+        fname = 'bin/{}-script-{}'.format(name, i)
+        files[fname] = '#!{}/bin/python\nprint("{}")\n'.format(
+            prefix_placeholder, name).encode('utf-8')
+        has_prefix.append('{} text {}'.format(prefix_placeholder, fname))
+    for i in range(n_binary_prefix):
+        fname = 'lib/lib{}_{}.so'.format(name, i)
+        padding = b'\0' * 256
+        files[fname] = (b'\x7fELF' + padding +
+                        prefix_placeholder.encode('utf-8') + b'/lib\0' +
+                        padding * max(1, file_size // 256))
+        has_prefix.append('{} binary {}'.format(prefix_placeholder, fname))
+
+    index = {'name': name, 'version': version, 'build': build,
+             'build_number': build_number, 'depends': [],
+             'license': 'BSD', 'platform': 'linux', 'arch': 'x86_64',
+             'subdir': 'linux-64'}
+    recipe = {'about': {'summary': 'The synthetic {} package'.format(name),
+                        'license': 'BSD'}}
+    path = os.path.join(directory, dist + '.tar.bz2')
+    with tarfile.open(path, 'w:bz2') as tar:
+        for fname in sorted(files):
+            _add_file(tar, fname, files[fname],
+                      0o755 if fname.startswith('bin/') else 0o644)
+        _add_file(tar, 'info/index.json',
+                  json.dumps(index, sort_keys=True).encode('utf-8'))
+        _add_file(tar, 'info/recipe.json',
+                  json.dumps(recipe).encode('utf-8'))
+        _add_file(tar, 'info/files',
+                  '\n'.join(sorted(files)).encode('utf-8'))
+        _add_file(tar, 'info/has_prefix',
+                  '\n'.join(has_prefix).encode('utf-8'))
+    return dist
+
+
+def make_channel(directory, n_dists=10, subdir='linux-64', **dist_kwargs):
+    """
+    Create a synthetic local channel in directory, containing `n_dists`
+    synthetic distributions (created with :func:`make_dist`) and their
+    repodata.json.
+
+    Returns the URL of the channel's subdir, and the list of distributions.
+
+    """
+    subdir_path = os.path.join(directory, subdir)
+    if not os.path.isdir(subdir_path):
+        os.makedirs(subdir_path)
+    packages = {}
+    dists = []
+    for i in range(n_dists):
+        dist = make_dist(subdir_path, 'pkg{}'.format(i), **dist_kwargs)
+        fname = dist + '.tar.bz2'
+        path = os.path.join(subdir_path, fname)
+        with open(path, 'rb') as fh:
+            content = fh.read()
+        name, version, build = dist.rsplit('-', 2)
+        packages[fname] = {'name': name, 'version': version, 'build': build,
+                           'build_number': int(build), 'depends': [],
+                           'license': 'BSD', 'size': len(content),
+                           'md5': hashlib.md5(content).hexdigest(),
+                           'sha256': hashlib.sha256(content).hexdigest()}
+        dists.append(dist)
+    repodata = {'info': {'subdir': subdir}, 'packages': packages}
+    with open(os.path.join(subdir_path, 'repodata.json'), 'w') as fh:
+        json.dump(repodata, fh, indent=2, sort_keys=True)
+    url = 'file://{}/'.format(os.path.abspath(subdir_path))
+    return url, dists
+
+
+def _git(repo_dir, *args):
+    subprocess.check_output(['git'] + list(args), cwd=repo_dir)
+
+
+def _commit(repo_dir, files, message):
+    for fname, content in files.items():
+        path = os.path.join(repo_dir, fname)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+    _git(repo_dir, 'add', '--all')
+    _git(repo_dir, 'commit', '--allow-empty', '-q', '-m', message)
+
+
+def make_gitenv(repo_dir, channel_url, dists, n_envs=2, n_tags=3,
+                labels=('current', 'next'), dists_per_env=None):
+    """
+    Create a synthetic conda-gitenv repository in repo_dir.
+
+    Each of the `n_envs` environments has an environment branch (with its
+    labels), and a manifest branch holding `n_tags` tagged manifests drawn
+    from the given distributions of the channel at channel_url.  Each label
+    points at one of the environment's tags.
+
+    Returns the list of tag names.
+
+    """
+    if not os.path.isdir(repo_dir):
+        os.makedirs(repo_dir)
+    _git(repo_dir, 'init', '-q')
+    _git(repo_dir, 'config', 'user.email', 'bench@example.com')
+    _git(repo_dir, 'config', 'user.name', 'conda-rpms benchmarks')
+    _commit(repo_dir, {'README.md': 'Synthetic gitenv.\n'}, 'Initial commit.')
+    _git(repo_dir, 'branch', '-M', 'master')
+    if dists_per_env is None:
+        dists_per_env = len(dists)
+
+    all_tags = []
+    for env_index in range(n_envs):
+        env = 'env{}'.format(env_index)
+        _git(repo_dir, 'checkout', '-q', '-b', env, 'master')
+        spec = 'env:\n' + ''.join('  - {}\n'.format(dist.rsplit('-', 2)[0])
+                                  for dist in dists[:dists_per_env])
+        _commit(repo_dir, {'env.spec': spec}, 'Add {}.'.format(env))
+
+        _git(repo_dir, 'checkout', '-q', '-b', 'manifest/' + env)
+        tags = []
+        for tag_index in range(n_tags):
+            # Rotate which distributions are in each tag, so that tags share
+            # most, but not all, of their distributions.
+            start = (env_index + tag_index) % len(dists)
+            env_dists = (dists[start:] + dists[:start])[:dists_per_env]
+            manifest = ''.join('{}\t{}\n'.format(channel_url, dist)
+                               for dist in sorted(env_dists))
+            _commit(repo_dir, {'env.manifest': manifest},
+                    'Manifest {} of {}.'.format(tag_index, env))
+            tag = 'env-{}-{:04d}_01_01'.format(env, 2000 + tag_index)
+            _git(repo_dir, 'tag', tag)
+            tags.append(tag)
+        all_tags.extend(tags)
+
+        _git(repo_dir, 'checkout', '-q', env)
+        label_files = dict(('labels/{}.txt'.format(label),
+                            tags[-1 - (i % len(tags))] + '\n')
+                           for i, label in enumerate(labels))
+        _commit(repo_dir, label_files, 'Label {}.'.format(env))
+    _git(repo_dir, 'checkout', '-q', 'master')
+    return all_tags
@@ -3,9 +3,14 @@ Build all spec files which exists and which don't already have
 equivalent built RPMs in the build directory.
 
 """
+import hashlib
+import json
 import os
 import glob
 import subprocess
+import time
+
+from conda_rpms.store import PackageStore, hash_tarball
 
 
 def name_version_release(spec_fh):
@@ -23,30 +28,245 @@ def name_version_release(spec_fh):
     return content
 
 
-def build_new(rpmbuild_dir, rpm_directory):
-    """We rely on spec naming conventions to check that the build RPMs actually exist."""
+def rpm_names(spec_fh):
+    """
+    Return the file names of the RPMs built by the spec file of the given
+    filehandle: those of its "%package -n" subpackages, if it has any (as
+    batch specs do, whose main package has no files), or else that of its
+    main package.
+    """
+    lines = list(spec_fh)
+    spec_info = name_version_release(lines)
+    names = [line.split()[2] for line in lines
+             if line.startswith('%package -n ')]
+    if not names:
+        names = [spec_info['name']]
+    return ['{}-{version}-{release}.x86_64.rpm'.format(name, **spec_info)
+            for name in names]
+
+
+def spec_sources(spec_path):
+    """Return the filenames of the sources of the given spec."""
+    sources = []
+    with open(spec_path, 'r') as fh:
+        for line in fh:
+            if line.startswith('Source') and ':' in line:
+                sources.append(line.split(':', 1)[1].strip())
+    return sources
+
+
+def artifact_key(spec_path, sources_directory, store=None):
+    """
+    Return the key of the RPMs built by the given spec in an artifact cache:
+    the sha256 of the spec's content and of the name and content of each of
+    its sources, or None if a source is missing.
+
+    Where the (given, or the sources directory's) PackageStore has a still
+    valid record of a tarball, its recorded sha256 is used rather than hashing
+    the tarball again.
+
+    """
+    if store is None:
+        store = PackageStore(sources_directory)
+    key = hashlib.sha256()
+    with open(spec_path, 'rb') as fh:
+        key.update(fh.read())
+    for source in spec_sources(spec_path):
+        path = os.path.join(sources_directory, source)
+        if not os.path.isfile(path):
+            return None
+        sha256 = None
+        if source.endswith('.tar.bz2'):
+            sha256 = store.recorded_sha256(source[:-len('.tar.bz2')])
+        if sha256 is None:
+            sha256 = hash_tarball(path)[1]
+        key.update('{}\0{}\0'.format(source, sha256).encode('utf-8'))
+    return key.hexdigest()
+
+
+def rpmbuild(spec_path, rpmbuild_dir, log_path=None):
+    """
+    Build the given spec, returning rpmbuild's exit status. If a log path is given,
+    rpmbuild's output is written to it rather than inherited.
+    """
+    cmd = ['rpmbuild', '-bb', '--define', "_topdir {}".format(rpmbuild_dir),
+           spec_path, '--force']
+    if log_path is None:
+        return subprocess.call(cmd)
+    with open(log_path, 'w') as fh:
+        return subprocess.call(cmd, stdout=fh, stderr=subprocess.STDOUT)
+
+
+def write_report(results, report_path):
+    """Write the results of build_new, and a summary of them, as JSON."""
+    summary = {'seconds': sum(result['seconds'] for result in results)}
+    for status in ['built', 'cached', 'skipped', 'failed', 'missing']:
+        summary[status] = len([result for result in results
+                               if result['status'] == status])
+    with open(report_path, 'w') as fh:
+        json.dump({'specs': results, 'summary': summary}, fh,
+                  indent=2, sort_keys=True)
+
+
+def planned_specs(plan_path, target=None):
+    """
+    Return the filenames of the specs to be created or updated by the plan
+    in the given JSON file (as written by build_rpm_structure --plan-json).
+    The plan of several targets has the specs of each; the target must then
+    be named.
+    """
+    with open(plan_path, 'r') as fh:
+        plan = json.load(fh)
+    if 'targets' in plan:
+        if target is None:
+            raise ValueError('The plan is of the targets {}; one must be '
+                             'chosen.'.format(', '.join(sorted(plan['targets']))))
+        plan = plan['targets'][target]
+    return [item['spec'] for item in plan['specs']]
+
+
+def build_new(rpmbuild_dir, rpm_directory, log_dir=None, report_path=None,
+              keep_going=False, specs=None, cache=None):
+    """
+    We rely on spec naming conventions to check that the build RPMs actually exist.
+
+    If the filenames of specs are given, only those specs are considered,
+    rather than all of those in the SPECS directory.
+
+    Given an artifact cache (see conda_rpms.artifact_cache), the RPMs of a
+    spec are taken from it, by the spec's artifact_key, rather than built;
+    and those which are built are published to it.
+
+    Returns a list with, for each spec, whether it was skipped, built, cached, failed
+    or missing (a given spec which doesn't exist),
+    the wall time of its build, the (total) size of the RPMs it produced, rpmbuild's exit
+    status and its log file (when a log directory is given). The list is also
+    written as a JSON report, if a report path is given.
+
+    Unless keep_going, the first failed build raises a CalledProcessError, and the
+    first missing spec an IOError.
+
+    """
     specs_directory = os.path.join(rpmbuild_dir, 'SPECS')
     sources_directory = os.path.join(rpmbuild_dir, 'SOURCES')
-    for spec in sorted(glob.glob(os.path.join(specs_directory, '*.spec'))):
-        spec_path = os.path.join(specs_directory, spec)
-        rpm_name = spec[:-5]
-        with open(spec_path, 'r') as fh:
-            spec_info = name_version_release(fh)
-        rpm_name = '{name}-{version}-{release}.x86_64.rpm'.format(**spec_info)
+    built_directory = os.path.join(rpmbuild_dir, 'RPMS', 'x86_64')
+    store = PackageStore(sources_directory)
+    if log_dir is not None and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    results = []
+    try:
+        if specs is None:
+            spec_paths = glob.glob(os.path.join(specs_directory, '*.spec'))
+        else:
+            spec_paths = [os.path.join(specs_directory, spec) for spec in specs]
+        for spec in sorted(spec_paths):
+            spec_path = os.path.join(specs_directory, spec)
+            if not os.path.isfile(spec_path):
+                # A stale (or mismatched) plan may name a spec which was never
+                # written.
+                results.append({'spec': os.path.basename(spec_path),
+                                'rpm': None, 'rpms': [], 'status': 'missing',
+                                'seconds': 0.0, 'returncode': None,
+                                'rpm_size': None, 'log': None})
+                if not keep_going:
+                    raise IOError('The spec {} does not exist.'.format(
+                        spec_path))
+                continue
+            with open(spec_path, 'r') as fh:
+                rpms = rpm_names(fh)
+            result = {'spec': os.path.basename(spec_path), 'rpm': rpms[0],
+                      'rpms': rpms, 'status': 'skipped', 'seconds': 0.0,
+                      'returncode': None, 'rpm_size': None, 'log': None}
+            results.append(result)
 
-        if not os.path.exists(os.path.join(rpm_directory, rpm_name)):
-            subprocess.check_call(['rpmbuild', '-bb', '--define', "_topdir {}".format(rpmbuild_dir),
-                                   spec_path, '--force'])
+            if all(os.path.exists(os.path.join(rpm_directory, rpm_name))
+                   for rpm_name in rpms):
+                continue
+            key = None
+            if cache is not None:
+                key = artifact_key(spec_path, sources_directory, store)
+            if key is not None and cache.fetch(key, rpms, built_directory):
+                result['status'] = 'cached'
+            else:
+                if log_dir is not None:
+                    result['log'] = os.path.join(
+                        log_dir, os.path.basename(spec_path)[:-5] + '.log')
+                start = time.time()
+                returncode = rpmbuild(spec_path, rpmbuild_dir, result['log'])
+                result['seconds'] = time.time() - start
+                result['returncode'] = returncode
+                if returncode != 0:
+                    result['status'] = 'failed'
+                    if not keep_going:
+                        raise subprocess.CalledProcessError(returncode,
+                                                            spec_path)
+                    continue
+                result['status'] = 'built'
+                rpm_paths = [os.path.join(built_directory, rpm_name)
+                             for rpm_name in rpms]
+                if key is not None and all(os.path.exists(rpm_path)
+                                           for rpm_path in rpm_paths):
+                    cache.publish(key, rpm_paths)
+            for rpm_name in rpms:
+                for directory in [built_directory, rpm_directory]:
+                    rpm_path = os.path.join(directory, rpm_name)
+                    if os.path.exists(rpm_path):
+                        result['rpm_size'] = ((result['rpm_size'] or 0) +
+                                              os.path.getsize(rpm_path))
+                        break
+    finally:
+        if report_path is not None:
+            write_report(results, report_path)
+    return results
 
 
 if __name__ == '__main__':
     import argparse
+    import sys
 
     parser = argparse.ArgumentParser()
     parser.add_argument('rpmbuild_dir', help='The location of the rpmbuild directory.')
     parser.add_argument('rpm_dir', help='The location to look for existing RPMs.')
+    parser.add_argument('--log-dir', help='Capture the output of each rpmbuild to '
+                                          'a <spec name>.log file in this directory.')
+    parser.add_argument('--report', help='Write a JSON report of the builds to this file.')
+    parser.add_argument('--keep-going', action='store_true',
+                        help='Continue building the remaining specs after a failure.')
+    parser.add_argument('--plan', help='Only build the specs of this JSON plan, '
+                                       'from build_rpm_structure --plan-json.')
+    parser.add_argument('--target', help='The target, of a plan of several, '
+                                         'whose specs are built.')
+    parser.add_argument('--artifact-cache', metavar='DIRECTORY',
+                        help='Take RPMs built from identical specs and sources '
+                             'from, and publish newly built RPMs to, this '
+                             '(shared) cache directory.')
+    parser.add_argument('--update-repo', action='store_true',
+                        help='Incrementally update the yum repository metadata '
+                             'of rpm_dir after building.')
 
     args = parser.parse_args()
 
-    build_new(args.rpmbuild_dir, args.rpm_dir)
-
+    specs = planned_specs(args.plan, args.target) if args.plan else None
+    cache = None
+    if args.artifact_cache:
+        from conda_rpms.artifact_cache import DirectoryCache
+        cache = DirectoryCache(args.artifact_cache)
+    try:
+        results = build_new(args.rpmbuild_dir, args.rpm_dir,
+                            log_dir=args.log_dir, report_path=args.report,
+                            keep_going=args.keep_going, specs=specs,
+                            cache=cache)
+    except IOError as err:
+        sys.exit(str(err))
+    if args.update_repo:
+        import conda_rpms.repodata as repodata
+        try:
+            returncode = repodata.update(args.rpm_dir)
+        except RuntimeError as err:
+            sys.exit(str(err))
+        if returncode != 0:
+            sys.exit('Failed to update the repodata of {}.'.format(args.rpm_dir))
+    failed = [result['spec'] for result in results
+              if result['status'] in ('failed', 'missing')]
+    if failed:
+        sys.exit('Failed to build: {}'.format(', '.join(failed)))
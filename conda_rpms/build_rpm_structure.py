@@ -3,27 +3,32 @@
 Turn the gitenv into RPM spec files which can be built at a later stage.
 
 """
-from __future__ import print_function
+from __future__ import division, print_function
 
-import datetime
-from glob import glob
+import glob
+import json
 import os
 import shutil
 import time
 
-import conda.api
-import conda.fetch
-from conda.resolve import Resolve, MatchSpec
-from conda_gitenv import manifest_branch_prefix
-from conda_gitenv.deploy import tags_by_label, tags_by_env
-from conda_gitenv.lock import Locked
-from conda_gitenv.resolve import tempdir, create_tracking_branches
-from git import Repo, Commit
-import yaml
-
+# NOTE: conda, conda_gitenv, git and yaml are slow to import, so they are
+# imported by the functions which need them, rather than here.
 import logging
 import conda_rpms.generate as generate
 import conda_rpms.install as conda_install
+from conda_rpms.stats import Stats
+from conda_rpms.store import PackageStore
+
+
+#: The timings and counters of the phases of a run.
+stats = Stats()
+
+#: The formats a conda tarball can be recompressed to in SOURCES, and the
+#: tarfile mode (and keyword arguments) of each. "tar.bz2" keeps the tarball
+#: as it was fetched.
+source_formats = {'tar.bz2': None,
+                  'tar': ('w', {}),
+                  'tar.gz': ('w:gz', {'compresslevel': 1})}
 
 
 class Config(dict):
@@ -37,6 +42,8 @@ class Config(dict):
             self._key = key
 
     def _load(self):
+        import yaml
+
         if not os.path.exists(self.fname):
             emsg = 'The configuration file {!r} does not exist.'
             raise ValueError(emsg.format(os.path.basename(self.fname)))
@@ -64,6 +71,14 @@ class Config(dict):
             result = Config(self.fname, result, self._key + [key])
         return result
 
+    def __contains__(self, key):
+        return key in self._store
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
     def __iter__(self):
         return iter(self._store)
 
@@ -74,8 +89,166 @@ class Config(dict):
         return repr(self._store)
 
 
-def create_rpmbuild_for_env(pkgs, target, config):
-    rpm_prefix = config['rpm']['prefix']
+def _merged(base, override):
+    """Return a plain dict of base, recursively updated with override."""
+    result = dict((key, base[key]) for key in base)
+    for key in override:
+        if key in result and isinstance(result[key], dict) and \
+                isinstance(override[key], dict):
+            result[key] = _merged(result[key], override[key])
+        else:
+            result[key] = override[key]
+    return result
+
+
+def target_configs(target, config):
+    """
+    Return a list of the (rpmbuild directory, configuration) of each of the
+    targets the specs are generated for, without creating anything.
+
+    Without a "targets" section in the configuration, this is just the given
+    target directory and configuration. Otherwise, each named target has the
+    configuration overridden by its own settings, and the rpmbuild directory
+    <target>/<name>, whose SOURCES is the shared <target>/SOURCES.
+
+    """
+    targets = config.get('targets')
+    if targets is None:
+        return [(target, config)]
+    base = dict((key, config[key]) for key in config if key != 'targets')
+    result = []
+    for name in sorted(targets):
+        target_config = _merged(base, targets[name])
+        if isinstance(config, Config):
+            target_config = Config(config.fname, target_config, [name])
+        result.append((os.path.join(target, name), target_config))
+    return result
+
+
+def rpmbuild_targets(target, config):
+    """
+    Return the targets of target_configs, first creating the rpmbuild
+    directory of each (with its SOURCES linked to the shared SOURCES).
+
+    """
+    result = target_configs(target, config)
+    if config.get('targets') is None:
+        return result
+    pkg_cache = os.path.join(target, 'SOURCES')
+    if not os.path.isdir(pkg_cache):
+        os.makedirs(pkg_cache)
+    for target_dir, _ in result:
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        sources = os.path.join(target_dir, 'SOURCES')
+        if not os.path.lexists(sources):
+            os.symlink(os.path.join(os.pardir, 'SOURCES'), sources)
+    return result
+
+
+def recompress(tar_path, source_format, checksum=None):
+    """
+    Convert the conda tarball at tar_path into the given source format,
+    alongside it, and return the path of the result.
+
+    The conversion is cached: the checksum of the tarball it was made from
+    (its md5, hashed if not given) is kept in a "<result>.md5" file, and the
+    conversion is only repeated when that checksum changes.
+
+    """
+    import tarfile
+
+    if source_format not in source_formats:
+        raise ValueError('Unknown source format {!r}, expected one of '
+                         '{}.'.format(source_format,
+                                      ', '.join(sorted(source_formats))))
+    if source_formats[source_format] is None:
+        return tar_path
+    mode, kwargs = source_formats[source_format]
+    if checksum is None:
+        checksum = conda_install.hash_file(tar_path, 'md5')
+    target = tar_path[:-len('tar.bz2')] + source_format
+    checksum_path = target + '.md5'
+    if os.path.exists(target) and os.path.exists(checksum_path):
+        with open(checksum_path, 'r') as fh:
+            if fh.read().strip() == checksum:
+                stats.count('recompress_hits')
+                return target
+    stats.count('recompress_misses')
+    tmp = target + '.tmp'
+    with stats.timer('recompress'):
+        with tarfile.open(tar_path, 'r:bz2') as src, \
+                tarfile.open(tmp, mode, **kwargs) as dst:
+            for member in src:
+                fileobj = src.extractfile(member) if member.isreg() else None
+                dst.addfile(member, fileobj)
+        os.rename(tmp, target)
+    with open(checksum_path, 'w') as fh:
+        fh.write(checksum + '\n')
+    return target
+
+
+def channel_index(source, tar_name, index_cache=None):
+    """
+    Return the index of the given channel, by distribution filename.
+
+    If an index_cache dictionary is given, the indexes are kept in it (by
+    channel) and reused. Distributions are never changed once they are in a
+    channel, so a cached index is only refetched if it lacks tar_name.
+
+    """
+    import conda.fetch
+
+    if index_cache is not None and tar_name in index_cache.get(source, {}):
+        stats.count('channel_index_hits')
+        return index_cache[source]
+    stats.count('channel_index_misses')
+    with stats.timer('fetch_index'):
+        index = conda.fetch.fetch_index([source], use_cache=False)
+    pkg_index = {pkg_info['fn']: pkg_info for pkg_info in index.values()}
+    if index_cache is not None:
+        index_cache[source] = pkg_index
+    return pkg_index
+
+
+def pkg_spec_name(rpm_prefix, dist):
+    return '{}-pkg-{}.spec'.format(rpm_prefix, dist)
+
+
+def batch_spec_name(rpm_prefix, batch_id):
+    return '{}-pkgs-{}.spec'.format(rpm_prefix, batch_id)
+
+
+def tag_spec_name(rpm_prefix, tag_name):
+    env_name, tag = tag_name.split('-', 2)[1:]
+    return '{}-env-{}-tag-{}.spec'.format(rpm_prefix, env_name, tag)
+
+
+def label_spec_name(rpm_prefix, env_name, label):
+    return '{}-env-{}-label-{}.spec'.format(rpm_prefix, env_name, label)
+
+
+def package_store(target, config):
+    """
+    Return the PackageStore of the target's SOURCES, or None unless the
+    config's verify_sources option is set.
+    """
+    if config['rpm'].get('verify_sources', False):
+        return PackageStore(os.path.join(target, 'SOURCES'))
+
+
+def create_rpmbuild_for_env(pkgs, target, config, index_cache=None,
+                            store=None):
+    """
+    Fetch the given distributions and write the specs of those which don't
+    have one.
+
+    The fetched distributions may be verified against the checksums of the
+    channel, at the cost of a stat for those already verified, by the
+    (given, or else the target's) package_store, which is saved here only
+    when it isn't given.
+
+    """
     pkg_cache = os.path.join(target, 'SOURCES')
     pkg_names = set(pkg for _, pkg in pkgs)
     if os.path.exists(target):
@@ -95,37 +268,163 @@ def create_rpmbuild_for_env(pkgs, target, config):
         # installed correctly.
         return
 
-    spec_dir = os.path.join(target, 'SPECS')
-    if not os.path.exists(spec_dir):
-        os.makedirs(spec_dir)
+    outputs = []
+    for target_dir, target_config in rpmbuild_targets(target, config):
+        rpm_prefix = target_config['rpm']['prefix']
+        spec_dir = os.path.join(target_dir, 'SPECS')
+        if not os.path.exists(spec_dir):
+            os.makedirs(spec_dir)
+        # Small distributions without a spec may be built together, by batch
+        # specs.
+        batch = target_config['rpm'].get('batch')
+        batched = {}
+        if batch is not None:
+            batched = batched_dists(spec_dir, rpm_prefix)
+        outputs.append({'spec_dir': spec_dir, 'config': target_config,
+                        'batch': batch, 'batched': batched, 'to_batch': []})
+    own_store = store is None
+    if own_store:
+        store = package_store(target, config)
+    try:
+        _fetch_and_write_specs(pkgs, pkg_cache, outputs, store, index_cache)
+    finally:
+        if own_store and store is not None:
+            store.save()
+    for output in outputs:
+        if output['to_batch']:
+            write_batch_specs(output['to_batch'], output['spec_dir'],
+                              output['config'])
+
+
+def _fetch_and_write_specs(pkgs, pkg_cache, outputs, store, index_cache):
+    import conda.fetch
+
     for source, pkg in pkgs:
-        index = conda.fetch.fetch_index([source], use_cache=False)
-        pkg_index = {pkg_info['fn']: pkg_info for pkg_info in index.values()}
         tar_name = pkg + '.tar.bz2'
+        pkg_index = channel_index(source, tar_name, index_cache)
         pkg_info = pkg_index.get(tar_name, None)
         if pkg_info is None:
             raise ValueError('Distribution {} is no longer available '
                              'in the channel {}.'.format(tar_name, source))
         dist_name = pkg 
-        if not conda_install.is_fetched(pkg_cache, dist_name):
+        tar_path = os.path.join(pkg_cache, tar_name)
+        fetched = conda_install.is_fetched(pkg_cache, dist_name)
+        if fetched and store is not None:
+            with stats.timer('verify_pkg'):
+                fetched = store.check(dist_name, pkg_info)
+            if not fetched:
+                stats.count('pkg_verify_failures')
+                print('Refetching {}, which failed verification'.format(
+                    dist_name))
+                if os.path.exists(tar_path):
+                    os.remove(tar_path)
+        if not fetched:
+            stats.count('pkg_cache_misses')
             print('Fetching {}'.format(dist_name))
-            conda.fetch.fetch_pkg(pkg_info, pkg_cache)
-        spec_path = os.path.join(spec_dir, '{}-pkg-{}.spec'.format(rpm_prefix,
-                                                                   pkg))
-        if not os.path.exists(spec_path):
-            spec = generate.render_dist_spec(os.path.join(pkg_cache,
-                                                          tar_name), config)
-            with open(spec_path, 'w') as fh:
-                fh.write(spec)
-
-
-def create_rpmbuild_for_tag(repo, tag_name, target, config):
+            with stats.timer('fetch_pkg'):
+                conda.fetch.fetch_pkg(pkg_info, pkg_cache)
+            if os.path.exists(tar_path):
+                stats.count('bytes_downloaded', os.path.getsize(tar_path))
+            if store is not None:
+                with stats.timer('verify_pkg'):
+                    store.add(dist_name, pkg_info)
+        else:
+            stats.count('pkg_cache_hits')
+        for output in outputs:
+            output_config = output['config']
+            rpm_prefix = output_config['rpm']['prefix']
+            source_format = output_config['rpm'].get('source_format',
+                                                     'tar.bz2')
+            if source_format != 'tar.bz2':
+                recompress(tar_path, source_format, pkg_info.get('md5'))
+            spec_path = os.path.join(output['spec_dir'],
+                                     pkg_spec_name(rpm_prefix, pkg))
+            batch = output['batch']
+            if pkg in output['batched']:
+                stats.count('pkg_spec_hits')
+            elif not os.path.exists(spec_path):
+                stats.count('pkg_spec_misses')
+                if batch is not None and (os.path.getsize(tar_path) <
+                                          batch.get('max_size', 2 ** 20)):
+                    output['to_batch'].append(tar_path)
+                    continue
+                with stats.timer('render_dist_spec'):
+                    spec = generate.render_dist_spec(tar_path, output_config)
+                with stats.timer('write_spec'), open(spec_path, 'w') as fh:
+                    fh.write(spec)
+            else:
+                stats.count('pkg_spec_hits')
+
+
+def batched_dists(spec_dir, rpm_prefix):
+    """
+    Return a dictionary mapping each distribution whose package RPM is built
+    by one of the batch specs in spec_dir to the filename of that spec.
+    """
+    package = '%package -n {}-pkg-'.format(rpm_prefix)
+    dists = {}
+    pattern = os.path.join(spec_dir, '{}-pkgs-*.spec'.format(rpm_prefix))
+    for spec_path in glob.glob(pattern):
+        with open(spec_path, 'r') as fh:
+            for line in fh:
+                if line.startswith(package):
+                    dists[line[len(package):].strip()] = \
+                        os.path.basename(spec_path)
+    return dists
+
+
+def batch_groups(tarballs, max_dists):
+    """
+    Split the given distribution tarballs into batches of up to max_dists,
+    returning a list of (batch id, tarballs) pairs. The id of a batch is a
+    hash of the names of its tarballs.
+    """
+    import hashlib
+
+    tarballs = sorted(tarballs)
+    groups = []
+    for start in range(0, len(tarballs), max_dists):
+        dists = tarballs[start:start + max_dists]
+        names = '\n'.join(os.path.basename(dist) for dist in dists)
+        batch_id = hashlib.sha1(names.encode('utf-8')).hexdigest()[:12]
+        groups.append((batch_id, dists))
+    return groups
+
+
+def write_batch_specs(tarballs, spec_dir, config):
+    """
+    Write batch specs, of up to rpm:batch:max_dists distributions each, which
+    build the package RPMs of the given distribution tarballs.
+
+    Each batch spec is named by a hash of the distributions it builds. Only
+    distributions without a spec are ever batched, so a new distribution is
+    batched with other new distributions, and never causes the RPMs of an
+    existing batch to be rebuilt.
+
+    """
     rpm_prefix = config['rpm']['prefix']
-    print("CREATE FOR {}".format(tag_name))
+    max_dists = config['rpm']['batch'].get('max_dists', 50)
+    for batch_id, dists in batch_groups(tarballs, max_dists):
+        with stats.timer('render_batch_spec'):
+            spec = generate.render_batch_spec(dists, config, batch_id)
+        spec_path = os.path.join(spec_dir, batch_spec_name(rpm_prefix,
+                                                           batch_id))
+        with stats.timer('write_spec'), open(spec_path, 'w') as fh:
+            fh.write(spec)
+
+
+def read_tag(repo, tag_name):
+    """
+    Checkout the given tag, returning the manifest (a sorted list of
+    [channel, distribution] pairs) and the specification of its environment.
+    """
+    import yaml
+
     tag = repo.tags[tag_name]
     # Checkout the tag in a detached head form.
-    repo.head.reference = tag.commit
-    repo.head.reset(working_tree=True)
+    with stats.timer('checkout'):
+        repo.head.reference = tag.commit
+        repo.head.reset(working_tree=True)
 
     manifest_fname = os.path.join(repo.working_dir, 'env.manifest')
     if not os.path.exists(manifest_fname):
@@ -139,17 +438,86 @@ def create_rpmbuild_for_tag(repo, tag_name, target, config):
         raise ValueError("The tag '{}' doesn't have an environment specification.".format(tag_name))
     with open(spec_fname, 'r') as fh:
         env_spec = yaml.safe_load(fh).get('env', [])
-    create_rpmbuild_for_env(manifest, target, config)
+    return manifest, env_spec
+
+
+def create_rpmbuild_for_tag(repo, tag_name, target, config, index_cache=None,
+                            store=None):
+    print("CREATE FOR {}".format(tag_name))
+    manifest, env_spec = read_tag(repo, tag_name)
+    create_rpmbuild_for_env(manifest, target, config, index_cache, store)
     pkgs = [pkg for _, pkg in manifest]
     env_name, tag = tag_name.split('-', 2)[1:]
-    fname = '{}-env-{}-tag-{}.spec'.format(rpm_prefix, env_name, tag)
-    with open(os.path.join(target, 'SPECS', fname), 'w') as fh:
-        fh.write(generate.render_taggedenv(env_name, tag, pkgs, config, env_spec))
+    for target_dir, target_config in rpmbuild_targets(target, config):
+        fname = tag_spec_name(target_config['rpm']['prefix'], tag_name)
+        with stats.timer('render_taggedenv'):
+            spec = generate.render_taggedenv(env_name, tag, pkgs,
+                                             target_config, env_spec)
+        with stats.timer('write_spec'):
+            with open(os.path.join(target_dir, 'SPECS', fname), 'w') as fh:
+                fh.write(spec)
 
 
-def create_rpmbuild_content(repo, target, config):
-    rpm_prefix = config['rpm']['prefix']
+def environment_names(repo):
+    """
+    Return the names of the environments of the repo: the branches which
+    have a manifest branch.
+    """
+    from conda_gitenv import manifest_branch_prefix
+
+    return set(branch.name for branch in repo.branches
+               if not branch.name.startswith(manifest_branch_prefix) and
+               manifest_branch_prefix + branch.name in repo.branches)
+
+
+def check_environments(repos):
+    """
+    Raise a ValueError if any environment is defined by more than one of the
+    given repos, as their specs would collide.
+    """
+    owners = {}
+    for repo in repos:
+        for name in sorted(environment_names(repo)):
+            if name in owners:
+                uri = repo.remotes.origin.url
+                raise ValueError('The environment {!r} is defined by both {} '
+                                 'and {}.'.format(name, owners[name], uri))
+            owners[name] = repo.remotes.origin.url
+
+
+def clone_repos(repo_uris, directory):
+    """
+    Clone each of the given gitenv repos into a subdirectory of directory,
+    checking that no environment is defined by more than one of them.
+    """
+    from conda_gitenv.resolve import create_tracking_branches
+    from git import Repo
+
+    repos = []
+    for index, repo_uri in enumerate(repo_uris):
+        with stats.timer('clone'):
+            repo = Repo.clone_from(repo_uri,
+                                   os.path.join(directory, str(index)))
+            create_tracking_branches(repo)
+        repos.append(repo)
+    check_environments(repos)
+    return repos
+
+
+def iter_labelled_tags(repo, envs=None):
+    """
+    Checkout each environment branch of the repo (or only those named in
+    envs) in turn, yielding the environment name, label, tag name and number
+    of commits of the branch for each of the labels of the environment.
+
+    """
+    from conda_gitenv import manifest_branch_prefix
+    from conda_gitenv.deploy import tags_by_label
+    from git import Commit
+
     for branch in repo.branches:
+        if envs is not None and branch.name not in envs:
+            continue
         # We only want environment branches, not manifest branches.
         if not branch.name.startswith(manifest_branch_prefix):
             manifest_branch_name = manifest_branch_prefix + branch.name
@@ -157,7 +525,8 @@ def create_rpmbuild_content(repo, target, config):
             # skip this environment.
             if manifest_branch_name not in repo.branches:
                 continue
-            branch.checkout()
+            with stats.timer('checkout'):
+                branch.checkout()
             labelled_tags = tags_by_label(os.path.join(repo.working_dir,
                                                        'labels'))
 
@@ -166,16 +535,176 @@ def create_rpmbuild_content(repo, target, config):
 
             # Keep track of the labels which have tags - its those we want.
             for label, tag in labelled_tags.items():
-                create_rpmbuild_for_tag(repo, tag, target, config)
-                fname = '{}-env-{}-label-{}.spec'.format(rpm_prefix, branch.name, label)
-                with open(os.path.join(target, 'SPECS', fname), 'w') as fh:
-                    fh.write(generate.render_env(branch.name, label,
-                                                 repo, config, tag, commit_num))
+                yield branch.name, label, tag, commit_num
+
+
+def create_rpmbuild_content(repo, target, config, envs=None,
+                            index_cache=None):
+    """
+    Create the specs of the labelled tags of each of the environments of
+    the repo (or only of those named in envs).
+
+    The distributions read are only cached for the run, so that the cache
+    doesn't grow from one poll of a watch to the next. The package_store
+    is read once for the run, and saved at its end.
+
+    """
+    store = package_store(target, config)
+    try:
+        for env_name, label, tag, commit_num in iter_labelled_tags(repo,
+                                                                   envs):
+            create_rpmbuild_for_tag(repo, tag, target, config, index_cache,
+                                    store)
+            for target_dir, target_config in rpmbuild_targets(target, config):
+                fname = label_spec_name(target_config['rpm']['prefix'],
+                                        env_name, label)
+                with stats.timer('render_env'):
+                    spec = generate.render_env(env_name, label, repo,
+                                               target_config, tag, commit_num)
+                with stats.timer('write_spec'):
+                    with open(os.path.join(target_dir, 'SPECS', fname),
+                              'w') as fh:
+                        fh.write(spec)
+    finally:
+        if store is not None:
+            store.save()
+        generate.clear_dist_info_cache()
+
+
+def _plan_spec(plan, spec_dir, fname, kind, spec=None, dists=None):
+    """
+    Add the spec to the plan: to be created if it doesn't exist, or to be
+    updated if its content (when given) differs from that of the existing
+    spec.
+    """
+    if fname in plan['_expected']:
+        return
+    plan['_expected'].add(fname)
+    spec_path = os.path.join(spec_dir, fname)
+    if not os.path.exists(spec_path):
+        action = 'create'
+    elif spec is None:
+        return
+    else:
+        with open(spec_path, 'r') as fh:
+            if fh.read() == spec:
+                return
+        action = 'update'
+    entry = {'spec': fname, 'kind': kind, 'action': action}
+    if dists is not None:
+        entry['dists'] = dists
+    plan['specs'].append(entry)
+
+
+def plan_rpmbuild_content(repos, target, config, index_cache=None,
+                          pkg_cache=None):
+    """
+    Compute, without fetching or writing anything, the actions which
+    create_rpmbuild_content (and create_rpm_installer) would take for each
+    of the given repos. The distributions are looked for in pkg_cache, by
+    default the target's SOURCES.
+
+    Returns a JSON serialisable dictionary of the distributions to fetch
+    (with their sizes, from the channel indexes), the specs to create or
+    update, and the existing specs which are no longer produced by any
+    environment (orphaned).
+
+    """
+    rpm_prefix = config['rpm']['prefix']
+    if pkg_cache is None:
+        pkg_cache = os.path.join(target, 'SOURCES')
+    spec_dir = os.path.join(target, 'SPECS')
+    batch = config['rpm'].get('batch')
+    batched = {}
+    if batch is not None:
+        batched = batched_dists(spec_dir, rpm_prefix)
+    plan = {'fetch': [], 'specs': [], '_expected': set()}
+    fetching = set()
+    labelled_tags = ((repo, labelled_tag) for repo in repos
+                     for labelled_tag in iter_labelled_tags(repo))
+    for repo, (env_name, label, tag, commit_num) in labelled_tags:
+        manifest, env_spec = read_tag(repo, tag)
+        to_batch = set()
+        for source, pkg in manifest:
+            tar_name = pkg + '.tar.bz2'
+            pkg_info = channel_index(source, tar_name, index_cache).get(
+                tar_name)
+            if pkg_info is None:
+                raise ValueError('Distribution {} is no longer available '
+                                 'in the channel {}.'.format(tar_name, source))
+            size = pkg_info.get('size')
+            if conda_install.is_fetched(pkg_cache, pkg):
+                size = os.path.getsize(os.path.join(pkg_cache, tar_name))
+            elif pkg not in fetching:
+                fetching.add(pkg)
+                plan['fetch'].append({'dist': pkg, 'channel': source,
+                                      'size': size})
+            fname = pkg_spec_name(rpm_prefix, pkg)
+            if pkg in batched:
+                plan['_expected'].add(batched[pkg])
+            elif os.path.exists(os.path.join(spec_dir, fname)):
+                plan['_expected'].add(fname)
+            elif (batch is not None and size is not None and
+                  size < batch.get('max_size', 2 ** 20)):
+                to_batch.add(tar_name)
+            else:
+                _plan_spec(plan, spec_dir, fname, 'pkg', dists=[pkg])
+        # As create_rpmbuild_for_env does, the new small distributions of
+        # each tag are batched together, and are then batched for the tags
+        # which follow.
+        if to_batch:
+            for batch_id, tar_names in batch_groups(
+                    to_batch, batch.get('max_dists', 50)):
+                fname = batch_spec_name(rpm_prefix, batch_id)
+                dists = [name[:-len('.tar.bz2')] for name in tar_names]
+                _plan_spec(plan, spec_dir, fname, 'batch', dists=dists)
+                batched.update((dist, fname) for dist in dists)
+
+        env, tag_id = tag.split('-', 2)[1:]
+        spec = generate.render_taggedenv(env, tag_id,
+                                         [pkg for _, pkg in manifest],
+                                         config, env_spec)
+        _plan_spec(plan, spec_dir, tag_spec_name(rpm_prefix, tag), 'tag',
+                   spec)
+        spec = generate.render_env(env_name, label, repo, config, tag,
+                                   commit_num)
+        _plan_spec(plan, spec_dir, label_spec_name(rpm_prefix, env_name,
+                                                   label), 'label', spec)
+    # The installer spec is always rewritten, so is only planned if missing.
+    _plan_spec(plan, spec_dir, '{}-installer.spec'.format(rpm_prefix),
+               'installer')
+
+    existing = []
+    if os.path.isdir(spec_dir):
+        existing = [fname for fname in os.listdir(spec_dir)
+                    if fname.endswith('.spec')]
+    plan['orphaned'] = sorted(set(existing) - plan.pop('_expected'))
+    plan['fetch_bytes'] = sum(item['size'] or 0 for item in plan['fetch'])
+    return plan
+
+
+def format_plan(plan):
+    """Return a human readable summary of a plan."""
+    lines = ['Distributions to fetch: {} ({:.1f} MB)'.format(
+        len(plan['fetch']), plan['fetch_bytes'] / 1e6)]
+    for item in plan['fetch']:
+        lines.append('    {dist} ({size} bytes) from {channel}'.format(**item))
+    lines.append('Specs to create or update: {}'.format(len(plan['specs'])))
+    for item in plan['specs']:
+        lines.append('    {action} {spec}'.format(**item))
+    lines.append('Orphaned specs: {}'.format(len(plan['orphaned'])))
+    for fname in plan['orphaned']:
+        lines.append('    {}'.format(fname))
+    return '\n'.join(lines)
 
 
 def create_rpm_installer(target, config, python_spec='python'):
-    rpm_prefix = config['rpm']['prefix']
-    index = conda.api.get_index()
+    import conda.api
+    import conda.fetch
+    from conda.resolve import Resolve, MatchSpec
+
+    with stats.timer('fetch_index'):
+        index = conda.api.get_index()
     matches = Resolve(index).get_pkgs(MatchSpec(python_spec))
     if not matches:
         raise RuntimeError('No python found in the channels.')
@@ -185,33 +714,210 @@ def create_rpm_installer(target, config, python_spec='python'):
                                   pkg_info['build'])
     pkg_cache = os.path.join(target, 'SOURCES') 
     if not conda_install.is_fetched(pkg_cache, dist_name):
+        stats.count('pkg_cache_misses')
         print('Fetching {}'.format(dist_name))
-        conda.fetch.fetch_pkg(pkg_info, pkg_cache)
+        with stats.timer('fetch_pkg'):
+            conda.fetch.fetch_pkg(pkg_info, pkg_cache)
+        tar_path = os.path.join(pkg_cache, dist_name + '.tar.bz2')
+        if os.path.exists(tar_path):
+            stats.count('bytes_downloaded', os.path.getsize(tar_path))
+    else:
+        stats.count('pkg_cache_hits')
 
     installer_source = os.path.join(os.path.dirname(__file__), 'install.py')
     installer_target = os.path.join(pkg_cache, 'install.py')
 
     shutil.copyfile(installer_source, installer_target)
 
-    spec_dir = os.path.join(target, 'SPECS')
-    if not os.path.exists(spec_dir):
-        os.makedirs(spec_dir)
-
-    specfile = os.path.join(spec_dir, '{}-installer.spec'.format(rpm_prefix))
-    with open(specfile, 'w') as fh:
-        fh.write(generate.render_installer(pkg_info, config))
+    for target_dir, target_config in rpmbuild_targets(target, config):
+        rpm_prefix = target_config['rpm']['prefix']
+        spec_dir = os.path.join(target_dir, 'SPECS')
+        if not os.path.exists(spec_dir):
+            os.makedirs(spec_dir)
+
+        specfile = os.path.join(spec_dir,
+                                '{}-installer.spec'.format(rpm_prefix))
+        with stats.timer('render_installer'):
+            spec = generate.render_installer(pkg_info, target_config)
+        with stats.timer('write_spec'), open(specfile, 'w') as fh:
+            fh.write(spec)
+
+
+def ref_snapshot(repo):
+    """Map the path of each branch and tag of the repo to its commit."""
+    return dict((ref.path, ref.commit.hexsha)
+                for ref in list(repo.heads) + list(repo.tags))
+
+
+def changed_environments(before, after):
+    """
+    Return the names of the environments whose branch, manifest branch or
+    tags differ between the two ref snapshots.
+    """
+    from conda_gitenv import manifest_branch_prefix
+
+    envs = set()
+    for path in set(before) | set(after):
+        if before.get(path) == after.get(path):
+            continue
+        if path.startswith('refs/heads/'):
+            name = path[len('refs/heads/'):]
+            if name.startswith(manifest_branch_prefix):
+                name = name[len(manifest_branch_prefix):]
+            envs.add(name)
+        elif path.startswith('refs/tags/'):
+            parts = path[len('refs/tags/'):].split('-', 2)
+            if len(parts) == 3:
+                envs.add(parts[1])
+    return envs
+
+
+def sync_repo(repo):
+    """
+    Fetch the repo's origin, and bring its local branches (and tags) up to
+    date with it.
+    """
+    from conda_gitenv.resolve import create_tracking_branches
+
+    with stats.timer('fetch'):
+        repo.remotes.origin.fetch(['+refs/heads/*:refs/remotes/origin/*',
+                                   '+refs/tags/*:refs/tags/*'])
+    # Detach the HEAD, so that any branch can be moved, and later checked
+    # out cleanly.
+    repo.head.reference = repo.head.commit
+    create_tracking_branches(repo)
+    for head in repo.heads:
+        tracking = head.tracking_branch()
+        if tracking is not None and head.commit != tracking.commit:
+            head.commit = tracking.commit
+
+
+def wait_for_trigger(interval, trigger=None, poll=1):
+    """
+    Sleep for interval seconds, or until the trigger file (if given) is
+    created or touched. Returns whether the trigger ended the wait.
+    """
+    def mtime():
+        try:
+            return os.path.getmtime(trigger)
+        except OSError:
+            return None
+    start_mtime = mtime() if trigger is not None else None
+    deadline = time.time() + interval
+    while time.time() < deadline:
+        time.sleep(max(min(poll, deadline - time.time()), 0))
+        if trigger is not None and mtime() != start_mtime:
+            return True
+    return False
+
+
+def watch(repos, target, config, interval=60, trigger=None, callback=None):
+    """
+    Poll the origins of the repos (every interval seconds, or when the
+    trigger file is touched) forever, regenerating the specs of only those
+    environments which have changed. The clones, and the channel indexes,
+    are kept between polls. The callback, if given, is called after each
+    regeneration.
+
+    A failure to sync or regenerate a repo (e.g. the network dropping, or a
+    distribution no longer being available) is reported, and the repo is
+    tried again at the next poll, rather than ending the watch.
+
+    """
+    import traceback
+
+    index_cache = {}
+    snapshots = [ref_snapshot(repo) for repo in repos]
+    while True:
+        wait_for_trigger(interval, trigger)
+        stats.reset()
+        changed = False
+        with stats.timer('total'):
+            synced = []
+            for index, repo in enumerate(repos):
+                try:
+                    sync_repo(repo)
+                except Exception:
+                    print('Failed to sync {}; retrying at the next '
+                          'poll.'.format(repo.working_dir))
+                    traceback.print_exc()
+                else:
+                    synced.append(index)
+            try:
+                check_environments(repos)
+            except ValueError as e:
+                print('Not regenerating: {}'.format(e))
+                continue
+            except Exception:
+                print('Not regenerating; retrying at the next poll.')
+                traceback.print_exc()
+                continue
+            for index in synced:
+                repo = repos[index]
+                new_snapshot = ref_snapshot(repo)
+                envs = changed_environments(snapshots[index], new_snapshot)
+                if envs:
+                    print('Regenerating {}'.format(', '.join(sorted(envs))))
+                    try:
+                        create_rpmbuild_content(repo, target, config,
+                                                envs=envs,
+                                                index_cache=index_cache)
+                    except Exception:
+                        # Keeping the old snapshot means the environments are
+                        # regenerated at the next poll.
+                        print('Failed to regenerate {}; retrying at the next '
+                              'poll.'.format(', '.join(sorted(envs))))
+                        traceback.print_exc()
+                        continue
+                    changed = True
+                snapshots[index] = new_snapshot
+        if changed and callback is not None:
+            callback()
 
 
 def configure_parser(parser):
-    parser.add_argument('repo_uri', help='Repo to deploy.')
+    parser.add_argument('repo_uri', nargs='+',
+                        help='Repo(s) to deploy. The distributions, and '
+                             'their specs, are shared between the repos, but '
+                             'no two repos may define the same environment.')
     parser.add_argument('target', help='Location to put the RPMBUILD content.')
     parser.add_argument('--config', '-c', type=str, default='config.yaml',
                         help='YAML configuration filename.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print a summary of the time spent in each '
+                             'phase of the run.')
+    parser.add_argument('--stats-json', metavar='FILENAME',
+                        help='Write the timings and counters of the run '
+                             'to this JSON file.')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print the distributions which would be fetched '
+                             'and the specs which would be created, updated '
+                             'or orphaned, without changing the target.')
+    parser.add_argument('--plan-json', metavar='FILENAME',
+                        help='Write the plan to this JSON file (implies '
+                             '--plan). It can be given to conda_rpms.build '
+                             'to build only the planned specs.')
+    parser.add_argument('--watch', action='store_true',
+                        help='After the first run, keep polling the repo, '
+                             'regenerating the specs of the environments '
+                             'which change.')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='The seconds between polls of the repo in '
+                             'watch mode.')
+    parser.add_argument('--trigger', metavar='FILENAME',
+                        help='In watch mode, poll the repo as soon as this '
+                             'file is created or touched.')
     parser.set_defaults(function=handle_args)
     return parser
 
 
 def handle_args(args):
+    # Import conda up-front (rather than lazily), so that its loggers exist
+    # by the time we quieten them.
+    import conda.api
+    import conda.fetch
+    from conda_gitenv.resolve import tempdir
+
     # To reduce the noise coming from conda/conda-build we set
     # all loggers to WARN level.
     logging.getLogger('').setLevel(logging.WARNING)
@@ -219,12 +925,51 @@ def handle_args(args):
         logger = logging.getLogger(logger_name)
         logger.setLevel(logging.WARNING)
 
+    def report_stats():
+        if args.stats:
+            print(stats.summary())
+        if args.stats_json:
+            with open(args.stats_json, 'w') as fh:
+                json.dump(stats.as_dict(), fh, indent=2, sort_keys=True)
+
     config = Config(args.config)
+    stats.reset()
     with tempdir() as repo_directory:
-        repo = Repo.clone_from(args.repo_uri, repo_directory)
-        create_tracking_branches(repo)
-        create_rpmbuild_content(repo, args.target, config)
-        create_rpm_installer(args.target, config)
+        index_cache = {}
+        with stats.timer('total'):
+            repos = clone_repos(args.repo_uri, repo_directory)
+            if args.plan or args.plan_json:
+                # The plan only reads the target, so its directories are
+                # not created.
+                targets = target_configs(args.target, config)
+                pkg_cache = os.path.join(args.target, 'SOURCES')
+                plans = {}
+                for target_dir, target_config in targets:
+                    plan = plan_rpmbuild_content(repos, target_dir,
+                                                 target_config,
+                                                 index_cache=index_cache,
+                                                 pkg_cache=pkg_cache)
+                    if len(targets) > 1:
+                        print('Target {}:'.format(target_dir))
+                    print(format_plan(plan))
+                    plans[os.path.basename(target_dir)] = plan
+                if args.plan_json:
+                    if len(targets) > 1:
+                        plan = {'targets': plans}
+                    with open(args.plan_json, 'w') as fh:
+                        json.dump(plan, fh, indent=2, sort_keys=True)
+                return
+            for repo in repos:
+                create_rpmbuild_content(repo, args.target, config,
+                                        index_cache=index_cache)
+            create_rpm_installer(args.target, config)
+        report_stats()
+        if args.watch:
+            try:
+                watch(repos, args.target, config, interval=args.interval,
+                      trigger=args.trigger, callback=report_stats)
+            except KeyboardInterrupt:
+                pass
 
 
 def main():
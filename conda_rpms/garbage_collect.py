@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+Remove (or archive) the SOURCES, SPECS and built RPMs of an RPM build
+directory which are no longer referenced by any labelled tag of the gitenv(s).
+
+"""
+from __future__ import division, print_function
+
+import glob
+import json
+import os
+import shutil
+import time
+
+import conda_rpms.build as build
+import conda_rpms.build_rpm_structure as structure
+from conda_rpms.store import PackageStore
+
+#: The suffixes of the files in SOURCES which may be collected. Anything else
+#: (e.g. install.py, or directories) is left alone.
+source_suffixes = ('.tar.bz2', '.tar.gz', '.tar', '.md5')
+
+
+def live_tags(repo, retention_days=None, now=None):
+    """
+    Return the set of tags which are labelled, or (given a retention window)
+    whose commit is less than retention_days old, and a list of the
+    (environment, label) pairs of the labels.
+
+    """
+    tags = set()
+    labels = []
+    for env_name, label, tag, _ in structure.iter_labelled_tags(repo):
+        tags.add(tag)
+        labels.append((env_name, label))
+    if retention_days is not None:
+        if now is None:
+            now = time.time()
+        cutoff = now - retention_days * 24 * 60 * 60
+        for tag in repo.tags:
+            if (tag.name.startswith('env-') and
+                    tag.commit.committed_date >= cutoff):
+                tags.add(tag.name)
+    return tags, labels
+
+
+def manifest_dists(repo, tag_name):
+    """Return the distributions of the manifest of the tag, without a checkout."""
+    blob = repo.tags[tag_name].commit.tree / 'env.manifest'
+    content = blob.data_stream.read().decode('utf-8')
+    return [line.strip().split('\t')[1] for line in content.splitlines()
+            if line.strip()]
+
+
+def live_files(repos, target, config, retention_days=None):
+    """
+    Return the live files of the build directory target, shared by the given
+    repos: a dictionary of the filenames of the live specs (in SPECS) of each
+    of its rpmbuild directories (one per target of the configuration), the
+    set of the live sources (in the shared SOURCES), and a dictionary of the
+    filenames of the live RPMs of each rpmbuild directory.
+
+    Each manifest is read once, and each live spec once, so the time taken
+    grows with the number of tags and files, not with their product.
+
+    """
+    dists = set()
+    tags = set()
+    labels = []
+    for repo in repos:
+        repo_tags, repo_labels = live_tags(repo, retention_days)
+        for tag in repo_tags:
+            dists.update(manifest_dists(repo, tag))
+        tags.update(repo_tags)
+        labels.extend(repo_labels)
+
+    # The tarballs as fetched are kept too, so that a live distribution is
+    # never fetched again.
+    sources = set(dist + '.tar.bz2' for dist in dists)
+    specs = {}
+    rpms = {}
+    for target_dir, target_config in structure.target_configs(target, config):
+        rpm_prefix = target_config['rpm']['prefix']
+        spec_dir = os.path.join(target_dir, 'SPECS')
+        target_specs = set(['{}-installer.spec'.format(rpm_prefix)])
+        target_specs.update(structure.tag_spec_name(rpm_prefix, tag)
+                            for tag in tags)
+        target_specs.update(structure.label_spec_name(rpm_prefix, env_name,
+                                                      label)
+                            for env_name, label in labels)
+        batched = structure.batched_dists(spec_dir, rpm_prefix)
+        for dist in dists:
+            target_specs.add(batched.get(
+                dist, structure.pkg_spec_name(rpm_prefix, dist)))
+        target_rpms = set()
+        for spec in target_specs:
+            spec_path = os.path.join(spec_dir, spec)
+            if not os.path.exists(spec_path):
+                continue
+            sources.update(build.spec_sources(spec_path))
+            with open(spec_path, 'r') as fh:
+                target_rpms.update(build.rpm_names(fh))
+        specs[target_dir] = target_specs
+        rpms[target_dir] = target_rpms
+    sources.update([source + '.md5' for source in sources])
+    return specs, sources, rpms
+
+
+def _candidates(directory, pattern, live, min_mtime=None):
+    """Return the paths in directory, matching pattern, which aren't live."""
+    paths = []
+    for path in glob.glob(os.path.join(directory, pattern)):
+        if os.path.basename(path) in live or not os.path.isfile(path):
+            continue
+        if min_mtime is not None and os.path.getmtime(path) >= min_mtime:
+            continue
+        paths.append(path)
+    return paths
+
+
+def collect(target, live, rpm_dirs=(), retention_days=None, archive=None,
+            dry_run=False):
+    """
+    Remove the files of the build directory target (and the RPMs of rpm_dirs)
+    which aren't in live, the (specs, sources, rpms) returned by live_files:
+    the specs and RPMs of each of its rpmbuild directories, and the sources
+    of its shared SOURCES. With a retention window, files modified within it
+    are kept too.
+
+    If an archive directory is given, the files are moved into its SOURCES,
+    SPECS and RPMS subdirectories rather than removed.
+
+    Returns a report of the files collected, and the bytes reclaimed, by kind.
+
+    """
+    specs, sources, rpms = live
+    min_mtime = None
+    if retention_days is not None:
+        min_mtime = time.time() - retention_days * 24 * 60 * 60
+    candidates = {
+        'SOURCES': [path for path in _candidates(
+                        os.path.join(target, 'SOURCES'), '*', sources,
+                        min_mtime)
+                    if path.endswith(source_suffixes)],
+        'SPECS': [],
+        'RPMS': []}
+    for target_dir in sorted(specs):
+        candidates['SPECS'].extend(_candidates(
+            os.path.join(target_dir, 'SPECS'), '*.spec', specs[target_dir],
+            min_mtime))
+        candidates['RPMS'].extend(_candidates(
+            os.path.join(target_dir, 'RPMS', 'x86_64'), '*.rpm',
+            rpms[target_dir], min_mtime))
+    # The further directories may have the RPMs of any of the targets.
+    all_rpms = set()
+    for target_rpms in rpms.values():
+        all_rpms.update(target_rpms)
+    for rpm_dir in rpm_dirs:
+        candidates['RPMS'].extend(_candidates(rpm_dir, '*.rpm', all_rpms,
+                                              min_mtime))
+
+    report = {}
+    for kind, paths in sorted(candidates.items()):
+        reclaimed = 0
+        for path in paths:
+            reclaimed += os.path.getsize(path)
+            if dry_run:
+                continue
+            if archive is None:
+                os.remove(path)
+            else:
+                archive_dir = os.path.join(archive, kind)
+                if not os.path.isdir(archive_dir):
+                    os.makedirs(archive_dir)
+                shutil.move(path, os.path.join(archive_dir,
+                                               os.path.basename(path)))
+        report[kind] = {'files': sorted(paths), 'bytes': reclaimed}
+    if not dry_run:
+        # The store's objects of the collected tarballs are no longer linked
+        # to, and so can go too (their bytes are already counted above).
+        store = PackageStore(os.path.join(target, 'SOURCES'))
+        if os.path.isdir(store.store_dir):
+            store.prune()
+            store.save()
+    return report
+
+
+def format_report(report, dry_run=False):
+    """Return a human readable summary of the report of collect."""
+    verb = 'Would reclaim' if dry_run else 'Reclaimed'
+    lines = []
+    for kind in sorted(report):
+        lines.append('{:<8} {:>6} files  {:>10.1f} MB'.format(
+            kind, len(report[kind]['files']), report[kind]['bytes'] / 1e6))
+    total = sum(item['bytes'] for item in report.values())
+    lines.append('{} {:.1f} MB.'.format(verb, total / 1e6))
+    return '\n'.join(lines)
+
+
+def configure_parser(parser):
+    parser.add_argument('repo_uri', nargs='+',
+                        help='The gitenv repo(s) of the environments.')
+    parser.add_argument('target', help='The RPMBUILD directory to collect.')
+    parser.add_argument('--config', '-c', type=str, default='config.yaml',
+                        help='YAML configuration filename.')
+    parser.add_argument('--rpm-dir', action='append', default=[],
+                        help='A further directory of built RPMs to collect '
+                             '(may be given more than once).')
+    parser.add_argument('--retention-days', type=float,
+                        help='Keep the files of tags created, and any file '
+                             'modified, within this many days.')
+    parser.add_argument('--archive', metavar='DIRECTORY',
+                        help='Move the collected files here, rather than '
+                             'removing them.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report what would be collected, without '
+                             'changing anything.')
+    parser.add_argument('--report', metavar='FILENAME',
+                        help='Write the collected files, and the bytes '
+                             'reclaimed, to this JSON file.')
+    parser.set_defaults(function=handle_args)
+    return parser
+
+
+def handle_args(args):
+    from conda_gitenv.resolve import tempdir
+
+    config = structure.Config(args.config)
+    with tempdir() as repo_directory:
+        repos = structure.clone_repos(args.repo_uri, repo_directory)
+        live = live_files(repos, args.target, config, args.retention_days)
+    report = collect(args.target, live, rpm_dirs=args.rpm_dir,
+                     retention_days=args.retention_days,
+                     archive=args.archive, dry_run=args.dry_run)
+    print(format_report(report, args.dry_run))
+    if args.report:
+        with open(args.report, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Collect the SOURCES, SPECS '
+                                                 'and RPMs no longer needed by '
+                                                 'the tracked environments.')
+    configure_parser(parser)
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,211 @@
 import os
-import jinja2
+import re
+import tarfile
+import json
 
 
 template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-loader = jinja2.FileSystemLoader(template_dir)
 
-env = jinja2.Environment(loader=loader)
+#: The environment variable naming a directory in which to cache the compiled
+#: templates between runs.
+bytecode_cache_env_var = 'CONDA_RPMS_TEMPLATE_CACHE'
 
-pkg_spec_tmpl = env.get_template('pkg.spec.template')
-env_spec_tmpl = env.get_template('env.spec.template')
-taggedenv_spec_tmpl = env.get_template('taggedenv.spec.template')
-installer_spec_tmpl = env.get_template('installer.spec.template')
+_environment = None
 
-import tarfile
-import json
-import yaml
 
+def environment():
+    """
+    Return the Jinja environment of the spec templates, which is created (and
+    jinja2 imported) on first use, as it is slow to import.
+    """
+    global _environment
+    if _environment is None:
+        import jinja2
+        loader = jinja2.FileSystemLoader(template_dir)
+        bytecode_cache = None
+        cache_dir = os.environ.get(bytecode_cache_env_var)
+        if cache_dir:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        _environment = jinja2.Environment(loader=loader,
+                                          bytecode_cache=bytecode_cache)
+    return _environment
 
-def render_dist_spec(dist, config):
-    with tarfile.open(dist, 'r:bz2') as tar:
-        m = tar.getmember('info/index.json')
-        fh = tar.extractfile(m)
-        import codecs
 
-        reader = codecs.getreader("utf-8")
-        pkginfo = json.load(reader(fh))
+def get_template(name):
+    """Return the named template, which is compiled the first time it is used."""
+    return environment().get_template(name)
+
+
+#: The index and recipe meta of each distribution tarball read, by path, with
+#: the size and modification time of the tarball when it was read.
+_dist_info_cache = {}
+
 
-        try:
-            m = tar.getmember('info/recipe.json')
-        except KeyError:
-            m = None
+def clear_dist_info_cache():
+    """Forget the distribution tarballs read by read_dist_info."""
+    _dist_info_cache.clear()
 
-        if m:
-            fh = tar.extractfile(m)
-            meta = yaml.safe_load(reader(fh))
-        else:
-            meta = {}
+
+def read_dist_info(dist):
+    """
+    Return the index (info/index.json) and recipe meta (info/recipe.json) of the
+    given conda distribution tarball.
+
+    The result is cached until the tarball changes (or the cache is cleared,
+    as it is after each run of build_rpm_structure.create_rpmbuild_content),
+    so should not be modified.
+    """
+    import codecs
+    import yaml
+
+    st = os.stat(dist)
+    key = (st.st_size, st.st_mtime)
+    cached = _dist_info_cache.get(dist)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    reader = codecs.getreader("utf-8")
+    pkginfo = meta = None
+    with tarfile.open(dist, 'r:bz2') as tar:
+        # Read the archive only as far as the members we need.
+        for m in tar:
+            if m.name == 'info/index.json':
+                pkginfo = json.load(reader(tar.extractfile(m)))
+            elif m.name == 'info/recipe.json':
+                meta = yaml.safe_load(reader(tar.extractfile(m)))
+            if pkginfo is not None and meta is not None:
+                break
+    if pkginfo is None:
+        raise KeyError("filename 'info/index.json' not found in {}".format(dist))
+    if meta is None:
+        meta = {}
 
     meta_about = meta.setdefault('about', {})
     meta_about.setdefault('license', pkginfo.get('license'))
     meta_about.setdefault('summary', 'The {} package'.format(pkginfo['name']))
+    result = pkginfo, meta
+    _dist_info_cache[dist] = (key, result)
+    return result
+
+
+#: How a package RPM puts its files into the buildroot: by copying them from
+#: the BUILD tree, by hard linking them from the BUILD tree, or by extracting
+#: the tarball straight into the buildroot.
+install_strategies = ('copy', 'link', 'extract')
 
-    rpm_prefix = config['rpm']['prefix']
-    install_prefix = config['install']['prefix']
 
+def pkg_spec_context(config):
+    """
+    Return the template context, from the given configuration, which is
+    common to all package specs.
+    """
+    install_strategy = config['rpm'].get('install_strategy', 'copy')
+    if install_strategy not in install_strategies:
+        raise ValueError('Unknown install strategy {!r}, expected one of '
+                         '{}.'.format(install_strategy,
+                                      ', '.join(install_strategies)))
+    return {'rpm_prefix': config['rpm']['prefix'],
+            'install_prefix': config['install']['prefix'],
+            'source_format': config['rpm'].get('source_format', 'tar.bz2'),
+            'install_strategy': install_strategy}
+
+
+#: The default size, in bytes, of the distribution tarballs whose RPMs use the
+#: "large" payload compression.
+default_large_size = 100 * 2 ** 20
+
+_payload_re = re.compile(r'^w\d*(T\d*)?\.\w+dio$')
+
+
+def payload_compression(config, size):
+    """
+    Return the rpm payload compression (e.g. "w9.xzdio") configured for a
+    distribution tarball of the given size, or None for rpm's default.
+
+    The configuration's optional rpm:payload section gives the compression of
+    "small" and of "large" distributions, those of at least "large_size"
+    bytes.
+
+    """
+    payload = config['rpm'].get('payload')
+    if payload is None:
+        return None
+    if size >= payload.get('large_size', default_large_size):
+        compression = payload.get('large')
+    else:
+        compression = payload.get('small')
+    if compression is not None and not _payload_re.match(compression):
+        raise ValueError('Invalid rpm payload compression {!r}, expected '
+                         'e.g. "w9.xzdio" or "w1.gzdio".'.format(compression))
+    return compression
+
+
+def render_dist_spec(dist, config):
+    pkginfo, meta = read_dist_info(dist)
+
+    pkg_spec_tmpl = get_template('pkg.spec.template')
     return pkg_spec_tmpl.render(pkginfo=pkginfo,
                                 meta=meta,
-                                rpm_prefix=rpm_prefix,
-                                install_prefix=install_prefix)
+                                payload=payload_compression(
+                                    config, os.path.getsize(dist)),
+                                **pkg_spec_context(config))
+
+
+def render_batch_spec(dists, config, batch_id):
+    """
+    Render a single spec which builds the package RPMs of all of the given
+    distribution tarballs, as subpackages. Each subpackage is named, and
+    installs, exactly as the RPM of the distribution's own spec would.
+
+    The files of a batch are always extracted straight into the buildroot,
+    whatever the configured install strategy.
+
+    """
+    pkgs = []
+    for dist in dists:
+        pkginfo, meta = read_dist_info(dist)
+        pkg_id = '{}-{}-{}'.format(pkginfo['name'], pkginfo['version'],
+                                   pkginfo['build'])
+        pkgs.append({'id': pkg_id, 'pkginfo': pkginfo, 'meta': meta})
+    size = sum(os.path.getsize(dist) for dist in dists)
+
+    pkgbatch_spec_tmpl = get_template('pkgbatch.spec.template')
+    return pkgbatch_spec_tmpl.render(pkgs=pkgs,
+                                     batch_id=batch_id,
+                                     payload=payload_compression(config, size),
+                                     **pkg_spec_context(config))
+
+
+def render_many(dists, config, processes=1):
+    """
+    Generate (dist, spec) pairs for each of the given distribution tarballs, in
+    order, sharing the template and the configuration context between them.
+    With more than one process, the tarballs are read by a pool of processes.
+    """
+    dists = list(dists)
+    pkg_spec_tmpl = get_template('pkg.spec.template')
+    context = pkg_spec_context(config)
+    pool = None
+    if processes != 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        infos = pool.imap(read_dist_info, dists)
+    else:
+        infos = (read_dist_info(dist) for dist in dists)
+    try:
+        for dist in dists:
+            pkginfo, meta = next(infos)
+            context['pkginfo'] = pkginfo
+            context['meta'] = meta
+            context['payload'] = payload_compression(config,
+                                                     os.path.getsize(dist))
+            yield dist, pkg_spec_tmpl.render(context)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 def render_env(branch_name, label, repo, config, tag, commit_num):
     env_info = {'url': 'http://link/to/gh',
@@ -57,6 +215,7 @@ def render_env(branch_name, label, repo, config, tag, commit_num):
                 'version': commit_num,}
     install_prefix = config['install']['prefix']
     rpm_prefix = config['rpm']['prefix']
+    env_spec_tmpl = get_template('env.spec.template')
     return env_spec_tmpl.render(install_prefix=install_prefix,
                                 rpm_prefix=rpm_prefix, env=env_info,
                                 labelled_tag=tag.split('-')[-1])
@@ -71,18 +230,28 @@ def render_taggedenv(env_name, tag, pkgs, config, env_spec):
                 'spec': '\n'.join(env_spec)}
     rpm_prefix = config['rpm']['prefix']
     install_prefix = config['install']['prefix']
+    compile_pyc = config['install'].get('compile_pyc', False)
+    meta_index = config['install'].get('meta_index', False)
+    fast_remove = config['install'].get('fast_remove', False)
+    taggedenv_spec_tmpl = get_template('taggedenv.spec.template')
     return taggedenv_spec_tmpl.render(install_prefix=install_prefix,
                                       pkgs=pkgs,
                                       rpm_prefix=rpm_prefix,
-                                      env=env_info)
+                                      env=env_info,
+                                      compile_pyc=compile_pyc,
+                                      meta_index=meta_index,
+                                      fast_remove=fast_remove)
 
 
 def render_installer(pkg_info, config):
     rpm_prefix = config['rpm']['prefix']
     install_prefix = config['install']['prefix']
+    dedup_pkgs = config['install'].get('dedup_pkgs', False)
+    installer_spec_tmpl = get_template('installer.spec.template')
     return installer_spec_tmpl.render(install_prefix=install_prefix,
                                       rpm_prefix=rpm_prefix,
-                                      pkg_info=pkg_info)
+                                      pkg_info=pkg_info,
+                                      dedup_pkgs=dedup_pkgs)
 
 
 if __name__ == '__main__':
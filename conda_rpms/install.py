@@ -35,31 +35,56 @@ the standard library).
 '''
 
 
+import binascii
+import contextlib
 import time
 import os
+import errno
 import json
 import shutil
 import stat
 import sys
 import subprocess
 import tarfile
+import tempfile
 import traceback
 import logging
 import shlex
 from os.path import abspath, basename, dirname, isdir, isfile, islink, join
 
+class Locked(object):
+    """
+    A no-op stand-in for conda's Locked, so that this still works as a
+    standalone script for the Anaconda installer.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+    def __enter__(self):
+        pass
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+def _conda_locked(path):
+    """
+    Return conda's Locked on path (or, without conda, the no-op Locked).
+    conda is slow to import, so it is only imported here, where flock isn't
+    available.
+    """
+    try:
+        from conda.lock import Locked as conda_Locked
+    except ImportError:
+        return Locked(path)
+    return conda_Locked(path)
+
 try:
-    from conda.lock import Locked
+    import fcntl
 except ImportError:
-    # Make sure this still works as a standalone script for the Anaconda
-    # installer.
-    class Locked(object):
-        def __init__(self, *args, **kwargs):
-            pass
-        def __enter__(self):
-            pass
-        def __exit__(self, exc_type, exc_value, traceback):
-            pass
+    fcntl = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 on_win = bool(sys.platform == 'win32')
 
@@ -143,6 +168,106 @@ def _link(src, dst, linktype=LINK_HARD):
         raise Exception("Did not expect linktype=%r" % linktype)
 
 
+lock_name = '.conda_rpms.lock'
+
+class DirLock(object):
+    """
+    An advisory lock on a directory (which is created if necessary).
+
+    Any number of shared locks may be held on a directory at once, whereas
+    an exclusive lock excludes all other locks.  The lock is taken with
+    flock(2) on the directory itself, so no lock files are left behind in
+    the prefix or the package cache.  Where the filesystem can't lock the
+    (read-only) directory, as NFS can't, the lock is instead taken on a
+    `lock_name` file within it, opened for writing.  Where flock is not
+    available at all, this falls back to an exclusive conda Locked.
+
+    """
+    #: The errors of flock on a directory of a filesystem which needs a
+    #: writable file to lock (NFS implements flock with byte-range locks).
+    _unlockable = (errno.EBADF, errno.ENOLCK, errno.EOPNOTSUPP)
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        #: The number of seconds spent waiting for the lock.
+        self.wait = 0.0
+        self._fd = None
+        self._fallback = None
+
+    def __enter__(self):
+        if not isdir(self.path):
+            os.makedirs(self.path)
+        start = time.time()
+        if fcntl is None:
+            self._fallback = _conda_locked(self.path)
+            self._fallback.__enter__()
+        else:
+            try:
+                self._flock(os.open(self.path, os.O_RDONLY))
+            except (IOError, OSError) as e:
+                if e.errno not in self._unlockable:
+                    raise
+                self._flock(os.open(join(self.path, lock_name),
+                                    os.O_RDWR | os.O_CREAT, 0o644))
+        self.wait = time.time() - start
+        return self
+
+    def _flock(self, fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._fallback is not None:
+            self._fallback.__exit__(exc_type, exc_value, traceback)
+            self._fallback = None
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+telemetry_env_var = 'CONDA_RPMS_TELEMETRY'
+telemetry_name = '.telemetry.jsonl'
+
+class Telemetry(object):
+    """
+    Timings and counters of a single operation on a prefix, which are
+    appended as a line of JSON to <prefix>/conda-meta/.telemetry.jsonl.
+    A disabled instance records nothing.
+
+    """
+    def __init__(self, enabled, **info):
+        self.enabled = enabled
+        self.record = dict(info)
+
+    def add(self, name, value=1):
+        if self.enabled:
+            self.record[name] = self.record.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Add the time spent within the context to `<name>_seconds`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name + '_seconds', time.time() - start)
+
+    def write(self, prefix):
+        if not self.enabled or not isdir(prefix):
+            return
+        meta_dir = join(prefix, 'conda-meta')
+        if not isdir(meta_dir):
+            os.makedirs(meta_dir)
+        with open(join(meta_dir, telemetry_name), 'a') as fo:
+            fo.write(json.dumps(self.record, sort_keys=True) + '\n')
+
+
 def _remove_readonly(func, path, excinfo):
     os.chmod(path, stat.S_IWRITE)
     func(path)
@@ -253,6 +378,10 @@ def binary_replace(data, a, b):
 
 def update_prefix(path, new_prefix, placeholder=prefix_placeholder,
                   mode='text'):
+    """
+    Replace the placeholder in the file at path with new_prefix, returning
+    the number of bytes written (0 if the file needed no change).
+    """
     if on_win and (placeholder != prefix_placeholder) and ('/' in placeholder):
         # original prefix uses unix-style path separators
         # replace with unix-style path separators
@@ -271,17 +400,122 @@ def update_prefix(path, new_prefix, placeholder=prefix_placeholder,
         sys.exit("Invalid mode:" % mode)
 
     if new_data == data:
-        return
+        return 0
     st = os.lstat(path)
     with open(path, 'wb') as fo:
         fo.write(new_data)
     os.chmod(path, stat.S_IMODE(st.st_mode))
+    return len(new_data)
 
 
 def name_dist(dist):
     return dist.rsplit('-', 2)[0]
 
 
+meta_index_name = '.index.sqlite'
+
+def _open_meta_index(prefix, create=False):
+    """
+    Return a connection to the conda-meta index of prefix, or None if the
+    prefix is not indexed (or sqlite3 is not available, or the index is
+    unusable). The index is only a cache of the JSON files in conda-meta,
+    so without it they are read instead.
+    """
+    if sqlite3 is None:
+        return None
+    path = join(prefix, 'conda-meta', meta_index_name)
+    if not create and not isfile(path):
+        return None
+    conn = None
+    try:
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dists (
+                dist TEXT PRIMARY KEY, mtime REAL, size INTEGER, meta TEXT);
+            CREATE TABLE IF NOT EXISTS files (path TEXT, dist TEXT);
+            CREATE INDEX IF NOT EXISTS files_path ON files (path);
+            CREATE INDEX IF NOT EXISTS files_dist ON files (dist);
+        """)
+    except sqlite3.Error as e:
+        log.warn('conda-meta index %r unusable: %r' % (path, e))
+        if conn is not None:
+            conn.close()
+        return None
+    return conn
+
+def _index_meta(conn, prefix, dist, meta):
+    """
+    Mirror the conda metadata of dist into the index, along with the stat
+    of its JSON file which is used to detect changes made without the index.
+    """
+    st = os.stat(join(prefix, 'conda-meta', dist + '.json'))
+    info = dict((k, v) for k, v in meta.items() if k != 'files')
+    with conn:
+        conn.execute('DELETE FROM files WHERE dist = ?', (dist,))
+        conn.execute('INSERT OR REPLACE INTO dists VALUES (?, ?, ?, ?)',
+                     (dist, st.st_mtime, st.st_size, json.dumps(info)))
+        conn.executemany('INSERT INTO files VALUES (?, ?)',
+                         ((f, dist) for f in meta.get('files', [])))
+
+def _unindex_meta(conn, dist):
+    with conn:
+        conn.execute('DELETE FROM files WHERE dist = ?', (dist,))
+        conn.execute('DELETE FROM dists WHERE dist = ?', (dist,))
+
+def _indexed_meta(conn, prefix, dist):
+    """
+    Return the conda metadata of dist from the index, or None if it is not
+    indexed or its JSON file has changed since it was.
+    """
+    try:
+        st = os.stat(join(prefix, 'conda-meta', dist + '.json'))
+    except OSError:
+        return None
+    row = conn.execute('SELECT mtime, size, meta FROM dists WHERE dist = ?',
+                       (dist,)).fetchone()
+    if row is None or (row[0], row[1]) != (st.st_mtime, st.st_size):
+        return None
+    meta = json.loads(row[2])
+    meta['files'] = [path for path, in conn.execute(
+        'SELECT path FROM files WHERE dist = ? ORDER BY rowid', (dist,))]
+    return meta
+
+def _refresh_meta_index(conn, prefix):
+    """
+    Bring the index up to date with the JSON files in conda-meta.
+    """
+    dists = linked(prefix)
+    indexed = dict((dist, (mtime, size)) for dist, mtime, size in
+                   conn.execute('SELECT dist, mtime, size FROM dists'))
+    for dist in set(indexed) - dists:
+        _unindex_meta(conn, dist)
+    for dist in sorted(dists):
+        meta_path = join(prefix, 'conda-meta', dist + '.json')
+        st = os.stat(meta_path)
+        if indexed.get(dist) != (st.st_mtime, st.st_size):
+            with open(meta_path) as fi:
+                _index_meta(conn, prefix, dist, json.load(fi))
+
+def _write_meta(prefix, dist, meta):
+    """
+    Write the conda metadata of dist into <prefix>/conda-meta/<dist>.json,
+    and into the conda-meta index if the prefix has one.
+    """
+    meta_dir = join(prefix, 'conda-meta')
+    if not isdir(meta_dir):
+        os.makedirs(meta_dir)
+    with open(join(meta_dir, dist + '.json'), 'w') as fo:
+        json.dump(meta, fo, indent=2, sort_keys=True)
+    conn = _open_meta_index(prefix)
+    if conn is not None:
+        try:
+            _index_meta(conn, prefix, dist, meta)
+        except sqlite3.Error as e:
+            log.warn('conda-meta index unusable: %r' % e)
+        finally:
+            conn.close()
+
+
 def create_meta(prefix, dist, info_dir, extra_info):
     """
     Create the conda metadata, in a given prefix, for a given package.
@@ -292,11 +526,7 @@ def create_meta(prefix, dist, info_dir, extra_info):
     # add extra info
     meta.update(extra_info)
     # write into <env>/conda-meta/<dist>.json
-    meta_dir = join(prefix, 'conda-meta')
-    if not isdir(meta_dir):
-        os.makedirs(meta_dir)
-    with open(join(meta_dir, dist + '.json'), 'w') as fo:
-        json.dump(meta, fo, indent=2, sort_keys=True)
+    _write_meta(prefix, dist, meta)
 
 
 def mk_menus(prefix, files, remove=False):
@@ -399,6 +629,35 @@ def symlink_conda(prefix, root_dir):
     if not os.path.lexists(prefix_deactivate):
         os.symlink(root_deactivate, prefix_deactivate)
 
+def hash_file(path, algorithm='sha256', blocksize=2 ** 20):
+    """
+    Return the hex digest of the content of the file at path.
+    """
+    import hashlib
+
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as fi:
+        for block in iter(lambda: fi.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _replace_with_link(src, dst):
+    """
+    Atomically replace dst with a hard link to src, returning True on
+    success and False if a hard link could not be made.
+    """
+    tmp = dst + '.dedup-tmp'
+    try:
+        _link(src, tmp, LINK_HARD)
+    except OSError:
+        return False
+    if on_win:
+        os.unlink(dst)
+    os.rename(tmp, dst)
+    return True
+
+
 # ========================== begin API functions =========================
 
 def try_hard_link(pkgs_dir, prefix, dist):
@@ -429,7 +688,7 @@ def is_fetched(pkgs_dir, dist):
     return isfile(join(pkgs_dir, dist + '.tar.bz2'))
 
 def rm_fetched(pkgs_dir, dist):
-    with Locked(pkgs_dir):
+    with DirLock(pkgs_dir):
         path = join(pkgs_dir, dist + '.tar.bz2')
         rm_rf(path)
 
@@ -445,34 +704,146 @@ def extracted(pkgs_dir):
                if (isfile(join(pkgs_dir, dn, 'info', 'files')) and
                    isfile(join(pkgs_dir, dn, 'info', 'index.json'))))
 
+def _root_owned(members):
+    """
+    Yield the given tar members, changing their ownership to root as they
+    are extracted (our implementation of --no-same-owner).
+    """
+    for member in members:
+        member.uid = member.gid = 0
+        member.uname = member.gname = 'root'
+        yield member
+
+def _extract(pkgs_dir, dist):
+    path = join(pkgs_dir, dist)
+    t = tarfile.open(path + '.tar.bz2')
+    try:
+        if sys.platform.startswith('linux') and os.getuid() == 0:
+            # When extracting as root, tarfile will by restore ownership
+            # of extracted files.  However, we want root to be the owner,
+            # which we set on each member as it is written, rather than
+            # walking the extracted tree afterwards.
+            t.extractall(path=path, members=_root_owned(t))
+        else:
+            t.extractall(path=path)
+    finally:
+        t.close()
+    return dist
+
+def _extract_star(args):
+    return _extract(*args)
+
 def extract(pkgs_dir, dist):
     """
     Extract a package, i.e. make a package available for linkage.  We assume
     that the compressed packages is located in the packages directory.
     """
-    with Locked(pkgs_dir):
-        path = join(pkgs_dir, dist)
-        t = tarfile.open(path + '.tar.bz2')
-        t.extractall(path=path)
-        t.close()
-        if sys.platform.startswith('linux') and os.getuid() == 0:
-            # When extracting as root, tarfile will by restore ownership
-            # of extracted files.  However, we want root to be the owner
-            # (our implementation of --no-same-owner).
-            for root, dirs, files in os.walk(path):
-                for fn in files:
-                    p = join(root, fn)
-                    os.lchown(p, 0, 0)
+    with DirLock(pkgs_dir):
+        _extract(pkgs_dir, dist)
+
+def extract_all(pkgs_dir, dists=None, processes=None):
+    """
+    Extract many packages concurrently across a pool of `processes` worker
+    processes (defaults to the number of CPUs).  By default, all fetched
+    packages which are not yet extracted are extracted.  Return the list
+    of extracted packages.
+    """
+    import multiprocessing
+
+    with DirLock(pkgs_dir):
+        if dists is None:
+            dists = fetched(pkgs_dir) - extracted(pkgs_dir)
+        dists = sorted(dists)
+        if not dists:
+            return []
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_extract_star,
+                            [(pkgs_dir, dist) for dist in dists],
+                            chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
 
 def is_extracted(pkgs_dir, dist):
     return (isfile(join(pkgs_dir, dist, 'info', 'files')) and
             isfile(join(pkgs_dir, dist, 'info', 'index.json')))
 
 def rm_extracted(pkgs_dir, dist):
-    with Locked(pkgs_dir):
+    with DirLock(pkgs_dir):
         path = join(pkgs_dir, dist)
         rm_rf(path)
 
+dedup_index_name = '.dedup-index.json'
+
+def dedup(pkgs_dir, index_path=None):
+    """
+    Replace byte-identical files of the extracted packages in pkgs_dir with
+    hard links to a single copy, and return the number of bytes reclaimed.
+    The content hashes are kept in a persistent index (by default in
+    pkgs_dir) so that subsequent runs only hash new or modified files.
+
+    Only files which also have the same metadata (mode, ownership and
+    modification time) are linked, so that `rpm -V` of the packages which
+    installed them still passes.
+    """
+    if index_path is None:
+        index_path = join(pkgs_dir, dedup_index_name)
+    try:
+        with open(index_path) as fi:
+            index = json.load(fi)
+    except (IOError, ValueError):
+        index = {}
+
+    new_index = {}
+    # Map the content (and the attributes a hard link would share) to the
+    # first path found with it, and the inodes seen so far to their hash.
+    canonical = {}
+    inode_hashes = {}
+    reclaimed = 0
+    with DirLock(pkgs_dir):
+        for dist in sorted(extracted(pkgs_dir)):
+            for root, dirs, files in os.walk(join(pkgs_dir, dist)):
+                dirs.sort()
+                for fn in sorted(files):
+                    path = join(root, fn)
+                    st = os.lstat(path)
+                    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                        continue
+                    rel = os.path.relpath(path, pkgs_dir)
+                    inode = (st.st_dev, st.st_ino)
+                    entry = index.get(rel)
+                    if inode in inode_hashes:
+                        digest = inode_hashes[inode]
+                    elif (entry is not None and
+                            entry[:3] == [st.st_size, st.st_mtime, st.st_ino]):
+                        digest = entry[3]
+                    else:
+                        digest = hash_file(path)
+                    inode_hashes[inode] = digest
+
+                    # rpm records modification times in whole seconds.
+                    key = (digest, st.st_size, stat.S_IMODE(st.st_mode),
+                           st.st_uid, st.st_gid, int(st.st_mtime))
+                    original = canonical.setdefault(key, path)
+                    if original != path:
+                        ost = os.lstat(original)
+                        if ((ost.st_dev, ost.st_ino) != inode and
+                                _replace_with_link(original, path)):
+                            if st.st_nlink == 1:
+                                reclaimed += st.st_size
+                            st = ost
+                    new_index[rel] = [st.st_size, st.st_mtime, st.st_ino,
+                                      digest]
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as fo:
+            json.dump(new_index, fo)
+        if on_win and isfile(index_path):
+            os.unlink(index_path)
+        os.rename(tmp_path, index_path)
+    return reclaimed
+
 # ------- linkage of packages
 
 def linked(prefix):
@@ -490,6 +861,17 @@ def is_linked(prefix, dist):
     Return the install meta-data for a linked package in a prefix, or None
     if the package is not linked in the prefix.
     """
+    conn = _open_meta_index(prefix)
+    if conn is not None:
+        try:
+            meta = _indexed_meta(conn, prefix, dist)
+        except sqlite3.Error as e:
+            log.debug('conda-meta index unusable: %r' % e)
+            meta = None
+        finally:
+            conn.close()
+        if meta is not None:
+            return meta
     meta_path = join(prefix, 'conda-meta', dist + '.json')
     try:
         with open(meta_path) as fi:
@@ -498,10 +880,61 @@ def is_linked(prefix, dist):
         return None
 
 
-def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=None):
+def index_meta(prefix):
+    """
+    Create (or bring up to date) the index of the conda metadata in prefix.
+    Once a prefix is indexed, link() and unlink() maintain the index, and it
+    is used to speed up is_linked(), unlink() and path_owner().
+    """
+    with DirLock(prefix):
+        conn = _open_meta_index(prefix, create=True)
+        index_path = join(prefix, 'conda-meta', meta_index_name)
+        if conn is None and isfile(index_path):
+            # An unusable index is rebuilt from the JSON files.
+            os.unlink(index_path)
+            conn = _open_meta_index(prefix, create=True)
+        if conn is None:
+            return
+        try:
+            _refresh_meta_index(conn, prefix)
+        finally:
+            conn.close()
+
+
+def path_owner(prefix, path):
+    """
+    Return the linked package which owns path (either absolute, or relative
+    to prefix), or None if no linked package contains it.
+    """
+    if os.path.isabs(path):
+        path = os.path.relpath(path, prefix)
+    path = path.replace(os.sep, '/')
+    conn = _open_meta_index(prefix)
+    if conn is not None:
+        try:
+            _refresh_meta_index(conn, prefix)
+            row = conn.execute('SELECT dist FROM files WHERE path = ?',
+                               (path,)).fetchone()
+            return row[0] if row else None
+        except (sqlite3.Error, OSError, IOError) as e:
+            log.debug('conda-meta index unusable: %r' % e)
+        finally:
+            conn.close()
+    for dist in sorted(linked(prefix)):
+        if path in is_linked(prefix, dist).get('files', []):
+            return dist
+    return None
+
+
+def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=None,
+         telemetry=None):
     '''
     Set up a package in a specified (environment) prefix.  We assume that
     the package has been extracted (using extract() above).
+
+    With telemetry (which defaults to whether the CONDA_RPMS_TELEMETRY
+    environment variable is set), the timings and counts of the link are
+    logged to <prefix>/conda-meta/.telemetry.jsonl.
     '''
     if target_prefix is None:
         target_prefix = prefix
@@ -515,8 +948,28 @@ def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=N
         log.warn('Ignored: %s' % dist)
         return
 
+    if telemetry is None:
+        telemetry = bool(os.environ.get(telemetry_env_var))
+    tel = Telemetry(telemetry, action='link', dist=dist, prefix=prefix,
+                    target_prefix=target_prefix,
+                    linktype=link_name_map.get(linktype),
+                    time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    try:
+        with tel.timer('total'):
+            _link_dist(pkgs_dir, prefix, dist, linktype, index,
+                       target_prefix, tel)
+    except BaseException:
+        tel.record['failed'] = True
+        raise
+    finally:
+        tel.write(prefix)
+
+
+def _link_dist(pkgs_dir, prefix, dist, linktype, index, target_prefix, tel):
     source_dir = join(pkgs_dir, dist)
-    if not run_script(dist, 'pre-link', prefix, target_prefix):
+    with tel.timer('pre_link'):
+        pre_link_ok = run_script(dist, 'pre-link', prefix, target_prefix)
+    if not pre_link_ok:
         sys.exit('Error: pre-link failed: %s' % dist)
 
     info_dir = join(source_dir, 'info')
@@ -524,7 +977,12 @@ def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=N
     has_prefix_files = read_has_prefix(join(info_dir, 'has_prefix'))
     no_link = read_no_link(info_dir)
 
-    with Locked(prefix), Locked(pkgs_dir):
+    # Linking only reads from the package cache, so other environments may
+    # be linked against it at the same time.
+    with DirLock(prefix) as prefix_lock, \
+            DirLock(pkgs_dir, shared=True) as pkgs_lock:
+        tel.add('lock_wait_seconds', prefix_lock.wait + pkgs_lock.wait)
+        copied = []
         for f in files:
             src = join(source_dir, f)
             dst = join(prefix, f)
@@ -545,6 +1003,11 @@ def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=N
             except OSError as e:
                 log.error('failed to link (src=%r, dst=%r, type=%r, error=%r)' %
                           (src, dst, lt, e))
+            else:
+                tel.add('files_' + link_name_map[lt].replace('-', '_'))
+                if lt == LINK_COPY and not islink(dst):
+                    copied.append(f)
+                    tel.add('bytes_copied', os.lstat(dst).st_size)
 
         if name_dist(dist) == '_cache':
             return
@@ -552,14 +1015,20 @@ def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=N
         for f in sorted(has_prefix_files):
             placeholder, mode = has_prefix_files[f]
             try:
-                update_prefix(join(prefix, f), target_prefix, placeholder, mode)
+                with tel.timer('update_prefix'):
+                    tel.add('bytes_rewritten',
+                            update_prefix(join(prefix, f), target_prefix,
+                                          placeholder, mode))
             except PaddingError:
                 sys.exit("ERROR: placeholder '%s' too short in: %s\n" %
                          (placeholder, dist))
 
         mk_menus(prefix, files, remove=False)
 
-        if not run_script(prefix, dist, 'post-link', target_prefix):
+        with tel.timer('post_link'):
+            post_link_ok = run_script(prefix, dist, 'post-link',
+                                      target_prefix)
+        if not post_link_ok:
             sys.exit("Error: post-link failed for: %s" % dist)
 
         # Make sure the script stays standalone for the installer
@@ -581,7 +1050,14 @@ def link(pkgs_dir, prefix, dist, linktype=LINK_HARD, index=None, target_prefix=N
         except IOError:
             meta_dict['files'] = files
         meta_dict['link'] = {'source': source_dir,
-                             'type': link_name_map.get(linktype)}
+                             'type': link_name_map.get(linktype),
+                             'target_prefix': target_prefix}
+        # Record the content of the files whose prefix was rewritten, so
+        # that verify() can tell whether they have since been modified (the
+        # other copied files are verified against the package cache).
+        meta_dict['copied_sha256'] = dict((f, hash_file(join(prefix, f)))
+                                          for f in copied
+                                          if f in has_prefix_files)
         if 'channel' in meta_dict:
             meta_dict['channel'] = remove_binstar_tokens(meta_dict['channel'])
         if 'icon' in meta_dict:
@@ -601,12 +1077,13 @@ def unlink(prefix, dist):
         log.warn('Ignored: %s' % dist)
         return
 
-    with Locked(prefix):
+    with DirLock(prefix):
         run_script(prefix, dist, 'pre-unlink')
 
         meta_path = join(prefix, 'conda-meta', dist + '.json')
-        with open(meta_path) as fi:
-            meta = json.load(fi)
+        meta = is_linked(prefix, dist)
+        if meta is None:
+            raise IOError('%s is not linked in %s' % (dist, prefix))
 
         mk_menus(prefix, meta['files'], remove=True)
         dst_dirs1 = set()
@@ -621,6 +1098,14 @@ def unlink(prefix, dist):
 
         # remove the meta-file last
         os.unlink(meta_path)
+        conn = _open_meta_index(prefix)
+        if conn is not None:
+            try:
+                _unindex_meta(conn, dist)
+            except sqlite3.Error as e:
+                log.warn('conda-meta index unusable: %r' % e)
+            finally:
+                conn.close()
 
         dst_dirs2 = set()
         for path in dst_dirs1:
@@ -635,6 +1120,360 @@ def unlink(prefix, dist):
             rm_empty_dir(path)
 
 
+trash_name = '.trash'
+
+def default_trash_dir(prefix):
+    """
+    The trash area of prefix: a .trash directory alongside it, and so on the
+    same filesystem.
+    """
+    return join(dirname(abspath(prefix)), trash_name)
+
+def trash(path, trash_dir):
+    """
+    Move `path` into `trash_dir`, with a single (atomic) rename, to be deleted
+    later by `reap`.  Return the path in the trash, or None if there was
+    nothing to move.  If the rename isn't possible (e.g. the trash is on
+    another filesystem), `path` is deleted here and now instead.
+    """
+    if not (islink(path) or os.path.exists(path)):
+        return None
+    if not isdir(trash_dir):
+        os.makedirs(trash_dir)
+    dst = join(trash_dir, '%s.%d.%s' % (basename(path.rstrip(os.sep)),
+                                        os.getpid(),
+                                        binascii.hexlify(os.urandom(4))
+                                        .decode('ascii')))
+    try:
+        os.rename(path, dst)
+    except OSError as e:
+        log.debug("could not move %s to the trash (%s), removing it" %
+                  (path, e))
+        rm_rf(path)
+        return None
+    return dst
+
+def reap(trash_dir, processes=None):
+    """
+    Delete everything in `trash_dir`, across a pool of `processes` worker
+    processes (defaults to the number of CPUs).  Only one reaper runs at a
+    time; a second waits, and then reaps whatever has been trashed since.
+    Return the number of trashed paths deleted.
+    """
+    import multiprocessing
+
+    if not isdir(trash_dir):
+        return 0
+    with DirLock(trash_dir):
+        entries = [join(trash_dir, name) for name in os.listdir(trash_dir)]
+        # Each trashed directory is deleted from its top-level contents in
+        # parallel, so that a single large environment is also shared out.
+        paths = []
+        for entry in entries:
+            if isdir(entry) and not islink(entry):
+                paths.extend(join(entry, name) for name in os.listdir(entry))
+        if len(paths) > 1 and processes != 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                pool.map(rm_rf, paths, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for path in paths:
+                rm_rf(path)
+        for entry in entries:
+            rm_rf(entry)
+    return len(entries)
+
+def reap_in_background(trash_dir):
+    """
+    Start a detached process which reaps `trash_dir`, and return its pid
+    without waiting for it.
+    """
+    kwargs = {}
+    if not on_win:
+        # Detach from the session, so that the reaper outlives (and isn't
+        # signalled with) the process which started it, e.g. an RPM
+        # transaction.
+        kwargs['preexec_fn'] = os.setsid
+        kwargs['close_fds'] = True
+    script = abspath(__file__)
+    if script.endswith(('.pyc', '.pyo')):
+        script = script[:-1]
+    with open(os.devnull, 'r+b') as devnull:
+        proc = subprocess.Popen([sys.executable, script, '--reap',
+                                 '--trash-dir', trash_dir],
+                                stdin=devnull, stdout=devnull, stderr=devnull,
+                                **kwargs)
+    return proc.pid
+
+def remove_prefix(prefix, trash_dir=None, background=True):
+    """
+    Remove the environment `prefix` in (near) constant time: it is moved into
+    `trash_dir` (defaults to `default_trash_dir(prefix)`), which is then
+    reaped by a detached process, or here and now if not `background`.
+    """
+    if trash_dir is None:
+        trash_dir = default_trash_dir(prefix)
+    if not isdir(prefix):
+        return
+    with DirLock(prefix):
+        trashed = trash(prefix, trash_dir)
+    if trashed is not None:
+        if background:
+            reap_in_background(trash_dir)
+        else:
+            reap(trash_dir)
+
+
+# A small script which is run by the environment's own python, so that the
+# generated bytecode matches the interpreter which will eventually load it.
+_compile_script = """
+import sys, py_compile
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    def cache_from_source(path):
+        return path + 'c'
+with open(sys.argv[1]) as fi, open(sys.argv[2], 'w') as fo:
+    for line in fi:
+        path = line.rstrip('\\n')
+        try:
+            py_compile.compile(path, doraise=True)
+        except Exception:
+            continue
+        fo.write('%s\\t%s\\n' % (path, cache_from_source(path)))
+"""
+
+
+def prefix_python(prefix):
+    """
+    Return the path to the python interpreter of prefix, or None if the
+    prefix doesn't contain one.
+    """
+    if on_win:
+        path = join(prefix, 'python.exe')
+    else:
+        path = join(prefix, 'bin', 'python')
+    return path if isfile(path) else None
+
+
+def compile_prefix(prefix, processes=None):
+    '''
+    Byte-compile the python files in site-packages of all packages linked
+    into prefix, using the python of the prefix and spreading the work over
+    `processes` worker processes (defaults to the number of CPUs).  The
+    generated files are added to the meta-data of the package which owns
+    the source, such that unlink() removes them again.
+    '''
+    python = prefix_python(prefix)
+    if python is None:
+        log.warn('No python found in %r, not compiling.' % prefix)
+        return
+
+    with DirLock(prefix):
+        owners = {}
+        metas = {}
+        for dist in sorted(linked(prefix)):
+            meta = is_linked(prefix, dist)
+            metas[dist] = meta
+            for f in meta.get('files', []):
+                if f.endswith('.py') and 'site-packages' in f.split('/'):
+                    owners[join(prefix, f)] = dist
+        if not owners:
+            return
+
+        if processes is None:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+        elif processes < 1:
+            raise ValueError('Number of processes must be at least 1')
+        sources = sorted(owners)
+        chunks = [sources[i::processes] for i in range(processes)]
+        chunks = [chunk for chunk in chunks if chunk]
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            workers = []
+            for i, chunk in enumerate(chunks):
+                in_path = join(tmp_dir, 'sources-%d.txt' % i)
+                out_path = join(tmp_dir, 'compiled-%d.txt' % i)
+                with open(in_path, 'w') as fo:
+                    fo.write('\n'.join(chunk) + '\n')
+                args = [python, '-c', _compile_script, in_path, out_path]
+                workers.append((subprocess.Popen(args), chunk, out_path))
+
+            compiled = []
+            for proc, chunk, out_path in workers:
+                if proc.wait() != 0:
+                    log.error('failed to compile %d files in %r' %
+                              (len(chunk), prefix))
+                    continue
+                # Each line is the source and the bytecode file written for it.
+                compiled.extend(line.split('\t')
+                                for line in yield_lines(out_path))
+        finally:
+            rm_rf(tmp_dir)
+
+        changed = set()
+        for source, pyc in compiled:
+            dist = owners[source]
+            files = metas[dist]['files']
+            f = os.path.relpath(pyc, prefix).replace(os.sep, '/')
+            if f not in files:
+                files.append(f)
+                metas[dist].setdefault('compiled', []).append(f)
+                changed.add(dist)
+
+        for dist in changed:
+            _write_meta(prefix, dist, metas[dist])
+
+
+def _check_file(args):
+    """
+    Check a single linked file, returning the file and a description of
+    the problem with it, or None if there is no problem.
+    """
+    f, dst, src, kind, sha256 = args
+    if not os.path.lexists(dst):
+        return f, 'missing'
+    if src is None or not os.path.lexists(src) or islink(src):
+        return f, None
+    if kind == 'hard':
+        st, src_st = os.lstat(dst), os.lstat(src)
+        # dedup may since have swapped the package's file for a link to an
+        # identical copy, so a different inode is only broken if the
+        # content differs too.
+        if ((st.st_dev, st.st_ino) != (src_st.st_dev, src_st.st_ino) and
+                (islink(dst) or hash_file(dst) != hash_file(src))):
+            return f, 'not hard-linked to %s' % src
+    elif kind == 'soft':
+        if not islink(dst) or os.readlink(dst) != src:
+            return f, 'not soft-linked to %s' % src
+    elif sha256 is not None:
+        if islink(dst) or hash_file(dst) != sha256:
+            return f, 'content differs from when it was linked'
+    elif islink(dst) or hash_file(dst) != hash_file(src):
+        return f, 'content differs from %s' % src
+    return f, None
+
+
+def _verify_tasks(prefix, dist, meta):
+    """
+    Return the _check_file arguments for all of the files of a linked
+    package.
+    """
+    link = meta.get('link') or {}
+    source_dir = link.get('source')
+    kind = {'hard-link': 'hard', 'soft-link': 'soft'}.get(link.get('type'),
+                                                          'copy')
+    # The bytecode compiled by compile_prefix has no package file to compare
+    # against (or relink from), so isn't verified.
+    compiled = set(meta.get('compiled', []))
+    files = [f for f in meta.get('files', []) if f not in compiled]
+    if source_dir is None:
+        # Without a package to compare against, all we can check is that
+        # the files exist.
+        return [(f, join(prefix, f), None, kind, None) for f in files]
+    info_dir = join(source_dir, 'info')
+    has_prefix_files = read_has_prefix(join(info_dir, 'has_prefix'))
+    no_link = read_no_link(info_dir)
+    copied_sha256 = meta.get('copied_sha256') or {}
+    tasks = []
+    for f in files:
+        dst, src = join(prefix, f), join(source_dir, f)
+        if f in copied_sha256:
+            task = (f, dst, src, 'copy', copied_sha256[f])
+        elif f in has_prefix_files:
+            # Linked before its hash was recorded, and its content differs
+            # from the package's, so we can only check that it exists.
+            task = (f, dst, None, 'copy', None)
+        elif f in no_link:
+            task = (f, dst, src, 'copy', None)
+        else:
+            task = (f, dst, src, kind, None)
+        tasks.append(task)
+    return tasks
+
+
+def _relink_file(prefix, meta, f):
+    """
+    Link a single file of a linked package again from the package cache.
+    """
+    link = meta.get('link') or {}
+    if 'source' not in link:
+        return
+    source_dir = link['source']
+    src = join(source_dir, f)
+    dst = join(prefix, f)
+    if not os.path.lexists(src):
+        return
+    lt = dict((name, lt) for lt, name in link_name_map.items()).get(
+        link.get('type'), LINK_COPY)
+    has_prefix_files = read_has_prefix(join(source_dir, 'info', 'has_prefix'))
+    no_link = read_no_link(join(source_dir, 'info'))
+    if f in has_prefix_files or f in no_link or islink(src):
+        lt = LINK_COPY
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    elif not isdir(dirname(dst)):
+        os.makedirs(dirname(dst))
+    _link(src, dst, lt)
+    if f in has_prefix_files:
+        placeholder, mode = has_prefix_files[f]
+        update_prefix(dst, link.get('target_prefix') or prefix,
+                      placeholder, mode)
+
+
+def verify(prefix, repair=False, processes=None):
+    '''
+    Check that the files of all packages linked into prefix still exist, are
+    still linked to the package cache and, for copied files, still have the
+    content of the package (or, where their prefix was rewritten, the
+    content they were linked with).  The bytecode compiled by compile_prefix
+    isn't checked.  The files are checked by `processes` worker processes
+    (defaults to the number of CPUs).
+
+    Return a dict mapping the broken files (relative to prefix) to a
+    description of their problem.  With repair=True, only the broken files
+    are linked again, and those which could not be fixed are returned.
+    '''
+    import multiprocessing
+
+    with DirLock(prefix, shared=not repair):
+        metas = {}
+        owners = {}
+        tasks = []
+        for dist in sorted(linked(prefix)):
+            meta = metas[dist] = is_linked(prefix, dist)
+            for task in _verify_tasks(prefix, dist, meta):
+                owners[task[0]] = dist
+                tasks.append(task)
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_check_file, tasks, chunksize=256)
+        finally:
+            pool.close()
+            pool.join()
+        broken = dict((f, problem) for f, problem in results if problem)
+
+        if repair and broken:
+            tasks = dict((task[0], task) for task in tasks)
+            for f in sorted(broken):
+                try:
+                    _relink_file(prefix, metas[owners[f]], f)
+                except (OSError, IOError, PaddingError) as e:
+                    log.error('failed to repair %r: %r' % (f, e))
+                problem = _check_file(tasks[f])[1]
+                if problem:
+                    broken[f] = problem
+                else:
+                    del broken[f]
+    return broken
+
+
 def messages(prefix):
     path = join(prefix, '.messages.txt')
     try:
@@ -664,14 +1503,39 @@ def main():
                  action="store_true",
                  help="extract package in pkgs cache")
 
+    p.add_option('--extract-all',
+                 action="store_true",
+                 help="extract all fetched packages in pkgs cache, "
+                      "in parallel")
+
     p.add_option('--link',
                  action="store_true",
                  help="link a package")
 
+    p.add_option('--telemetry',
+                 action="store_true",
+                 help="log the timings of linking to "
+                      "<prefix>/conda-meta/%s (also enabled by setting %s)"
+                      % (telemetry_name, telemetry_env_var))
+
     p.add_option('--unlink',
                  action="store_true",
                  help="unlink a package")
 
+    p.add_option('--remove-prefix',
+                 action="store_true",
+                 help="remove prefix, by moving it into the trash, which is "
+                      "then deleted in the background")
+
+    p.add_option('--reap',
+                 action="store_true",
+                 help="delete everything in the trash, in parallel")
+
+    p.add_option('--trash-dir',
+                 default=None,
+                 help="the trash (defaults to a %s directory alongside "
+                      "prefix)" % trash_name)
+
     p.add_option('--target-prefix',
                  default=None,
                  help="target prefix (defaults to prefix)")
@@ -690,14 +1554,49 @@ def main():
                  action="store_true",
                  help="link all extracted packages")
 
+    p.add_option('--index',
+                 action="store_true",
+                 help="index the conda-meta records of prefix, speeding up "
+                      "subsequent queries")
+
+    p.add_option('--verify',
+                 action="store_true",
+                 help="check that the files of all linked packages are "
+                      "intact")
+
+    p.add_option('--repair',
+                 action="store_true",
+                 help="verify, and link again the files which are broken")
+
+    p.add_option('--dedup',
+                 action="store_true",
+                 help="hard link identical files of the extracted packages "
+                      "in the pkgs cache")
+
+    p.add_option('--compile',
+                 action="store_true",
+                 help="byte-compile the site-packages of all linked packages")
+
+    p.add_option('-j', '--jobs',
+                 type="int",
+                 default=None,
+                 help="number of worker processes to use when compiling, "
+                      "extracting or verifying (defaults to the number of "
+                      "CPUs)")
+
     p.add_option('-v', '--verbose',
                  action="store_true")
 
     opts, args = p.parse_args()
 
+    if opts.jobs is not None and opts.jobs < 1:
+        p.error('the number of jobs must be at least 1')
+
     logging.basicConfig()
 
-    if opts.list or opts.extract or opts.link_all:
+    if (opts.list or opts.extract_all or opts.link_all or opts.compile or
+            opts.dedup or opts.verify or opts.repair or opts.index or
+            opts.remove_prefix or opts.reap):
         if args:
             p.error('no arguments expected')
     else:
@@ -728,18 +1627,48 @@ def main():
         for dist in dists:
             if opts.verbose or linktype == LINK_COPY:
                 print("linking: %s" % dist)
-            link(pkgs_dir, prefix, dist, linktype, target_prefix=target_prefix)
+            link(pkgs_dir, prefix, dist, linktype, target_prefix=target_prefix,
+                 telemetry=opts.telemetry or None)
         messages(prefix)
 
     elif opts.extract:
         extract(pkgs_dir, dist)
 
+    elif opts.extract_all:
+        for dist in extract_all(pkgs_dir, processes=opts.jobs):
+            if opts.verbose:
+                print("extracted: %s" % dist)
+
     elif opts.link:
-        link(pkgs_dir, prefix, dist, target_prefix=target_prefix)
+        link(pkgs_dir, prefix, dist, target_prefix=target_prefix,
+             telemetry=opts.telemetry or None)
 
     elif opts.unlink:
         unlink(prefix, dist)
 
+    elif opts.remove_prefix:
+        remove_prefix(prefix, opts.trash_dir)
+
+    elif opts.reap:
+        reap(opts.trash_dir or default_trash_dir(prefix), processes=opts.jobs)
+
+    elif opts.compile:
+        compile_prefix(prefix, processes=opts.jobs)
+
+    elif opts.index:
+        index_meta(prefix)
+
+    elif opts.verify or opts.repair:
+        broken = verify(prefix, repair=opts.repair, processes=opts.jobs)
+        for f in sorted(broken):
+            print("%s: %s" % (f, broken[f]))
+        if broken:
+            sys.exit(1)
+
+    elif opts.dedup:
+        reclaimed = dedup(pkgs_dir)
+        print("reclaimed: %d bytes" % reclaimed)
+
 
 if __name__ == '__main__':
     main()
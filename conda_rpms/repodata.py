@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Maintain the yum repository metadata (repodata) of a directory of RPMs
+incrementally, with createrepo_c (or createrepo) --update: only the RPMs added
+or changed (by path, size and modification time) since the last update are
+read, the metadata of the others being reused from the existing repodata.
+
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+
+
+#: The commands which generate repodata, in order of preference.
+createrepo_commands = ['createrepo_c', 'createrepo']
+
+#: The directory, within the RPM directory, of createrepo's checksum cache.
+cache_dirname = '.repodata-cache'
+
+
+def find_createrepo(commands=None):
+    """
+    Return the path of the first of the given commands (by default,
+    createrepo_commands) found on the PATH.
+    """
+    if commands is None:
+        commands = createrepo_commands
+    path_dirs = os.environ.get('PATH', os.defpath).split(os.pathsep)
+    for command in commands:
+        for directory in path_dirs:
+            path = os.path.join(directory, command)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    raise RuntimeError('None of {} were found; one is needed to update the '
+                       'repodata.'.format(', '.join(commands)))
+
+
+def update(rpm_dir, cache_dir=None, command=None):
+    """
+    Update the repodata of the RPMs in rpm_dir (and its subdirectories),
+    returning the exit status of createrepo.
+
+    With --update, createrepo only reads the RPMs whose path, size or
+    modification time have changed since the existing repodata was written,
+    and with a persistent --cachedir (by default, rpm_dir/.repodata-cache)
+    it doesn't checksum an RPM it has checksummed before. The repodata is
+    replaced atomically, so a client never sees a partial update.
+
+    """
+    if command is None:
+        command = find_createrepo()
+    if cache_dir is None:
+        cache_dir = os.path.join(rpm_dir, cache_dirname)
+    cmd = [command, '--update', '--cachedir', os.path.abspath(cache_dir),
+           rpm_dir]
+    return subprocess.call(cmd)
+
+
+def configure_parser(parser):
+    parser.add_argument('rpm_dir', help='The directory of RPMs.')
+    parser.add_argument('--cache-dir',
+                        help='The checksum cache of createrepo (default: '
+                             '<rpm_dir>/{}).'.format(cache_dirname))
+    parser.set_defaults(function=handle_args)
+    return parser
+
+
+def handle_args(args):
+    import sys
+
+    try:
+        returncode = update(args.rpm_dir, args.cache_dir)
+    except RuntimeError as err:
+        sys.exit(str(err))
+    if returncode != 0:
+        sys.exit('Failed to update the repodata of {}.'.format(args.rpm_dir))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Incrementally update the '
+                                                 'yum repository metadata of '
+                                                 'a directory of RPMs.')
+    configure_parser(parser)
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Timers and counters for reporting where the time of a run goes.
+
+"""
+from __future__ import division
+
+import contextlib
+from timeit import default_timer
+
+
+class Stats(object):
+    """
+    Accumulates the time spent in named phases, and named counters.
+
+    Counters named ``<name>_hits`` and ``<name>_misses`` are summarised
+    as the hit rate of ``<name>``.
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        #: Phase name -> [number of calls, total seconds].
+        self.timings = {}
+        #: Counter name -> value.
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """A context manager which adds the time spent within it to phase."""
+        start = default_timer()
+        try:
+            yield
+        finally:
+            timing = self.timings.setdefault(phase, [0, 0.0])
+            timing[0] += 1
+            timing[1] += default_timer() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def hit_rates(self):
+        bases = set()
+        for name in self.counters:
+            for suffix in ['_hits', '_misses']:
+                if name.endswith(suffix):
+                    bases.add(name[:-len(suffix)])
+        rates = {}
+        for base in bases:
+            # A cache which only missed (e.g. on a cold first run) has a
+            # rate of 0, rather than none at all.
+            hits = self.counters.get(base + '_hits', 0)
+            total = hits + self.counters.get(base + '_misses', 0)
+            rates[base] = hits / total if total else 0.0
+        return rates
+
+    def as_dict(self):
+        return {'timings': dict((phase, {'calls': calls, 'seconds': seconds})
+                                for phase, (calls, seconds)
+                                in self.timings.items()),
+                'counters': dict(self.counters),
+                'hit_rates': self.hit_rates()}
+
+    def summary(self):
+        """Return a human readable summary of the timings and counters."""
+        lines = []
+        names = list(self.timings) + list(self.counters)
+        width = max([len(name) for name in names] + [5])
+        if self.timings:
+            lines.append('{:<{}}  {:>7}  {:>10}'.format('Phase', width,
+                                                        'Calls', 'Seconds'))
+            for phase, (calls, seconds) in sorted(self.timings.items(),
+                                                  key=lambda item: -item[1][1]):
+                lines.append('{:<{}}  {:>7}  {:>10.3f}'.format(
+                    phase, width, calls, seconds))
+        if self.counters:
+            lines.append('')
+            for name in sorted(self.counters):
+                lines.append('{:<{}}  {:>7}'.format(name, width,
+                                                    self.counters[name]))
+        for name, rate in sorted(self.hit_rates().items()):
+            lines.append('{:<{}}  {:>6.1f}%'.format(name + ' hit rate',
+                                                    width, rate * 100))
+        return '\n'.join(lines)
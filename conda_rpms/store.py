@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+A checksum-verified store of the distribution tarballs of a SOURCES
+directory.
+
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+#: The directory, within SOURCES, of the store's records and objects.
+store_dirname = '.store'
+
+
+def hash_tarball(path, blocksize=2 ** 20):
+    """Return the md5 and sha256 hex digests of the file, in one read."""
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(blocksize), b''):
+            md5.update(block)
+            sha256.update(block)
+    return md5.hexdigest(), sha256.hexdigest()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+class PackageStore(object):
+    """
+    The distribution tarballs (<dist>.tar.bz2) of a SOURCES directory,
+    recorded with their checksums and stored by content.
+
+    Each tarball is a hard link to an object named by its sha256, so that
+    tarballs with the same content are stored once. A tarball is fully
+    hashed when it is added; after that it is only hashed again if its size,
+    modification time or inode change, so checking it is as cheap as a stat.
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.store_dir = os.path.join(directory, store_dirname)
+        self.objects_dir = os.path.join(self.store_dir, 'sha256')
+        self.records_path = os.path.join(self.store_dir, 'records.json')
+        self._records = None
+        self._dirty = False
+
+    @property
+    def records(self):
+        """The checksums, size and stat of each recorded tarball, by dist."""
+        if self._records is None:
+            self._records = {}
+            if os.path.exists(self.records_path):
+                with open(self.records_path, 'r') as fh:
+                    self._records = json.load(fh)
+        return self._records
+
+    def save(self):
+        """Write the records, if they have changed."""
+        if not self._dirty:
+            return
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        tmp = self.records_path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.records, fh, indent=1, sort_keys=True)
+        os.rename(tmp, self.records_path)
+        self._dirty = False
+
+    def path(self, dist):
+        return os.path.join(self.directory, dist + '.tar.bz2')
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    @staticmethod
+    def _mismatch(record, pkg_info):
+        """
+        Return a description of how the record differs from the channel's
+        pkg_info (comparing the checksums and size it has), or None.
+        """
+        if pkg_info is None:
+            return None
+        for key in ['sha256', 'md5', 'size']:
+            expected = pkg_info.get(key)
+            if expected and record.get(key) != expected:
+                return 'its {} is {}, not the channel\'s {}'.format(
+                    key, record.get(key), expected)
+        return None
+
+    def forget(self, dist):
+        if self.records.pop(dist, None) is not None:
+            self._dirty = True
+
+    def add(self, dist, pkg_info=None, hashes=None):
+        """
+        Record the (freshly fetched) tarball of dist, and store it by content.
+
+        If the tarball doesn't have the checksums (or size) of the channel's
+        pkg_info, it is removed and a ValueError raised.
+
+        """
+        path = self.path(dist)
+        md5, sha256 = hashes or hash_tarball(path)
+        record = {'md5': md5, 'sha256': sha256,
+                  'size': os.path.getsize(path)}
+        mismatch = self._mismatch(record, pkg_info)
+        if mismatch is not None:
+            os.remove(path)
+            self.forget(dist)
+            raise ValueError('The distribution {} is corrupt: {}.'.format(
+                dist, mismatch))
+        obj = self.object_path(sha256)
+        if os.path.exists(obj):
+            if not os.path.samefile(obj, path):
+                # The same content is already stored, so share it.
+                tmp = path + '.store-tmp'
+                os.link(obj, tmp)
+                os.rename(tmp, path)
+        else:
+            if not os.path.isdir(os.path.dirname(obj)):
+                os.makedirs(os.path.dirname(obj))
+            os.link(path, obj)
+        record['stat'] = _stat_key(path)
+        self.records[dist] = record
+        self._dirty = True
+        return record
+
+    def recorded_sha256(self, dist):
+        """
+        Return the recorded sha256 of the tarball of dist, if it hasn't
+        changed (by its stat) since it was recorded, or else None.
+        """
+        record = self.records.get(dist)
+        path = self.path(dist)
+        if (record is None or not os.path.exists(path) or
+                _stat_key(path) != record['stat']):
+            return None
+        return record['sha256']
+
+    def check(self, dist, pkg_info=None):
+        """
+        Return whether the tarball of dist is present and good: it has the
+        recorded checksums (which must also be those of the channel's
+        pkg_info, if given).
+
+        The tarball is only hashed if it has changed (by its stat) since it
+        was recorded, or if it was never recorded (it is then recorded, if
+        good).
+
+        """
+        path = self.path(dist)
+        if not os.path.exists(path):
+            self.forget(dist)
+            return False
+        record = self.records.get(dist)
+        if record is not None:
+            if self._mismatch(record, pkg_info) is not None:
+                return False
+            if _stat_key(path) == record['stat']:
+                return True
+            hashes = hash_tarball(path)
+            if list(hashes) != [record['md5'], record['sha256']]:
+                self.forget(dist)
+                return False
+        try:
+            self.add(dist, pkg_info)
+        except ValueError:
+            return False
+        return True
+
+    def verify(self, dists=None, processes=None):
+        """
+        Fully hash the given (or all) recorded tarballs, in parallel with a
+        pool of processes, returning the sorted list of those which are
+        missing or whose content no longer matches their record. Those are
+        forgotten, and so will be fetched again.
+
+        """
+        import multiprocessing
+
+        if dists is None:
+            dists = sorted(self.records)
+        present = [dist for dist in dists if os.path.exists(self.path(dist))]
+        bad = [dist for dist in dists if dist not in present]
+        paths = [self.path(dist) for dist in present]
+        if processes == 1 or len(paths) < 2:
+            hashes = [hash_tarball(path) for path in paths]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                hashes = pool.map(hash_tarball, paths)
+            finally:
+                pool.terminate()
+                pool.join()
+        for dist, (md5, sha256) in zip(present, hashes):
+            record = self.records[dist]
+            if [md5, sha256] != [record['md5'], record['sha256']]:
+                bad.append(dist)
+        for dist in bad:
+            self.forget(dist)
+        return sorted(bad)
+
+    def prune(self):
+        """
+        Forget the records of tarballs which no longer exist, and remove the
+        objects no longer linked to by any tarball, returning the number of
+        bytes freed.
+        """
+        for dist in list(self.records):
+            if not os.path.exists(self.path(dist)):
+                self.forget(dist)
+        freed = 0
+        if os.path.isdir(self.objects_dir):
+            for dirpath, _, fnames in os.walk(self.objects_dir):
+                for fname in fnames:
+                    obj = os.path.join(dirpath, fname)
+                    st = os.stat(obj)
+                    if st.st_nlink == 1:
+                        freed += st.st_size
+                        os.remove(obj)
+        return freed
+
+
+def configure_parser(parser):
+    parser.add_argument('sources', help='The SOURCES directory to verify.')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='The number of processes to hash with '
+                             '(default: the number of CPUs).')
+    parser.add_argument('--remove', action='store_true',
+                        help='Remove the tarballs which fail verification.')
+    parser.set_defaults(function=handle_args)
+    return parser
+
+
+def handle_args(args):
+    import sys
+
+    store = PackageStore(args.sources)
+    bad = store.verify(processes=args.jobs)
+    for dist in bad:
+        print('{} failed verification'.format(dist))
+        if args.remove and os.path.exists(store.path(dist)):
+            os.remove(store.path(dist))
+    store.save()
+    print('Verified {} distributions, {} bad.'.format(
+        len(store.records) + len(bad), len(bad)))
+    if bad:
+        sys.exit(1)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Verify the checksums of '
+                                                 'the distributions of a '
+                                                 'SOURCES directory.')
+    configure_parser(parser)
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import contextlib
+import os
 import shutil
 import tempfile
 import unittest
@@ -64,4 +65,35 @@ class CommonTest(unittest.TestCase):
         try:
             yield dname
         finally:
-            shutil.rmtree(dname) 
+            shutil.rmtree(dname)
+
+
+def make_pkg(pkgs_dir, dist, files, has_prefix=(), mtime=None):
+    """
+    Make a fake extracted package in pkgs_dir, with the given files (a dict
+    of their relative paths and content), of which those in has_prefix have
+    the default placeholder prefix. Given an mtime, all of the package's
+    files have it. Returns the package's directory.
+
+    """
+    dist_dir = os.path.join(pkgs_dir, dist)
+    info_dir = os.path.join(dist_dir, 'info')
+    os.makedirs(info_dir)
+    with open(os.path.join(info_dir, 'index.json'), 'w') as fh:
+        fh.write('{"name": "%s"}' % dist)
+    with open(os.path.join(info_dir, 'files'), 'w') as fh:
+        fh.write('\n'.join(sorted(files)))
+    if has_prefix:
+        with open(os.path.join(info_dir, 'has_prefix'), 'w') as fh:
+            fh.write(''.join(f + '\n' for f in has_prefix))
+    for fname, content in files.items():
+        path = os.path.join(dist_dir, fname)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+    if mtime is not None:
+        for root, _, fnames in os.walk(dist_dir):
+            for fname in fnames:
+                os.utime(os.path.join(root, fname), (mtime, mtime))
+    return dist_dir
@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import tarfile
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.benchmarks.synthetic import make_channel, make_gitenv
+from conda_rpms.install import read_has_prefix
+
+
+class Test_make_channel(tests.CommonTest):
+    def test_channel(self):
+        with self.temp_dir() as directory:
+            url, dists = make_channel(directory, n_dists=2, n_files=3,
+                                      file_size=10)
+            self.assertEqual(dists, ['pkg0-1.0-0', 'pkg1-1.0-0'])
+            subdir = os.path.join(directory, 'linux-64')
+            self.assertEqual(url, 'file://{}/'.format(subdir))
+            with open(os.path.join(subdir, 'repodata.json')) as fh:
+                repodata = json.load(fh)
+            self.assertEqual(sorted(repodata['packages']),
+                             ['pkg0-1.0-0.tar.bz2', 'pkg1-1.0-0.tar.bz2'])
+            with tarfile.open(os.path.join(subdir,
+                                           'pkg0-1.0-0.tar.bz2')) as tar:
+                tar.extractall(directory)
+            info_dir = os.path.join(directory, 'info')
+            with open(os.path.join(info_dir, 'files')) as fh:
+                files = fh.read().split('\n')
+            # 3 data files, plus one text and one binary prefixed file.
+            self.assertEqual(len(files), 5)
+            has_prefix = read_has_prefix(os.path.join(info_dir,
+                                                      'has_prefix'))
+            self.assertEqual(sorted(mode for _, mode in has_prefix.values()),
+                             ['binary', 'text'])
+
+
+class Test_make_gitenv(tests.CommonTest):
+    def test_gitenv(self):
+        with self.temp_dir() as directory:
+            tags = make_gitenv(directory, 'file:///channel/',
+                               ['a-1-0', 'b-1-0', 'c-1-0'], n_envs=2,
+                               n_tags=2, dists_per_env=2)
+            self.assertEqual(tags, ['env-env0-2000_01_01',
+                                    'env-env0-2001_01_01',
+                                    'env-env1-2000_01_01',
+                                    'env-env1-2001_01_01'])
+            branches = subprocess.check_output(
+                ['git', 'branch', '--format=%(refname:short)'],
+                cwd=directory).decode('utf-8').split()
+            self.assertEqual(sorted(branches),
+                             ['env0', 'env1', 'manifest/env0',
+                              'manifest/env1', 'master'])
+            manifest = subprocess.check_output(
+                ['git', 'show', 'env-env1-2001_01_01:env.manifest'],
+                cwd=directory).decode('utf-8')
+            self.assertEqual(manifest, 'file:///channel/\ta-1-0\n'
+                                       'file:///channel/\tc-1-0\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import argparse
+import os
+import unittest
+
+from conda_rpms.benchmarks import synthetic
+from conda_rpms.build_rpm_structure import clone_repos, configure_parser
+import conda_rpms.tests as tests
+
+
+class Test(tests.CommonTest):
+    def make_gitenvs(self, directory, n_envs):
+        url, dists = synthetic.make_channel(
+            os.path.join(directory, 'channel'), n_dists=2, n_files=1)
+        uris = []
+        for name, envs in zip(['a', 'b'], n_envs):
+            uri = os.path.join(directory, name)
+            synthetic.make_gitenv(uri, url, dists, n_envs=envs, n_tags=1)
+            uris.append(uri)
+        return uris
+
+    def test_distinct(self):
+        with self.temp_dir() as directory:
+            a, b = self.make_gitenvs(directory, [1, 2])
+            # Rename the environment of "a", so that it is distinct.
+            synthetic._git(a, 'branch', '-m', 'env0', 'other')
+            synthetic._git(a, 'branch', '-m', 'manifest/env0',
+                           'manifest/other')
+            repos = clone_repos([a, b], os.path.join(directory, 'clones'))
+        self.assertEqual(len(repos), 2)
+
+    def test_same_environment(self):
+        with self.temp_dir() as directory:
+            a, b = self.make_gitenvs(directory, [1, 2])
+            emsg = "The environment 'env0' is defined by both"
+            with self.assertRaisesRegexp(ValueError, emsg):
+                clone_repos([a, b], os.path.join(directory, 'clones'))
+
+    def test_parser(self):
+        parser = configure_parser(argparse.ArgumentParser())
+        args = parser.parse_args(['repo1', 'repo2', 'target'])
+        self.assertEqual(args.repo_uri, ['repo1', 'repo2'])
+        self.assertEqual(args.target, 'target')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import unittest
+
+from conda_gitenv.resolve import create_tracking_branches
+from git import Repo
+
+from conda_rpms.benchmarks import synthetic
+from conda_rpms.build_rpm_structure import (create_rpmbuild_content,
+                                            plan_rpmbuild_content)
+from conda_rpms.store import PackageStore
+import conda_rpms.tests as tests
+
+
+class Test(tests.CommonTest):
+    def setUp(self):
+        self.config = {'rpm': {'prefix': 'Prefix'},
+                       'install': {'prefix': '/opt/prefix'}}
+        self.patch('conda_rpms.build_rpm_structure.channel_index',
+                   side_effect=self._channel_index)
+
+    def _channel_index(self, source, tar_name, index_cache=None):
+        with open(os.path.join(self.channel_dir, 'linux-64',
+                               'repodata.json')) as fh:
+            packages = json.load(fh)['packages']
+        for fname, pkg_info in packages.items():
+            pkg_info['fn'] = fname
+        return packages
+
+    def make_repo(self, directory):
+        self.channel_dir = os.path.join(directory, 'channel')
+        url, dists = synthetic.make_channel(self.channel_dir, n_dists=3,
+                                            n_files=1)
+        tags = synthetic.make_gitenv(os.path.join(directory, 'gitenv'), url,
+                                     dists, n_envs=1, n_tags=2,
+                                     dists_per_env=2)
+        repo = Repo.clone_from(os.path.join(directory, 'gitenv'),
+                               os.path.join(directory, 'clone'))
+        create_tracking_branches(repo)
+        return repo, dists, tags
+
+    def fetch_pkg(self, pkg_info, pkg_cache):
+        if not os.path.isdir(pkg_cache):
+            os.makedirs(pkg_cache)
+        shutil.copy(os.path.join(self.channel_dir, 'linux-64',
+                                 pkg_info['fn']), pkg_cache)
+
+    def test_plan(self):
+        with self.temp_dir() as directory:
+            repo, dists, tags = self.make_repo(directory)
+            target = os.path.join(directory, 'rpmbuild')
+            spec_dir = os.path.join(target, 'SPECS')
+            os.makedirs(spec_dir)
+            for fname in ['Prefix-env-env0-tag-2000_01_01.spec',
+                          'Prefix-env-gone-tag-2000_01_01.spec']:
+                with open(os.path.join(spec_dir, fname), 'w') as fh:
+                    fh.write('Out of date.')
+            plan = plan_rpmbuild_content([repo], target, self.config)
+        self.assertEqual(sorted(item['dist'] for item in plan['fetch']),
+                         sorted(dists))
+        self.assertEqual(plan['fetch_bytes'],
+                         sum(item['size'] for item in plan['fetch']))
+        actions = dict((item['spec'], item['action'])
+                       for item in plan['specs'])
+        expected = dict(('Prefix-pkg-{}.spec'.format(dist), 'create')
+                        for dist in dists)
+        expected.update({'Prefix-env-env0-tag-2000_01_01.spec': 'update',
+                         'Prefix-env-env0-tag-2001_01_01.spec': 'create',
+                         'Prefix-env-env0-label-current.spec': 'create',
+                         'Prefix-env-env0-label-next.spec': 'create',
+                         'Prefix-installer.spec': 'create'})
+        self.assertEqual(actions, expected)
+        self.assertEqual(plan['orphaned'],
+                         ['Prefix-env-gone-tag-2000_01_01.spec'])
+        self.assertFalse(os.path.exists(os.path.join(target, 'SOURCES')))
+
+    def test_batches_match_run(self):
+        # The second tag brings in a new small distribution, which is
+        # batched separately from those of the first tag.
+        config = dict(self.config, rpm={'prefix': 'Prefix',
+                                        'batch': {'max_size': 2 ** 30}})
+        with self.temp_dir() as directory:
+            repo, dists, tags = self.make_repo(directory)
+            target = os.path.join(directory, 'rpmbuild')
+            plan = plan_rpmbuild_content([repo], target, config)
+            planned = dict((item['spec'], item.get('dists'))
+                           for item in plan['specs']
+                           if item['kind'] == 'batch')
+            self.assertEqual(len(planned), 2)
+            self.patch('conda.fetch.fetch_pkg', side_effect=self.fetch_pkg)
+            create_rpmbuild_content(repo, target, config)
+            written = sorted(fname for fname in
+                             os.listdir(os.path.join(target, 'SPECS'))
+                             if fname.startswith('Prefix-pkgs-'))
+        self.assertEqual(sorted(planned), written)
+        self.assertEqual(sorted(dist for batch in planned.values()
+                                for dist in batch), sorted(dists))
+
+    def test_one_store(self):
+        # The package store of the run is shared by all of its tags.
+        config = dict(self.config, rpm={'prefix': 'Prefix',
+                                        'verify_sources': True})
+        with self.temp_dir() as directory:
+            repo, dists, tags = self.make_repo(directory)
+            target = os.path.join(directory, 'rpmbuild')
+            self.patch('conda.fetch.fetch_pkg', side_effect=self.fetch_pkg)
+            mstore = self.patch('conda_rpms.build_rpm_structure.PackageStore',
+                                wraps=PackageStore)
+            create_rpmbuild_content(repo, target, config)
+            self.assertEqual(mstore.call_count, 1)
+            store = PackageStore(os.path.join(target, 'SOURCES'))
+            self.assertEqual(sorted(store.records), sorted(dists))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import io
+import os
+import tarfile
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.build_rpm_structure import recompress
+
+
+class Test(tests.CommonTest):
+    def make_tarball(self, pkgs_dir, dist, content=b'data'):
+        path = os.path.join(pkgs_dir, dist + '.tar.bz2')
+        with tarfile.open(path, 'w:bz2') as tar:
+            member = tarfile.TarInfo('info')
+            member.type = tarfile.DIRTYPE
+            tar.addfile(member)
+            member = tarfile.TarInfo('info/files')
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+        return path
+
+    def contents(self, path):
+        with tarfile.open(path) as tar:
+            return [(member.name, member.isdir(),
+                     tar.extractfile(member).read() if member.isreg() else None)
+                    for member in tar]
+
+    def test_unchanged(self):
+        with self.temp_dir() as pkgs_dir:
+            path = self.make_tarball(pkgs_dir, 'a-1-0')
+            self.assertEqual(recompress(path, 'tar.bz2'), path)
+            self.assertEqual(os.listdir(pkgs_dir), ['a-1-0.tar.bz2'])
+
+    def test_tar(self):
+        with self.temp_dir() as pkgs_dir:
+            path = self.make_tarball(pkgs_dir, 'a-1-0')
+            result = recompress(path, 'tar')
+            self.assertEqual(result, os.path.join(pkgs_dir, 'a-1-0.tar'))
+            self.assertEqual(self.contents(result), self.contents(path))
+            # An uncompressed tar.
+            tarfile.open(result, 'r:').close()
+
+    def test_tar_gz(self):
+        with self.temp_dir() as pkgs_dir:
+            path = self.make_tarball(pkgs_dir, 'a-1-0')
+            result = recompress(path, 'tar.gz')
+            self.assertEqual(result, os.path.join(pkgs_dir, 'a-1-0.tar.gz'))
+            self.assertEqual(self.contents(result), self.contents(path))
+            with open(result, 'rb') as fh:
+                self.assertEqual(fh.read(2), b'\x1f\x8b')
+
+    def test_cached_by_checksum(self):
+        with self.temp_dir() as pkgs_dir:
+            path = self.make_tarball(pkgs_dir, 'a-1-0')
+            result = recompress(path, 'tar', checksum='abc')
+            os.utime(result, (0, 0))
+            recompress(path, 'tar', checksum='abc')
+            self.assertEqual(os.path.getmtime(result), 0)
+            # A new checksum means the tarball changed upstream.
+            path = self.make_tarball(pkgs_dir, 'a-1-0', b'changed')
+            recompress(path, 'tar', checksum='def')
+            self.assertNotEqual(os.path.getmtime(result), 0)
+            self.assertEqual(self.contents(result)[1][2], b'changed')
+
+    def test_unknown_format(self):
+        with self.temp_dir() as pkgs_dir:
+            path = self.make_tarball(pkgs_dir, 'a-1-0')
+            with self.assertRaisesRegexp(ValueError, 'Unknown source format'):
+                recompress(path, 'tar.xz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.build_rpm_structure import rpmbuild_targets, target_configs
+
+
+class Test(tests.CommonTest):
+    def test_single(self):
+        config = {'rpm': {'prefix': 'Prefix'}}
+        self.assertEqual(rpmbuild_targets('target', config),
+                         [('target', config)])
+
+    def test_targets(self):
+        config = {'rpm': {'prefix': 'Prefix', 'source_format': 'tar'},
+                  'install': {'prefix': '/opt/prefix'},
+                  'targets': {'b': {'rpm': {'prefix': 'B'},
+                                    'install': {'prefix': '/opt/b'}},
+                              'a': {}}}
+        with self.temp_dir() as target:
+            targets = rpmbuild_targets(target, config)
+            self.assertEqual([target_dir for target_dir, _ in targets],
+                             [os.path.join(target, 'a'),
+                              os.path.join(target, 'b')])
+            # The sources are shared.
+            open(os.path.join(target, 'SOURCES', 'dist.tar.bz2'), 'w').close()
+            for target_dir, _ in targets:
+                self.assertTrue(os.path.exists(
+                    os.path.join(target_dir, 'SOURCES', 'dist.tar.bz2')))
+            # Preparing the targets again is harmless.
+            self.assertEqual(rpmbuild_targets(target, config), targets)
+        a_config, b_config = [target_config for _, target_config in targets]
+        self.assertEqual(a_config, {'rpm': {'prefix': 'Prefix',
+                                            'source_format': 'tar'},
+                                    'install': {'prefix': '/opt/prefix'}})
+        self.assertEqual(b_config, {'rpm': {'prefix': 'B',
+                                            'source_format': 'tar'},
+                                    'install': {'prefix': '/opt/b'}})
+
+    def test_target_configs(self):
+        config = {'rpm': {'prefix': 'Prefix'},
+                  'targets': {'b': {'rpm': {'prefix': 'B'}}, 'a': {}}}
+        with self.temp_dir() as target:
+            targets = target_configs(target, config)
+            # Nothing is created.
+            self.assertEqual(os.listdir(target), [])
+            self.assertEqual(targets, rpmbuild_targets(target, config))
+        self.assertEqual([target_config['rpm']['prefix']
+                          for _, target_config in targets], ['Prefix', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import unittest
+
+import mock
+
+import conda_rpms.tests as tests
+from conda_rpms.build_rpm_structure import (changed_environments,
+                                            wait_for_trigger, watch)
+
+
+class Test_changed_environments(unittest.TestCase):
+    def test_changes(self):
+        before = {'refs/heads/default': 'a',
+                  'refs/heads/manifest/default': 'b',
+                  'refs/heads/other': 'c',
+                  'refs/heads/manifest/other': 'd',
+                  'refs/tags/env-default-2016_01_01': 'e'}
+        after = dict(before)
+        self.assertEqual(changed_environments(before, after), set())
+        after['refs/heads/manifest/other'] = 'f'
+        self.assertEqual(changed_environments(before, after), set(['other']))
+        after['refs/tags/env-default-2016_01_02'] = 'g'
+        self.assertEqual(changed_environments(before, after),
+                         set(['default', 'other']))
+
+    def test_new_environment(self):
+        after = {'refs/heads/new': 'a', 'refs/heads/manifest/new': 'b'}
+        self.assertEqual(changed_environments({}, after), set(['new']))
+
+
+class Test_wait_for_trigger(tests.CommonTest):
+    def test_interval(self):
+        start = time.time()
+        self.assertFalse(wait_for_trigger(0.2, poll=0.05))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_trigger(self):
+        with self.temp_dir() as directory:
+            trigger = os.path.join(directory, 'trigger')
+            timer = threading.Timer(0.1, lambda: open(trigger, 'w').close())
+            timer.start()
+            start = time.time()
+            self.assertTrue(wait_for_trigger(60, trigger, poll=0.05))
+            self.assertLess(time.time() - start, 10)
+            timer.join()
+
+
+class _Stop(Exception):
+    pass
+
+
+class Test_watch(tests.CommonTest):
+    def setUp(self):
+        module = 'conda_rpms.build_rpm_structure.'
+        # Two polls, and then the watch is stopped.
+        self.patch(module + 'wait_for_trigger',
+                   side_effect=[False, False, _Stop])
+        self.patch(module + 'check_environments')
+        self.sync_repo = self.patch(module + 'sync_repo')
+        self.patch(module + 'ref_snapshot', side_effect=[
+            {}, {'refs/heads/env': 'a', 'refs/heads/manifest/env': 'b'},
+            {'refs/heads/env': 'a', 'refs/heads/manifest/env': 'b'}])
+        self.create = self.patch(module + 'create_rpmbuild_content')
+        self.patch('sys.stdout')
+        self.patch('sys.stderr')
+        self.repo = mock.Mock(working_dir='repo')
+
+    def test_regenerate_fails_once(self):
+        self.create.side_effect = [RuntimeError('No longer available.'),
+                                   None]
+        callback = mock.Mock()
+        with self.assertRaises(_Stop):
+            watch([self.repo], 'target', {}, callback=callback)
+        # The failed regeneration is retried at the next poll.
+        self.assertEqual(self.create.call_count, 2)
+        self.assertEqual(self.create.call_args[1]['envs'], set(['env']))
+        self.assertEqual(callback.call_count, 1)
+
+    def test_sync_fails_once(self):
+        self.sync_repo.side_effect = [IOError('Network is unreachable.'),
+                                      None]
+        self.patch('conda_rpms.build_rpm_structure.ref_snapshot',
+                   side_effect=[{}, {'refs/heads/env': 'a',
+                                     'refs/heads/manifest/env': 'b'}])
+        with self.assertRaises(_Stop):
+            watch([self.repo], 'target', {})
+        self.assertEqual(self.create.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
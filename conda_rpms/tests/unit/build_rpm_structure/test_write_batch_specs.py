@@ -0,0 +1,42 @@
+import glob
+import os
+import unittest
+
+from conda_rpms.benchmarks.synthetic import make_dist
+from conda_rpms.build_rpm_structure import batched_dists, write_batch_specs
+import conda_rpms.tests as tests
+
+
+class Test(tests.CommonTest):
+    def setUp(self):
+        self.config = {'rpm': {'prefix': 'Prefix', 'batch': {'max_dists': 2}},
+                       'install': {'prefix': '/opt/prefix'}}
+
+    def test_batches(self):
+        with self.temp_dir() as directory:
+            spec_dir = os.path.join(directory, 'SPECS')
+            os.makedirs(spec_dir)
+            tarballs = [os.path.join(directory,
+                                     make_dist(directory, name, n_files=1) +
+                                     '.tar.bz2')
+                        for name in ['c', 'a', 'b']]
+            write_batch_specs(tarballs, spec_dir, self.config)
+            specs = glob.glob(os.path.join(spec_dir, 'Prefix-pkgs-*.spec'))
+            self.assertEqual(len(specs), 2)
+            batched = batched_dists(spec_dir, 'Prefix')
+            self.assertEqual(sorted(batched), ['a-1.0-0', 'b-1.0-0',
+                                               'c-1.0-0'])
+            self.assertEqual(batched['a-1.0-0'], batched['b-1.0-0'])
+            self.assertNotEqual(batched['a-1.0-0'], batched['c-1.0-0'])
+            # The batches are named by their content, so are stable.
+            write_batch_specs(tarballs, spec_dir, self.config)
+            self.assertEqual(sorted(os.listdir(spec_dir)),
+                             sorted(os.path.basename(spec) for spec in specs))
+
+    def test_no_batches(self):
+        with self.temp_dir() as spec_dir:
+            self.assertEqual(batched_dists(spec_dir, 'Prefix'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
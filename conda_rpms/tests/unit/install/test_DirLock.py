@@ -0,0 +1,87 @@
+import errno
+import fcntl
+import os
+import stat
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.install import DirLock, lock_name
+
+
+class Test(tests.CommonTest):
+    def can_lock(self, path, operation):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return True
+        finally:
+            os.close(fd)
+
+    def test_shared(self):
+        with self.temp_dir() as path:
+            with DirLock(path, shared=True):
+                self.assertTrue(self.can_lock(path, fcntl.LOCK_SH))
+                self.assertFalse(self.can_lock(path, fcntl.LOCK_EX))
+            self.assertTrue(self.can_lock(path, fcntl.LOCK_EX))
+
+    def test_exclusive(self):
+        with self.temp_dir() as path:
+            with DirLock(path):
+                self.assertFalse(self.can_lock(path, fcntl.LOCK_SH))
+            self.assertTrue(self.can_lock(path, fcntl.LOCK_SH))
+
+    def test_creates_directory(self):
+        with self.temp_dir() as path:
+            prefix = os.path.join(path, 'envs', 'foo')
+            with DirLock(prefix):
+                self.assertTrue(os.path.isdir(prefix))
+            self.assertEqual(os.listdir(prefix), [])
+
+    def test_nfs(self):
+        # As on NFS, a directory (opened read-only) can't be locked.
+        flock = fcntl.flock
+
+        def nfs_flock(fd, operation):
+            if stat.S_ISDIR(os.fstat(fd).st_mode):
+                raise IOError(errno.EBADF, 'Bad file descriptor')
+            return flock(fd, operation)
+
+        self.patch('fcntl.flock', side_effect=nfs_flock)
+        with self.temp_dir() as path:
+            lock_path = os.path.join(path, lock_name)
+            with DirLock(path, shared=True):
+                self.assertTrue(os.path.isfile(lock_path))
+                with DirLock(path, shared=True) as lock:
+                    self.assertIsNotNone(lock._fd)
+                self.assertTrue(self.can_lock(lock_path, fcntl.LOCK_SH))
+                self.assertFalse(self.can_lock(lock_path, fcntl.LOCK_EX))
+            with DirLock(path):
+                self.assertFalse(self.can_lock(lock_path, fcntl.LOCK_SH))
+            self.assertTrue(self.can_lock(lock_path, fcntl.LOCK_EX))
+
+    def test_other_error(self):
+        self.patch('fcntl.flock', side_effect=IOError(errno.EINTR,
+                                                      'Interrupted'))
+        with self.temp_dir() as path:
+            with self.assertRaises(IOError):
+                with DirLock(path):
+                    pass
+            self.assertEqual(os.listdir(path), [])
+
+    def test_fallback(self):
+        # Without flock, conda's Locked (imported only then) is used.
+        self.patch('conda_rpms.install.fcntl', None)
+        conda_locked = self.patch('conda_rpms.install._conda_locked')
+        with self.temp_dir() as path:
+            with DirLock(path):
+                conda_locked.assert_called_once_with(path)
+                conda_locked.return_value.__enter__.assert_called_once_with()
+        self.assertEqual(conda_locked.return_value.__exit__.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
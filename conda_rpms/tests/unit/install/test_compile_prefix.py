@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.install import compile_prefix, is_linked, main, unlink
+
+
+class Test(tests.CommonTest):
+    def setUp(self):
+        self.dist = 'pkg1-1.0-0'
+        self.files = ['lib/python/site-packages/pkg1/__init__.py',
+                      'lib/python/site-packages/pkg1/broken.py',
+                      'share/pkg1/script.py']
+
+    def make_prefix(self, prefix):
+        bin_dir = os.path.join(prefix, 'bin')
+        os.makedirs(bin_dir)
+        os.symlink(sys.executable, os.path.join(bin_dir, 'python'))
+        for f in self.files:
+            path = os.path.join(prefix, f)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write('def (:\n' if 'broken' in f else 'x = 1\n')
+        meta_dir = os.path.join(prefix, 'conda-meta')
+        os.makedirs(meta_dir)
+        with open(os.path.join(meta_dir, self.dist + '.json'), 'w') as fh:
+            json.dump({'files': self.files}, fh)
+
+    def compiled(self, meta):
+        return [f for f in meta['files'] if f not in self.files]
+
+    def test_compile(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            compile_prefix(prefix, processes=2)
+            compiled = self.compiled(is_linked(prefix, self.dist))
+            # Only the valid module in site-packages gets compiled.
+            self.assertEqual(len(compiled), 1)
+            self.assertIn('site-packages/pkg1/', compiled[0])
+            self.assertTrue(compiled[0].endswith('.pyc'))
+            self.assertTrue(os.path.isfile(os.path.join(prefix, compiled[0])))
+
+    def test_recompile(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            compile_prefix(prefix)
+            compile_prefix(prefix)
+            compiled = self.compiled(is_linked(prefix, self.dist))
+            self.assertEqual(len(compiled), 1)
+
+    def test_unlink_removes_compiled(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            compile_prefix(prefix)
+            unlink(prefix, self.dist)
+            pkg_dir = os.path.join(prefix, 'lib', 'python', 'site-packages')
+            self.assertFalse(os.path.exists(pkg_dir))
+
+    def test_no_python(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            os.unlink(os.path.join(prefix, 'bin', 'python'))
+            compile_prefix(prefix)
+            self.assertEqual(self.compiled(is_linked(prefix, self.dist)), [])
+
+    def test_no_processes(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            with self.assertRaisesRegexp(ValueError, 'at least 1'):
+                compile_prefix(prefix, processes=0)
+            self.patch('sys.argv', ['install.py', '--prefix', prefix,
+                                    '--compile', '-j', '0'])
+            self.patch('sys.stderr')
+            with self.assertRaises(SystemExit):
+                main()
+            self.assertEqual(self.compiled(is_linked(prefix, self.dist)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
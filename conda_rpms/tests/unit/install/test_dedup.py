@@ -0,0 +1,65 @@
+import os
+import unittest
+
+from mock import patch
+
+import conda_rpms.install
+import conda_rpms.tests as tests
+from conda_rpms.install import dedup
+
+
+class Test(tests.CommonTest):
+    def make_dist(self, pkgs_dir, dist, files, mtime=1000000000):
+        tests.make_pkg(pkgs_dir, dist, files, mtime=mtime)
+
+    def inode(self, pkgs_dir, dist, fname):
+        return os.lstat(os.path.join(pkgs_dir, dist, fname)).st_ino
+
+    def test_dedup(self):
+        with self.temp_dir() as pkgs_dir:
+            self.make_dist(pkgs_dir, 'a-1-0', {'lib/same': 'x' * 10,
+                                               'lib/other': 'a'})
+            self.make_dist(pkgs_dir, 'a-1-1', {'lib/same': 'x' * 10,
+                                               'lib/other': 'b'})
+            reclaimed = dedup(pkgs_dir)
+            # The identical info/files listings are shared too.
+            self.assertEqual(reclaimed, 10 + len('lib/same\nlib/other'))
+            self.assertEqual(self.inode(pkgs_dir, 'a-1-0', 'lib/same'),
+                             self.inode(pkgs_dir, 'a-1-1', 'lib/same'))
+            self.assertNotEqual(self.inode(pkgs_dir, 'a-1-0', 'lib/other'),
+                                self.inode(pkgs_dir, 'a-1-1', 'lib/other'))
+            with open(os.path.join(pkgs_dir, 'a-1-1', 'lib', 'other')) as fh:
+                self.assertEqual(fh.read(), 'b')
+
+    def test_metadata_differs(self):
+        with self.temp_dir() as pkgs_dir:
+            self.make_dist(pkgs_dir, 'a-1-0', {'lib/same': 'x'})
+            self.make_dist(pkgs_dir, 'a-1-1', {'lib/same': 'x'},
+                           mtime=1000000001)
+            # Linking would change the mtime of one of the files.
+            self.assertEqual(dedup(pkgs_dir), 0)
+            self.assertNotEqual(self.inode(pkgs_dir, 'a-1-0', 'lib/same'),
+                                self.inode(pkgs_dir, 'a-1-1', 'lib/same'))
+
+    def test_incremental(self):
+        with self.temp_dir() as pkgs_dir:
+            self.make_dist(pkgs_dir, 'a-1-0', {'lib/same': 'x'})
+            self.make_dist(pkgs_dir, 'a-1-1', {'lib/same': 'x'})
+            dedup(pkgs_dir)
+            self.assertTrue(os.path.isfile(
+                os.path.join(pkgs_dir, conda_rpms.install.dedup_index_name)))
+            self.make_dist(pkgs_dir, 'a-1-2', {'lib/same': 'x'})
+            with patch('conda_rpms.install.hash_file',
+                       wraps=conda_rpms.install.hash_file) as mhash:
+                self.assertEqual(dedup(pkgs_dir), 1 + len('lib/same'))
+            # Only the files of the new package needed hashing.
+            hashed = sorted(os.path.relpath(call[0][0], pkgs_dir)
+                            for call in mhash.call_args_list)
+            expected = [os.path.join('a-1-2', 'info', 'files'),
+                        os.path.join('a-1-2', 'info', 'index.json'),
+                        os.path.join('a-1-2', 'lib', 'same')]
+            self.assertEqual(hashed, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
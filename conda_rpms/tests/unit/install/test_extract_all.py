@@ -0,0 +1,44 @@
+import io
+import os
+import tarfile
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.install import extract_all, extracted
+
+
+class Test(tests.CommonTest):
+    def make_tarball(self, pkgs_dir, dist):
+        path = os.path.join(pkgs_dir, dist + '.tar.bz2')
+        with tarfile.open(path, 'w:bz2') as tar:
+            for name in ['info/files', 'info/index.json', 'lib/data']:
+                content = name.encode('ascii')
+                member = tarfile.TarInfo(name)
+                member.size = len(content)
+                member.mode = 0o640
+                member.uid = member.gid = 1234
+                member.uname = member.gname = 'nobody-in-particular'
+                tar.addfile(member, io.BytesIO(content))
+
+    def test_extract_all(self):
+        with self.temp_dir() as pkgs_dir:
+            dists = ['a-1-0', 'b-1-0', 'c-1-0']
+            for dist in dists:
+                self.make_tarball(pkgs_dir, dist)
+            result = extract_all(pkgs_dir, processes=2)
+            self.assertEqual(result, dists)
+            self.assertEqual(extracted(pkgs_dir), set(dists))
+            st = os.stat(os.path.join(pkgs_dir, 'a-1-0', 'lib', 'data'))
+            self.assertEqual(st.st_mode & 0o777, 0o640)
+            if os.getuid() == 0:
+                self.assertEqual((st.st_uid, st.st_gid), (0, 0))
+
+    def test_already_extracted(self):
+        with self.temp_dir() as pkgs_dir:
+            self.make_tarball(pkgs_dir, 'a-1-0')
+            extract_all(pkgs_dir)
+            self.assertEqual(extract_all(pkgs_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import unittest
+
+from mock import patch
+
+import conda_rpms.tests as tests
+from conda_rpms.install import (index_meta, is_linked, meta_index_name,
+                                path_owner, unlink)
+
+
+class Test(tests.CommonTest):
+    def setUp(self):
+        self.metas = {'pkg1-1.0-0': {'name': 'pkg1',
+                                     'files': ['bin/pkg1', 'lib/pkg1.so']},
+                      'pkg2-1.0-0': {'name': 'pkg2',
+                                     'files': ['bin/pkg2']}}
+
+    def make_prefix(self, prefix):
+        meta_dir = os.path.join(prefix, 'conda-meta')
+        os.makedirs(meta_dir)
+        for dist, meta in self.metas.items():
+            with open(os.path.join(meta_dir, dist + '.json'), 'w') as fh:
+                json.dump(meta, fh)
+            for f in meta['files']:
+                path = os.path.join(prefix, f)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'w').close()
+        return os.path.join(meta_dir, meta_index_name)
+
+    def test_is_linked(self):
+        with self.temp_dir() as prefix:
+            index_path = self.make_prefix(prefix)
+            index_meta(prefix)
+            self.assertTrue(os.path.isfile(index_path))
+            with patch('json.load') as mload:
+                meta = is_linked(prefix, 'pkg1-1.0-0')
+            self.assertEqual(mload.call_count, 0)
+            self.assertEqual(meta, self.metas['pkg1-1.0-0'])
+
+    def test_stale(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            index_meta(prefix)
+            meta = dict(self.metas['pkg2-1.0-0'], files=['bin/pkg2', 'x'])
+            meta_path = os.path.join(prefix, 'conda-meta', 'pkg2-1.0-0.json')
+            with open(meta_path, 'w') as fh:
+                json.dump(meta, fh)
+            self.assertEqual(is_linked(prefix, 'pkg2-1.0-0'), meta)
+            self.assertEqual(path_owner(prefix, 'x'), 'pkg2-1.0-0')
+
+    def test_path_owner(self):
+        with self.temp_dir() as prefix:
+            self.make_prefix(prefix)
+            self.assertEqual(path_owner(prefix, 'bin/pkg2'), 'pkg2-1.0-0')
+            index_meta(prefix)
+            self.assertEqual(path_owner(prefix, 'bin/pkg2'), 'pkg2-1.0-0')
+            self.assertEqual(path_owner(prefix,
+                                        os.path.join(prefix, 'lib',
+                                                     'pkg1.so')),
+                             'pkg1-1.0-0')
+            self.assertIsNone(path_owner(prefix, 'bin/pkg3'))
+
+    def test_unlink(self):
+        with self.temp_dir() as root:
+            prefix = os.path.join(root, 'env')
+            index_path = self.make_prefix(prefix)
+            index_meta(prefix)
+            unlink(prefix, 'pkg1-1.0-0')
+            self.assertIsNone(path_owner(prefix, 'bin/pkg1'))
+            self.assertTrue(os.path.isfile(index_path))
+            unlink(prefix, 'pkg2-1.0-0')
+            # The index is kept, so later links into the prefix are indexed.
+            self.assertEqual(os.listdir(prefix), ['conda-meta'])
+            self.assertTrue(os.path.isfile(index_path))
+
+    def test_corrupt(self):
+        with self.temp_dir() as prefix:
+            index_path = self.make_prefix(prefix)
+            with open(index_path, 'w') as fh:
+                fh.write('Not a database.')
+            # The JSON files are used instead.
+            self.assertEqual(is_linked(prefix, 'pkg1-1.0-0'),
+                             self.metas['pkg1-1.0-0'])
+            self.assertEqual(path_owner(prefix, 'bin/pkg2'), 'pkg2-1.0-0')
+            unlink(prefix, 'pkg2-1.0-0')
+            self.assertIsNone(is_linked(prefix, 'pkg2-1.0-0'))
+            # Indexing again replaces the unusable index.
+            index_meta(prefix)
+            with patch('json.load') as mload:
+                meta = is_linked(prefix, 'pkg1-1.0-0')
+            self.assertEqual(mload.call_count, 0)
+            self.assertEqual(meta, self.metas['pkg1-1.0-0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import unittest
+
+from mock import patch
+
+import conda_rpms.tests as tests
+from conda_rpms.install import (link, prefix_placeholder, telemetry_env_var,
+                                telemetry_name)
+
+
+class Test_telemetry(tests.CommonTest):
+    def setUp(self):
+        self.dist = 'pkg1-1.0-0'
+        self.script = '#!{}/bin/python\n'.format(prefix_placeholder)
+        self.files = {'lib/data': 'data\n', 'bin/script': self.script}
+
+    def make_pkgs_dir(self, root):
+        pkgs_dir = os.path.join(root, 'pkgs')
+        tests.make_pkg(pkgs_dir, self.dist, self.files,
+                       has_prefix=['bin/script'])
+        return pkgs_dir
+
+    def telemetry_path(self, prefix):
+        return os.path.join(prefix, 'conda-meta', telemetry_name)
+
+    def test_disabled(self):
+        with self.temp_dir() as root:
+            prefix = os.path.join(root, 'env')
+            with patch.dict(os.environ, clear=True):
+                link(self.make_pkgs_dir(root), prefix, self.dist)
+            self.assertFalse(os.path.exists(self.telemetry_path(prefix)))
+
+    def test_enabled(self):
+        with self.temp_dir() as root:
+            prefix = os.path.join(root, 'env')
+            pkgs_dir = self.make_pkgs_dir(root)
+            link(pkgs_dir, prefix, self.dist, target_prefix='/opt/env',
+                 telemetry=True)
+            with patch.dict(os.environ, {telemetry_env_var: '1'}):
+                link(pkgs_dir, prefix, self.dist, target_prefix='/opt/env')
+            with open(self.telemetry_path(prefix)) as fh:
+                records = [json.loads(line) for line in fh]
+        self.assertEqual(len(records), 2)
+        record = records[0]
+        self.assertEqual(record['dist'], self.dist)
+        self.assertEqual(record['files_hard_link'], 1)
+        self.assertEqual(record['files_copy'], 1)
+        self.assertEqual(record['bytes_copied'], len(self.script))
+        self.assertEqual(record['bytes_rewritten'],
+                         len('#!/opt/env/bin/python\n'))
+        for name in ['total', 'pre_link', 'post_link', 'lock_wait',
+                     'update_prefix']:
+            self.assertIn(name + '_seconds', record)
+        self.assertNotIn('failed', record)
+
+
+if __name__ == '__main__':
+    unittest.main()
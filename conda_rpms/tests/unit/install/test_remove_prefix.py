@@ -0,0 +1,81 @@
+import errno
+import os
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.install import (default_trash_dir, reap, remove_prefix,
+                                trash)
+
+
+class Test(tests.CommonTest):
+    def make_prefix(self, prefix):
+        for fname in ['bin/python', 'lib/a.py', 'lib/b/c.py',
+                      'conda-meta/a-1-0.json']:
+            path = os.path.join(prefix, fname)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write('x')
+
+    def test_trash(self):
+        with self.temp_dir() as directory:
+            prefix = os.path.join(directory, 'env')
+            trash_dir = os.path.join(directory, '.trash')
+            self.make_prefix(prefix)
+            trashed = trash(prefix, trash_dir)
+            self.assertFalse(os.path.exists(prefix))
+            self.assertEqual(os.path.dirname(trashed), trash_dir)
+            self.assertTrue(os.path.basename(trashed).startswith('env.'))
+            self.assertTrue(os.path.isfile(os.path.join(trashed, 'lib',
+                                                        'a.py')))
+            # The same name may be trashed again.
+            self.make_prefix(prefix)
+            self.assertNotEqual(trash(prefix, trash_dir), trashed)
+            self.assertIsNone(trash(prefix, trash_dir))
+
+    def test_trash_other_filesystem(self):
+        self.patch('os.rename', side_effect=OSError(errno.EXDEV,
+                                                    'Cross-device link'))
+        with self.temp_dir() as directory:
+            prefix = os.path.join(directory, 'env')
+            self.make_prefix(prefix)
+            self.assertIsNone(trash(prefix, os.path.join(directory,
+                                                         '.trash')))
+            self.assertFalse(os.path.exists(prefix))
+
+    def test_reap(self):
+        with self.temp_dir() as directory:
+            trash_dir = os.path.join(directory, '.trash')
+            for name in ['a', 'b']:
+                prefix = os.path.join(directory, name)
+                self.make_prefix(prefix)
+                trash(prefix, trash_dir)
+            self.assertEqual(reap(trash_dir, processes=2), 2)
+            self.assertEqual(os.listdir(trash_dir), [])
+            self.assertEqual(reap(os.path.join(directory, 'missing')), 0)
+
+    def test_remove_prefix(self):
+        reap_in_background = self.patch(
+            'conda_rpms.install.reap_in_background')
+        with self.temp_dir() as directory:
+            prefix = os.path.join(directory, 'envs', 'env')
+            self.make_prefix(prefix)
+            remove_prefix(prefix)
+            self.assertFalse(os.path.exists(prefix))
+            trash_dir = os.path.join(directory, 'envs', '.trash')
+            self.assertEqual(default_trash_dir(prefix), trash_dir)
+            self.assertEqual(len(os.listdir(trash_dir)), 1)
+            reap_in_background.assert_called_once_with(trash_dir)
+
+    def test_remove_prefix_foreground(self):
+        with self.temp_dir() as directory:
+            prefix = os.path.join(directory, 'env')
+            trash_dir = os.path.join(directory, '.trash')
+            self.make_prefix(prefix)
+            remove_prefix(prefix, trash_dir, background=False)
+            self.assertFalse(os.path.exists(prefix))
+            self.assertEqual(os.listdir(trash_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import sys
+import unittest
+
+from mock import patch
+
+import conda_rpms.install
+import conda_rpms.tests as tests
+from conda_rpms.install import (LINK_COPY, compile_prefix, dedup, is_linked,
+                                link, prefix_placeholder, verify)
+
+
+class Test(tests.CommonTest):
+    def setUp(self):
+        self.dist = 'pkg1-1.0-0'
+        self.files = {'lib/data': 'data\n',
+                      'bin/script': '#!{}/bin/python\n'.format(
+                          prefix_placeholder)}
+
+    def make_env(self, root, linktype=None):
+        pkgs_dir = os.path.join(root, 'pkgs')
+        tests.make_pkg(pkgs_dir, self.dist, self.files,
+                       has_prefix=['bin/script'])
+        prefix = os.path.join(root, 'env')
+        if linktype is None:
+            link(pkgs_dir, prefix, self.dist)
+        else:
+            link(pkgs_dir, prefix, self.dist, linktype)
+        return prefix
+
+    def test_intact(self):
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            self.assertIn('bin/script',
+                          is_linked(prefix, self.dist)['copied_sha256'])
+            self.assertEqual(verify(prefix, processes=2), {})
+
+    def test_broken(self):
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            data = os.path.join(prefix, 'lib', 'data')
+            shutil.copy(data, data + '.tmp')
+            with open(data + '.tmp', 'a') as fh:
+                fh.write('modified\n')
+            os.rename(data + '.tmp', data)
+            with open(os.path.join(prefix, 'bin', 'script'), 'a') as fh:
+                fh.write('# modified\n')
+            broken = verify(prefix, processes=2)
+            self.assertEqual(sorted(broken), ['bin/script', 'lib/data'])
+
+    def test_copied(self):
+        with self.temp_dir() as root:
+            with patch('conda_rpms.install.hash_file',
+                       wraps=conda_rpms.install.hash_file) as mhash:
+                prefix = self.make_env(root, LINK_COPY)
+            # Only the file whose prefix was rewritten is hashed by link.
+            self.assertEqual(mhash.call_count, 1)
+            self.assertEqual(list(is_linked(prefix, self.dist)['copied_sha256']),
+                             ['bin/script'])
+            self.assertEqual(verify(prefix), {})
+            # The other copied files are compared with the package's.
+            with open(os.path.join(prefix, 'lib', 'data'), 'a') as fh:
+                fh.write('modified\n')
+            self.assertEqual(list(verify(prefix)), ['lib/data'])
+            self.assertEqual(verify(prefix, repair=True), {})
+
+    def test_compiled(self):
+        self.files['lib/python/site-packages/mod.py'] = 'x = 1\n'
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            os.symlink(sys.executable, os.path.join(prefix, 'bin', 'python'))
+            compile_prefix(prefix)
+            compiled = is_linked(prefix, self.dist)['compiled']
+            self.assertEqual(len(compiled), 1)
+            # The bytecode has no package file to relink from, so isn't
+            # verified (or repaired).
+            os.unlink(os.path.join(prefix, compiled[0]))
+            self.assertEqual(verify(prefix), {})
+            self.assertEqual(verify(prefix, repair=True), {})
+
+    def test_dedup(self):
+        # dedup swaps the package's file for a link to an identical file of
+        # another package, which the linked file is then no longer a hard
+        # link to.
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            pkgs_dir = os.path.join(root, 'pkgs')
+            other = os.path.join(pkgs_dir, 'a-other-1.0-0')
+            shutil.copytree(os.path.join(pkgs_dir, self.dist), other)
+            self.assertGreater(dedup(pkgs_dir), 0)
+            data = os.path.join(prefix, 'lib', 'data')
+            self.assertNotEqual(
+                os.stat(data).st_ino,
+                os.stat(os.path.join(pkgs_dir, self.dist, 'lib',
+                                     'data')).st_ino)
+            self.assertEqual(verify(prefix), {})
+
+    def test_missing(self):
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            os.unlink(os.path.join(prefix, 'lib', 'data'))
+            self.assertEqual(verify(prefix), {'lib/data': 'missing'})
+
+    def test_repair(self):
+        with self.temp_dir() as root:
+            prefix = self.make_env(root)
+            script = os.path.join(prefix, 'bin', 'script')
+            os.unlink(os.path.join(prefix, 'lib', 'data'))
+            with open(script, 'w') as fh:
+                fh.write('modified\n')
+            self.assertEqual(verify(prefix, repair=True), {})
+            self.assertEqual(verify(prefix), {})
+            with open(script) as fh:
+                self.assertEqual(fh.read(),
+                                 '#!{}/bin/python\n'.format(prefix))
+
+
+if __name__ == '__main__':
+    unittest.main()
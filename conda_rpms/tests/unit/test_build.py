@@ -1,7 +1,13 @@
+import json
+import os
+import subprocess
 import textwrap
 import unittest
 
-from conda_rpms.build import name_version_release
+from conda_rpms.artifact_cache import DirectoryCache
+from conda_rpms.build import (artifact_key, build_new, name_version_release,
+                              planned_specs, rpm_names, spec_sources)
+import conda_rpms.tests as tests
 
 
 class Test_name_version_release(unittest.TestCase):
@@ -38,5 +44,194 @@ class Test_name_version_release(unittest.TestCase):
         self._check_output(spec)
 
 
+class Test_rpm_names(unittest.TestCase):
+    def test_single(self):
+        spec = ['Name: foo\n', 'Version: 1\n', 'Release: 2\n']
+        self.assertEqual(rpm_names(spec), ['foo-1-2.x86_64.rpm'])
+
+    def test_subpackages(self):
+        spec = ['Name: batch\n', 'Version: 1\n', 'Release: 0\n',
+                '%package -n foo\n', '%package -n bar\n']
+        self.assertEqual(rpm_names(spec), ['foo-1-0.x86_64.rpm',
+                                           'bar-1-0.x86_64.rpm'])
+
+
+class Test_spec_sources(tests.CommonTest):
+    def test_sources(self):
+        with self.temp_dir() as directory:
+            spec_path = os.path.join(directory, 'a.spec')
+            with open(spec_path, 'w') as fh:
+                fh.write('Name: a\nSource0:        a-1-0.tar\n'
+                         'Source1: install.py\nSummary: Sources\n')
+            self.assertEqual(spec_sources(spec_path),
+                             ['a-1-0.tar', 'install.py'])
+
+
+class Test_artifact_key(tests.CommonTest):
+    def make(self, rpmbuild_dir, spec='Name: a\nSource0: a.tar\n',
+             source='a'):
+        for dirname in ['SPECS', 'SOURCES']:
+            if not os.path.isdir(os.path.join(rpmbuild_dir, dirname)):
+                os.makedirs(os.path.join(rpmbuild_dir, dirname))
+        spec_path = os.path.join(rpmbuild_dir, 'SPECS', 'a.spec')
+        with open(spec_path, 'w') as fh:
+            fh.write(spec)
+        with open(os.path.join(rpmbuild_dir, 'SOURCES', 'a.tar'), 'w') as fh:
+            fh.write(source)
+        return artifact_key(spec_path, os.path.join(rpmbuild_dir, 'SOURCES'))
+
+    def test_changes(self):
+        with self.temp_dir() as rpmbuild_dir:
+            key = self.make(rpmbuild_dir)
+            self.assertEqual(self.make(rpmbuild_dir), key)
+            self.assertNotEqual(self.make(rpmbuild_dir, source='b'), key)
+            self.assertNotEqual(
+                self.make(rpmbuild_dir, spec='Name: b\nSource0: a.tar\n'),
+                key)
+
+    def test_missing_source(self):
+        with self.temp_dir() as rpmbuild_dir:
+            self.make(rpmbuild_dir)
+            os.remove(os.path.join(rpmbuild_dir, 'SOURCES', 'a.tar'))
+            self.assertIsNone(artifact_key(
+                os.path.join(rpmbuild_dir, 'SPECS', 'a.spec'),
+                os.path.join(rpmbuild_dir, 'SOURCES')))
+
+
+class Test_build_new(tests.CommonTest):
+    def setUp(self):
+        self.rpmbuild = self.patch('conda_rpms.build.rpmbuild',
+                                   side_effect=self._rpmbuild)
+        self.returncodes = {}
+
+    def _rpmbuild(self, spec_path, rpmbuild_dir, log_path=None):
+        name = os.path.basename(spec_path)[:-5]
+        returncode = self.returncodes.get(name, 0)
+        if returncode == 0:
+            rpm_dir = os.path.join(rpmbuild_dir, 'RPMS', 'x86_64')
+            if not os.path.isdir(rpm_dir):
+                os.makedirs(rpm_dir)
+            with open(os.path.join(rpm_dir, name + '-1-0.x86_64.rpm'),
+                      'w') as fh:
+                fh.write('rpm')
+        return returncode
+
+    def make_specs(self, rpmbuild_dir, names):
+        spec_dir = os.path.join(rpmbuild_dir, 'SPECS')
+        os.makedirs(spec_dir)
+        for name in names:
+            with open(os.path.join(spec_dir, name + '.spec'), 'w') as fh:
+                fh.write('Name: {}\nVersion: 1\nRelease: 0\n'.format(name))
+
+    def test_report(self):
+        with self.temp_dir() as rpmbuild_dir:
+            self.make_specs(rpmbuild_dir, ['a', 'b'])
+            rpm_dir = os.path.join(rpmbuild_dir, 'repo')
+            os.makedirs(rpm_dir)
+            open(os.path.join(rpm_dir, 'a-1-0.x86_64.rpm'), 'w').close()
+            report_path = os.path.join(rpmbuild_dir, 'report.json')
+            log_dir = os.path.join(rpmbuild_dir, 'LOGS')
+            build_new(rpmbuild_dir, rpm_dir, log_dir=log_dir,
+                      report_path=report_path)
+            with open(report_path) as fh:
+                report = json.load(fh)
+        a, b = report['specs']
+        self.assertEqual((a['spec'], a['status'], a['log']),
+                         ('a.spec', 'skipped', None))
+        self.assertEqual((b['spec'], b['status'], b['returncode'],
+                          b['rpm_size']), ('b.spec', 'built', 0, 3))
+        self.assertEqual(b['log'], os.path.join(log_dir, 'b.log'))
+        self.assertEqual(self.rpmbuild.call_count, 1)
+        self.assertEqual(report['summary']['built'], 1)
+        self.assertEqual(report['summary']['skipped'], 1)
+
+    def test_batch(self):
+        with self.temp_dir() as rpmbuild_dir:
+            spec_dir = os.path.join(rpmbuild_dir, 'SPECS')
+            os.makedirs(spec_dir)
+            with open(os.path.join(spec_dir, 'batch.spec'), 'w') as fh:
+                fh.write('Name: batch\nVersion: 1\nRelease: 0\n'
+                         '%package -n a\n%package -n b\n')
+            rpm_dir = os.path.join(rpmbuild_dir, 'repo')
+            os.makedirs(rpm_dir)
+            open(os.path.join(rpm_dir, 'a-1-0.x86_64.rpm'), 'w').close()
+            result, = build_new(rpmbuild_dir, rpm_dir)
+            self.assertEqual(result['status'], 'built')
+            self.assertEqual(result['rpms'], ['a-1-0.x86_64.rpm',
+                                              'b-1-0.x86_64.rpm'])
+            open(os.path.join(rpm_dir, 'b-1-0.x86_64.rpm'), 'w').close()
+            result, = build_new(rpmbuild_dir, rpm_dir)
+            self.assertEqual(result['status'], 'skipped')
+
+    def test_plan(self):
+        with self.temp_dir() as rpmbuild_dir:
+            self.make_specs(rpmbuild_dir, ['a', 'b', 'c'])
+            plan_path = os.path.join(rpmbuild_dir, 'plan.json')
+            with open(plan_path, 'w') as fh:
+                json.dump({'specs': [{'spec': 'c.spec', 'action': 'create'},
+                                     {'spec': 'a.spec', 'action': 'update'}],
+                           'fetch': [], 'orphaned': ['b.spec']}, fh)
+            results = build_new(rpmbuild_dir, rpmbuild_dir,
+                                specs=planned_specs(plan_path))
+        self.assertEqual([result['spec'] for result in results],
+                         ['a.spec', 'c.spec'])
+        self.assertEqual(self.rpmbuild.call_count, 2)
+
+    def test_artifact_cache(self):
+        with self.temp_dir() as directory:
+            cache = DirectoryCache(os.path.join(directory, 'cache'))
+            hosts = [os.path.join(directory, host) for host in ['a', 'b']]
+            for rpmbuild_dir in hosts:
+                self.make_specs(rpmbuild_dir, ['a'])
+            results = [build_new(rpmbuild_dir, rpmbuild_dir, cache=cache)
+                       for rpmbuild_dir in hosts]
+            self.assertEqual([result['status'] for result, in results],
+                             ['built', 'cached'])
+            self.assertEqual(results[1][0]['rpm_size'], 3)
+            self.assertTrue(os.path.exists(os.path.join(
+                hosts[1], 'RPMS', 'x86_64', 'a-1-0.x86_64.rpm')))
+        self.assertEqual(self.rpmbuild.call_count, 1)
+
+    def test_plan_missing_spec(self):
+        with self.temp_dir() as rpmbuild_dir:
+            self.make_specs(rpmbuild_dir, ['a', 'c'])
+            rpm_dir = os.path.join(rpmbuild_dir, 'RPMS', 'x86_64')
+            report_path = os.path.join(rpmbuild_dir, 'report.json')
+            specs = ['a.spec', 'b.spec', 'c.spec']
+            with self.assertRaises(IOError):
+                build_new(rpmbuild_dir, rpm_dir, specs=specs,
+                          report_path=report_path)
+            with open(report_path) as fh:
+                report = json.load(fh)
+            self.assertEqual([spec['status'] for spec in report['specs']],
+                             ['built', 'missing'])
+            results = build_new(rpmbuild_dir, rpm_dir, specs=specs,
+                                keep_going=True)
+        self.assertEqual([result['status'] for result in results],
+                         ['skipped', 'missing', 'built'])
+
+    def test_failure(self):
+        self.returncodes['a'] = 1
+        with self.temp_dir() as rpmbuild_dir:
+            self.make_specs(rpmbuild_dir, ['a', 'b'])
+            report_path = os.path.join(rpmbuild_dir, 'report.json')
+            with self.assertRaises(subprocess.CalledProcessError):
+                build_new(rpmbuild_dir, rpmbuild_dir,
+                          report_path=report_path)
+            with open(report_path) as fh:
+                report = json.load(fh)
+        self.assertEqual([spec['status'] for spec in report['specs']],
+                         ['failed'])
+
+    def test_keep_going(self):
+        self.returncodes['a'] = 1
+        with self.temp_dir() as rpmbuild_dir:
+            self.make_specs(rpmbuild_dir, ['a', 'b'])
+            results = build_new(rpmbuild_dir, rpmbuild_dir, keep_going=True)
+        self.assertEqual([result['status'] for result in results],
+                         ['failed', 'built'])
+        self.assertEqual(results[0]['returncode'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
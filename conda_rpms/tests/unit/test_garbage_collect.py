@@ -0,0 +1,179 @@
+import os
+import time
+import unittest
+
+from conda_rpms.benchmarks import synthetic
+from conda_rpms.garbage_collect import collect, live_files
+import conda_rpms.tests as tests
+
+
+class Test_collect(tests.CommonTest):
+    def make_target(self, directory):
+        files = ['SPECS/live.spec', 'SPECS/dead.spec',
+                 'SOURCES/live.tar.bz2', 'SOURCES/dead.tar.bz2',
+                 'SOURCES/dead.tar', 'SOURCES/dead.tar.md5',
+                 'SOURCES/install.py',
+                 'RPMS/x86_64/live-1-0.x86_64.rpm',
+                 'RPMS/x86_64/dead-1-0.x86_64.rpm',
+                 'repo/dead-1-0.x86_64.rpm']
+        for fname in files:
+            path = os.path.join(directory, fname)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write('1234')
+        return ({directory: set(['live.spec'])}, set(['live.tar.bz2']),
+                {directory: set(['live-1-0.x86_64.rpm'])})
+
+    def remaining(self, directory):
+        return sorted(os.path.relpath(os.path.join(root, fname), directory)
+                      for root, _, fnames in os.walk(directory)
+                      for fname in fnames)
+
+    def test_remove(self):
+        with self.temp_dir() as directory:
+            live = self.make_target(directory)
+            report = collect(directory, live,
+                             rpm_dirs=[os.path.join(directory, 'repo')])
+            self.assertEqual(self.remaining(directory),
+                             ['RPMS/x86_64/live-1-0.x86_64.rpm',
+                              'SOURCES/install.py', 'SOURCES/live.tar.bz2',
+                              'SPECS/live.spec'])
+        self.assertEqual(report['SOURCES']['bytes'], 12)
+        self.assertEqual(report['RPMS']['bytes'], 8)
+        self.assertEqual(report['SPECS']['bytes'], 4)
+
+    def test_archive(self):
+        with self.temp_dir() as directory:
+            live = self.make_target(directory)
+            archive = os.path.join(directory, 'archive')
+            collect(directory, live, archive=archive)
+            self.assertEqual(sorted(os.listdir(os.path.join(archive,
+                                                            'SOURCES'))),
+                             ['dead.tar', 'dead.tar.bz2', 'dead.tar.md5'])
+            self.assertEqual(os.listdir(os.path.join(archive, 'RPMS')),
+                             ['dead-1-0.x86_64.rpm'])
+            # The repo directory wasn't given, so is left alone.
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, 'repo', 'dead-1-0.x86_64.rpm')))
+
+    def test_dry_run(self):
+        with self.temp_dir() as directory:
+            live = self.make_target(directory)
+            before = self.remaining(directory)
+            report = collect(directory, live, dry_run=True)
+            self.assertEqual(self.remaining(directory), before)
+        self.assertEqual(report['SPECS']['files'],
+                         [os.path.join(directory, 'SPECS', 'dead.spec')])
+
+    def test_retention(self):
+        with self.temp_dir() as directory:
+            live = self.make_target(directory)
+            old = time.time() - 3 * 24 * 60 * 60
+            dead_spec = os.path.join(directory, 'SPECS', 'dead.spec')
+            os.utime(dead_spec, (old, old))
+            report = collect(directory, live, retention_days=1)
+        self.assertEqual(report['SPECS']['files'], [dead_spec])
+        self.assertEqual(report['SOURCES']['files'], [])
+
+    def test_targets(self):
+        with self.temp_dir() as directory:
+            for fname in ['a/SPECS/A-live.spec', 'a/SPECS/A-dead.spec',
+                          'a/RPMS/x86_64/A-live-1-0.x86_64.rpm',
+                          'b/SPECS/B-live.spec',
+                          'b/RPMS/x86_64/A-live-1-0.x86_64.rpm',
+                          'SOURCES/live.tar', 'SOURCES/dead.tar']:
+                path = os.path.join(directory, fname)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as fh:
+                    fh.write('1234')
+            a, b = [os.path.join(directory, name) for name in 'ab']
+            live = ({a: set(['A-live.spec']), b: set(['B-live.spec'])},
+                    set(['live.tar']),
+                    {a: set(['A-live-1-0.x86_64.rpm']), b: set()})
+            report = collect(directory, live)
+        self.assertEqual(report['SPECS']['files'],
+                         [os.path.join(a, 'SPECS', 'A-dead.spec')])
+        self.assertEqual(report['RPMS']['files'],
+                         [os.path.join(b, 'RPMS', 'x86_64',
+                                       'A-live-1-0.x86_64.rpm')])
+        self.assertEqual(report['SOURCES']['files'],
+                         [os.path.join(directory, 'SOURCES', 'dead.tar')])
+
+
+class Test_live_files(tests.CommonTest):
+    def setUp(self):
+        self.config = {'rpm': {'prefix': 'Prefix'},
+                       'install': {'prefix': '/opt/prefix'}}
+
+    def make_repo(self, directory):
+        from conda_gitenv.resolve import create_tracking_branches
+        from git import Repo
+
+        url, dists = synthetic.make_channel(
+            os.path.join(directory, 'channel'), n_dists=4, n_files=1)
+        # Of the 3 tags, only the last two are labelled.
+        synthetic.make_gitenv(os.path.join(directory, 'gitenv'), url,
+                              dists, n_envs=1, n_tags=3, dists_per_env=2)
+        repo = Repo.clone_from(os.path.join(directory, 'gitenv'),
+                               os.path.join(directory, 'clone'))
+        create_tracking_branches(repo)
+        return repo, dists
+
+    def test_live(self):
+        with self.temp_dir() as directory:
+            repo, dists = self.make_repo(directory)
+            target = os.path.join(directory, 'rpmbuild')
+            os.makedirs(os.path.join(target, 'SPECS'))
+            specs, sources, rpms = live_files([repo], target, self.config)
+            self.assertEqual(list(specs), [target])
+            specs = specs[target]
+            self.assertNotIn('Prefix-env-env0-tag-2000_01_01.spec', specs)
+            self.assertIn('Prefix-env-env0-tag-2001_01_01.spec', specs)
+            self.assertIn('Prefix-env-env0-label-current.spec', specs)
+            # The first tag has pkg0 and pkg1, the others pkg1 to pkg3.
+            self.assertNotIn(dists[0] + '.tar.bz2', sources)
+            self.assertIn(dists[3] + '.tar.bz2', sources)
+
+            specs, sources, rpms = live_files([repo], target, self.config,
+                                              retention_days=1)
+            self.assertIn('Prefix-env-env0-tag-2000_01_01.spec',
+                          specs[target])
+            self.assertIn(dists[0] + '.tar.bz2', sources)
+
+    def test_targets(self):
+        config = dict(self.config, targets={'a': {'rpm': {'prefix': 'A'}},
+                                            'b': {'rpm': {'prefix': 'B'}}})
+        with self.temp_dir() as directory:
+            repo, dists = self.make_repo(directory)
+            target = os.path.join(directory, 'rpmbuild')
+            for name in ['A', 'B']:
+                spec_dir = os.path.join(target, name.lower(), 'SPECS')
+                os.makedirs(spec_dir)
+                # Each target recompresses the distribution differently.
+                fname = '{}-pkg-{}.spec'.format(name, dists[3])
+                with open(os.path.join(spec_dir, fname), 'w') as fh:
+                    fh.write('Name: {}-pkg-{}\nVersion: 1\nRelease: 0\n'
+                             'Source0: {}.tar.{}\n'.format(
+                                 name, dists[3], dists[3],
+                                 'gz' if name == 'A' else 'bz2'))
+            specs, sources, rpms = live_files([repo], target, config)
+        a, b = [os.path.join(target, name) for name in 'ab']
+        self.assertEqual(sorted(specs), [a, b])
+        self.assertIn('A-env-env0-tag-2001_01_01.spec', specs[a])
+        self.assertNotIn('Prefix-env-env0-tag-2001_01_01.spec', specs[a])
+        self.assertIn('B-env-env0-label-current.spec', specs[b])
+        self.assertIn('B-installer.spec', specs[b])
+        self.assertEqual(rpms[a], set(['A-pkg-{}-1-0.x86_64.rpm'.format(
+            dists[3])]))
+        self.assertEqual(rpms[b], set(['B-pkg-{}-1-0.x86_64.rpm'.format(
+            dists[3])]))
+        self.assertIn(dists[3] + '.tar.gz', sources)
+        self.assertIn(dists[3] + '.tar.gz.md5', sources)
+        # Nothing is created by looking.
+        self.assertFalse(os.path.exists(os.path.join(target, 'SOURCES')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import unittest
+
+from mock import patch
+
+from conda_rpms.benchmarks.synthetic import make_dist
+import conda_rpms.generate as generate
+import conda_rpms.tests as tests
+
+
+class Test_render_many(tests.CommonTest):
+    def setUp(self):
+        self.config = {'rpm': {'prefix': 'Prefix'},
+                       'install': {'prefix': '/opt/prefix'}}
+
+    def make_dists(self, directory):
+        return [os.path.join(directory,
+                             make_dist(directory, name, n_files=1) +
+                             '.tar.bz2')
+                for name in ['pkg1', 'pkg2', 'pkg3']]
+
+    def _check(self, processes):
+        with self.temp_dir() as directory:
+            dists = self.make_dists(directory)
+            result = list(generate.render_many(iter(dists), self.config,
+                                               processes=processes))
+            expected = [(dist, generate.render_dist_spec(dist, self.config))
+                        for dist in dists]
+        self.assertEqual(result, expected)
+        self.assertIn('Name:           Prefix-pkg-pkg2-1.0-0', result[1][1])
+
+    def test_serial(self):
+        self._check(processes=1)
+
+    def test_parallel(self):
+        self._check(processes=2)
+
+
+class Test_render_dist_spec(tests.CommonTest):
+    def render(self, **rpm_config):
+        rpm_config['prefix'] = 'Prefix'
+        config = {'rpm': rpm_config, 'install': {'prefix': '/opt/prefix'}}
+        with self.temp_dir() as directory:
+            dist = os.path.join(directory,
+                                make_dist(directory, 'pkg1', n_files=1) +
+                                '.tar.bz2')
+            return generate.render_dist_spec(dist, config)
+
+    def test_copy(self):
+        spec = self.render()
+        self.assertIn('%setup -q -c\n', spec)
+        self.assertIn('cp -rf $SOURCE_DIR/* $BUILD_PREFIX/\n', spec)
+        self.assertIn('Source0:        pkg1-1.0-0.tar.bz2\n', spec)
+
+    def test_link(self):
+        spec = self.render(install_strategy='link')
+        self.assertIn('%setup -q -c\n', spec)
+        self.assertIn('cp -al $SOURCE_DIR/. $BUILD_PREFIX/\n', spec)
+        self.assertNotIn('cp -rf', spec)
+
+    def test_extract(self):
+        spec = self.render(install_strategy='extract', source_format='tar')
+        self.assertIn('%setup -q -c -T\n', spec)
+        self.assertIn('tar -xf %{SOURCE0} -C $BUILD_PREFIX\n', spec)
+        self.assertIn('Source0:        pkg1-1.0-0.tar\n', spec)
+        self.assertNotIn('cp -', spec)
+
+    def test_default_payload(self):
+        self.assertNotIn('_binary_payload', self.render())
+
+    def test_payload(self):
+        payload = {'large_size': 1, 'small': 'w9.xzdio', 'large': 'w1.gzdio'}
+        spec = self.render(payload=payload)
+        self.assertIn('%define _binary_payload w1.gzdio\n', spec)
+        self.assertIn('%define _source_payload w1.gzdio\n', spec)
+        payload['large_size'] = 2 ** 40
+        spec = self.render(payload=payload)
+        self.assertIn('%define _binary_payload w9.xzdio\n', spec)
+
+    def test_invalid_payload(self):
+        with self.assertRaisesRegexp(ValueError, 'Invalid rpm payload'):
+            self.render(payload={'small': 'xz'})
+
+    def test_unknown_strategy(self):
+        with self.assertRaisesRegexp(ValueError, 'Unknown install strategy'):
+            self.render(install_strategy='move')
+
+
+class Test_render_batch_spec(tests.CommonTest):
+    def test_subpackages(self):
+        config = {'rpm': {'prefix': 'Prefix'},
+                  'install': {'prefix': '/opt/prefix'}}
+        with self.temp_dir() as directory:
+            dists = [os.path.join(directory,
+                                  make_dist(directory, name, n_files=1) +
+                                  '.tar.bz2')
+                     for name in ['pkg1', 'pkg2']]
+            spec = generate.render_batch_spec(dists, config, 'abc')
+        self.assertIn('Name:           Prefix-pkgs-abc\n', spec)
+        for index, name in enumerate(['pkg1', 'pkg2']):
+            pkg_id = name + '-1.0-0'
+            self.assertIn('Source{}:        {}.tar.bz2\n'.format(index,
+                                                                 pkg_id), spec)
+            self.assertIn('%package -n Prefix-pkg-{}\n'.format(pkg_id), spec)
+            self.assertIn('%files -n Prefix-pkg-{}\n'
+                          '/opt/prefix/.pkgs/{}\n'.format(pkg_id, pkg_id),
+                          spec)
+            self.assertIn('tar -xf %{{SOURCE{}}} -C $RPM_BUILD_ROOT'
+                          '$INSTALL_PREFIX/{}\n'.format(index, pkg_id), spec)
+        # Each subpackage's preamble (up to its %description) turns off
+        # AutoReqProv, as it isn't inherited from the main package.
+        subpackages = spec.split('%package -n ')[1:]
+        self.assertEqual(len(subpackages), 2)
+        for subpackage in subpackages:
+            preamble = subpackage.split('%description')[0]
+            self.assertIn('AutoReqProv: no\n', preamble)
+
+
+class Test_render_installer(tests.CommonTest):
+    def render(self, **install):
+        install['prefix'] = '/opt/prefix'
+        config = {'rpm': {'prefix': 'Prefix'}, 'install': install}
+        pkg_info = {'version': '2.7.11', 'build': '0'}
+        return generate.render_installer(pkg_info, config)
+
+    def test_dedup(self):
+        spec = self.render(dedup_pkgs=True)
+        self.assertIn('%posttrans\n', spec)
+        self.assertIn('install.py --pkgs-dir /opt/prefix/.pkgs --dedup', spec)
+        # The environments don't deduplicate the package cache themselves.
+        taggedenv = generate.render_taggedenv(
+            'env', 'tag', ['a-1-0'], {'rpm': {'prefix': 'Prefix'},
+                                      'install': {'prefix': '/opt/prefix',
+                                                  'dedup_pkgs': True}}, [])
+        self.assertNotIn('--dedup', taggedenv)
+
+    def test_no_dedup(self):
+        spec = self.render()
+        self.assertNotIn('%posttrans', spec)
+        self.assertNotIn('--dedup', spec)
+
+
+class Test_read_dist_info(tests.CommonTest):
+    def test_cached(self):
+        with self.temp_dir() as directory:
+            dist = os.path.join(directory,
+                                make_dist(directory, 'pkg1', n_files=1) +
+                                '.tar.bz2')
+            with patch('conda_rpms.generate._dist_info_cache', {}):
+                info = generate.read_dist_info(dist)
+                with patch('tarfile.open') as mopen:
+                    self.assertIs(generate.read_dist_info(dist), info)
+                self.assertEqual(mopen.call_count, 0)
+                # A changed tarball is read again.
+                os.utime(dist, (0, 0))
+                changed = generate.read_dist_info(dist)
+                self.assertIsNot(changed, info)
+                # As is any tarball, once the cache is cleared.
+                generate.clear_dist_info_cache()
+                self.assertIsNot(generate.read_dist_info(dist), changed)
+
+
+class Test_environment(tests.CommonTest):
+    def test_bytecode_cache(self):
+        with self.temp_dir() as directory:
+            cache_dir = os.path.join(directory, 'cache')
+            env = {generate.bytecode_cache_env_var: cache_dir}
+            with patch.dict(os.environ, env), \
+                    patch('conda_rpms.generate._environment', None):
+                generate.get_template('pkg.spec.template')
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_no_bytecode_cache(self):
+        with patch.dict(os.environ, clear=True), \
+                patch('conda_rpms.generate._environment', None):
+            self.assertIsNone(generate.environment().bytecode_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
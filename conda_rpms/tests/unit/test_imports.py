@@ -0,0 +1,27 @@
+import unittest
+
+from conda_rpms.benchmarks.suite import measure_import
+
+
+class Test_lazy_imports(unittest.TestCase):
+    # Importing these modules must not import conda, conda_gitenv, git,
+    # jinja2 or yaml, which are slow to import.
+    def _check(self, module):
+        seconds, heavy = measure_import(module)
+        self.assertEqual(heavy, [])
+
+    def test_build(self):
+        self._check('conda_rpms.build')
+
+    def test_generate(self):
+        self._check('conda_rpms.generate')
+
+    def test_install(self):
+        self._check('conda_rpms.install')
+
+    def test_build_rpm_structure(self):
+        self._check('conda_rpms.build_rpm_structure')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import stat
+import unittest
+
+import conda_rpms.tests as tests
+import conda_rpms.repodata as repodata
+
+
+class Test_find_createrepo(tests.CommonTest):
+    def make_command(self, directory, name):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as fh:
+            fh.write('#!/bin/sh\n')
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def test_preference(self):
+        with self.temp_dir() as first, self.temp_dir() as second:
+            self.make_command(first, 'createrepo')
+            createrepo_c = self.make_command(second, 'createrepo_c')
+            self.patch('os.environ',
+                       {'PATH': os.pathsep.join([first, second])})
+            self.assertEqual(repodata.find_createrepo(), createrepo_c)
+
+    def test_missing(self):
+        with self.temp_dir() as directory:
+            # Not executable.
+            open(os.path.join(directory, 'createrepo'), 'w').close()
+            self.patch('os.environ', {'PATH': directory})
+            with self.assertRaisesRegexp(RuntimeError, 'createrepo_c'):
+                repodata.find_createrepo()
+
+
+class Test_update(tests.CommonTest):
+    def test(self):
+        call = self.patch('subprocess.call', return_value=0)
+        with self.temp_dir() as rpm_dir:
+            self.assertEqual(repodata.update(rpm_dir,
+                                             command='createrepo_c'), 0)
+        call.assert_called_once_with(
+            ['createrepo_c', '--update', '--cachedir',
+             os.path.join(rpm_dir, '.repodata-cache'), rpm_dir])
+
+    def test_cache_dir(self):
+        call = self.patch('subprocess.call', return_value=1)
+        self.patch('conda_rpms.repodata.find_createrepo',
+                   return_value='/usr/bin/createrepo')
+        self.assertEqual(repodata.update('rpms', cache_dir='cache'), 1)
+        call.assert_called_once_with(
+            ['/usr/bin/createrepo', '--update', '--cachedir',
+             os.path.abspath('cache'), 'rpms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from mock import patch
+
+from conda_rpms.stats import Stats
+
+
+class Test_Stats(unittest.TestCase):
+    def test_timer(self):
+        stats = Stats()
+        with patch('conda_rpms.stats.default_timer', side_effect=[1, 3, 4, 5]):
+            with stats.timer('fetch'):
+                pass
+            with stats.timer('fetch'):
+                pass
+        self.assertEqual(stats.timings, {'fetch': [2, 3.0]})
+
+    def test_timer_exception(self):
+        stats = Stats()
+        with self.assertRaises(ValueError):
+            with stats.timer('render'):
+                raise ValueError()
+        self.assertEqual(stats.timings['render'][0], 1)
+
+    def test_counters(self):
+        stats = Stats()
+        stats.count('bytes_downloaded', 10)
+        stats.count('bytes_downloaded', 5)
+        stats.count('cache_hits')
+        stats.count('cache_hits')
+        stats.count('cache_hits')
+        stats.count('cache_misses')
+        result = stats.as_dict()
+        self.assertEqual(result['counters'],
+                         {'bytes_downloaded': 15, 'cache_hits': 3,
+                          'cache_misses': 1})
+        self.assertEqual(result['hit_rates'], {'cache': 0.75})
+
+    def test_only_misses(self):
+        stats = Stats()
+        stats.count('cache_misses', 2)
+        self.assertEqual(stats.hit_rates(), {'cache': 0.0})
+
+    def test_summary(self):
+        stats = Stats()
+        with stats.timer('clone'):
+            pass
+        stats.count('cache_hits')
+        summary = stats.summary()
+        self.assertIn('clone', summary)
+        self.assertIn('cache hit rate', summary)
+        self.assertIn('100.0%', summary)
+
+    def test_reset(self):
+        stats = Stats()
+        stats.count('cache_hits')
+        stats.reset()
+        self.assertEqual(stats.as_dict(), {'timings': {}, 'counters': {},
+                                           'hit_rates': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
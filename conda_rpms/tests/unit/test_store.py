@@ -0,0 +1,121 @@
+import hashlib
+import os
+import unittest
+
+import conda_rpms.tests as tests
+from conda_rpms.store import PackageStore, hash_tarball
+
+
+class Test(tests.CommonTest):
+    def write(self, store, dist, content=b'data'):
+        with open(store.path(dist), 'wb') as fh:
+            fh.write(content)
+
+    def pkg_info(self, content=b'data'):
+        return {'md5': hashlib.md5(content).hexdigest(),
+                'sha256': hashlib.sha256(content).hexdigest(),
+                'size': len(content)}
+
+    def test_hash_tarball(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0')
+            self.assertEqual(hash_tarball(store.path('a-1-0')),
+                             (self.pkg_info()['md5'],
+                              self.pkg_info()['sha256']))
+
+    def test_add_and_check(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0')
+            store.add('a-1-0', self.pkg_info())
+            store.save()
+            store = PackageStore(sources)
+            self.assertEqual(store.records['a-1-0']['md5'],
+                             self.pkg_info()['md5'])
+            self.assertTrue(store.check('a-1-0', self.pkg_info()))
+            # The channel's distribution has since changed.
+            self.assertFalse(store.check('a-1-0', self.pkg_info(b'new')))
+
+    def test_add_corrupt(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0', b'truncated')
+            with self.assertRaisesRegexp(ValueError, 'a-1-0 is corrupt'):
+                store.add('a-1-0', self.pkg_info())
+            self.assertFalse(os.path.exists(store.path('a-1-0')))
+            self.assertNotIn('a-1-0', store.records)
+
+    def test_check_unchanged_is_not_hashed(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0')
+            store.add('a-1-0')
+            hash_tarball = self.patch('conda_rpms.store.hash_tarball')
+            self.assertTrue(store.check('a-1-0'))
+            self.assertEqual(hash_tarball.call_count, 0)
+
+    def test_check_modified(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0')
+            store.add('a-1-0')
+            os.remove(store.path('a-1-0'))
+            self.write(store, 'a-1-0', b'dat!')
+            self.assertFalse(store.check('a-1-0'))
+            self.assertNotIn('a-1-0', store.records)
+
+    def test_check_unrecorded(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.assertFalse(store.check('a-1-0'))
+            self.write(store, 'a-1-0')
+            self.assertTrue(store.check('a-1-0', self.pkg_info()))
+            self.assertIn('a-1-0', store.records)
+
+    def test_dedup(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0')
+            self.write(store, 'b-1-0')
+            store.add('a-1-0')
+            store.add('b-1-0')
+            self.assertTrue(os.path.samefile(store.path('a-1-0'),
+                                             store.path('b-1-0')))
+            self.assertEqual(os.stat(store.path('a-1-0')).st_nlink, 3)
+            self.assertTrue(store.check('a-1-0'))
+            self.assertTrue(store.check('b-1-0'))
+
+    def test_verify(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            for dist in ['a-1-0', 'b-1-0', 'c-1-0']:
+                self.write(store, dist, dist.encode('ascii'))
+                store.add(dist)
+            # Corrupted in place, without changing its size or stat.
+            st = os.stat(store.path('b-1-0'))
+            with open(store.path('b-1-0'), 'r+b') as fh:
+                fh.write(b'x')
+            os.utime(store.path('b-1-0'), (st.st_atime, st.st_mtime))
+            os.remove(store.path('c-1-0'))
+            self.assertEqual(store.verify(processes=2), ['b-1-0', 'c-1-0'])
+            self.assertEqual(sorted(store.records), ['a-1-0'])
+
+    def test_prune(self):
+        with self.temp_dir() as sources:
+            store = PackageStore(sources)
+            self.write(store, 'a-1-0', b'a')
+            self.write(store, 'b-1-0', b'bb')
+            store.add('a-1-0')
+            store.add('b-1-0')
+            os.remove(store.path('b-1-0'))
+            self.assertEqual(store.prune(), 2)
+            self.assertEqual(sorted(store.records), ['a-1-0'])
+            self.assertFalse(os.path.exists(
+                store.object_path(self.pkg_info(b'bb')['sha256'])))
+            self.assertTrue(os.path.exists(
+                store.object_path(self.pkg_info(b'a')['sha256'])))
+
+
+if __name__ == '__main__':
+    unittest.main()